@@ -35,6 +35,45 @@ function json_response(int $code, $payload, array $headers = []): void {
   exit;
 }
 
+// Публичный JSON с валидаторами: ETag по содержимому, Last-Modified по файлам-источникам.
+// If-None-Match / If-Modified-Since совпали — 304 без тела. Окно кэша — PUBLIC_API_MAX_AGE /
+// PUBLIC_API_STALE_WHILE_REVALIDATE (как в server.py).
+function json_response_cached($payload, int $mtime): void {
+  $body = json_encode($payload, JSON_UNESCAPED_UNICODE | JSON_UNESCAPED_SLASHES);
+  $etag = '"' . substr(hash('sha256', (string)$body), 0, 24) . '"';
+  $maxAge = getenv('PUBLIC_API_MAX_AGE');
+  $maxAge = ($maxAge === false || $maxAge === '') ? 60 : max(0, (int)$maxAge);
+  $swr = getenv('PUBLIC_API_STALE_WHILE_REVALIDATE');
+  $swr = ($swr === false || $swr === '') ? 600 : (int)$swr;
+  $cc = 'public, max-age=' . $maxAge . ($swr > 0 ? ', stale-while-revalidate=' . $swr : '');
+
+  header('ETag: ' . $etag);
+  if ($mtime > 0) header('Last-Modified: ' . gmdate('D, d M Y H:i:s', $mtime) . ' GMT');
+  header('Cache-Control: ' . $cc);
+
+  $inm = $_SERVER['HTTP_IF_NONE_MATCH'] ?? null;
+  $fresh = false;
+  if ($inm !== null) {
+    foreach (explode(',', (string)$inm) as $tag) {
+      $tag = trim($tag);
+      if (strpos($tag, 'W/') === 0) $tag = substr($tag, 2);
+      // mod_deflate дописывает -gzip к ETag
+      if ($tag === '*' || $tag === $etag || $tag === substr($etag, 0, -1) . '-gzip"') { $fresh = true; break; }
+    }
+  } elseif ($mtime > 0 && !empty($_SERVER['HTTP_IF_MODIFIED_SINCE'])) {
+    $ims = strtotime((string)$_SERVER['HTTP_IF_MODIFIED_SINCE']);
+    $fresh = $ims !== false && $mtime <= $ims;
+  }
+  if ($fresh) {
+    http_response_code(304);
+    exit;
+  }
+  http_response_code(200);
+  header('Content-Type: application/json; charset=utf-8');
+  echo $body;
+  exit;
+}
+
 function text_response(int $code, string $text, string $ctype = 'text/plain; charset=utf-8'): void {
   http_response_code($code);
   header('Content-Type: ' . $ctype);
@@ -0,0 +1,92 @@
+<?php
+require __DIR__ . '/_config.php';
+
+// Счётчики для фильтров каталога без скачивания всего списка:
+// GET /api/public_facets.php?category=kmu&q=&brand=&year=&cargo=&outreach=&sections=
+// -> {"category": "kmu", "total": N, "facets": {"brand": {"Palfinger": 12, ...}, "year": {...}, ...}}
+// Значения считаются по тем же правилам, что computeFacets() в catalog-filters.js и facet_keys() в server.py;
+// счётчики поля считаются без его собственного фильтра.
+
+const FACET_FIELDS = ['brand', 'year', 'cargo', 'outreach', 'sections'];
+const FACET_SPEC_KEYWORDS = [
+  'cargo' => ['грузопод', 'груз', 'грузовой'],
+  'outreach' => ['вылет', 'радиус'],
+  'sections' => ['секц'],
+];
+
+function facet_number($val) {
+  // "7.0 т" -> 7.0, "12,5 м" -> 12.5 (первая запятая — как replace(",", ".") в JS)
+  $s = preg_replace('/,/', '.', (string)$val, 1);
+  return preg_match('/-?\d+(\.\d+)?/', $s, $m) ? (float)$m[0] : null;
+}
+
+function facet_keys(array $p): array {
+  $brand = trim((string)($p['brand'] ?? ''));
+  $year = trim((string)($p['year'] ?? ''));
+  $out = [
+    'category' => (string)($p['category'] ?? '') ?: 'kmu',
+    'brand' => $brand !== '' ? $brand : null,
+    'year' => $year !== '' ? $year : null,
+  ];
+  $rows = is_array($p['specs_table'] ?? null) ? $p['specs_table'] : [];
+  foreach (FACET_SPEC_KEYWORDS as $field => $keywords) {
+    $raw = null;
+    foreach ($rows as $r) {
+      $k = is_array($r) ? mb_strtolower((string)($r['k'] ?? '')) : '';
+      if ($k === '') continue;
+      foreach ($keywords as $kw) {
+        if (mb_strpos($k, $kw) !== false) { $raw = $r['v'] ?? null; break 2; }
+      }
+    }
+    $num = facet_number($raw);
+    if ($num !== null && $field === 'sections') $num = floor($num + 0.5);
+    $out[$field] = $num === null ? null : ($num == floor($num) ? (string)(int)$num : (string)$num);
+  }
+  return $out;
+}
+
+$products = read_json_file(PRODUCTS_JSON, []);
+if (!is_array($products)) $products = [];
+
+$category = trim((string)($_GET['category'] ?? ''));
+$q = mb_strtolower(trim((string)($_GET['q'] ?? '')));
+$selected = [];
+foreach (FACET_FIELDS as $f) {
+  $v = trim((string)($_GET[$f] ?? ''));
+  if ($v !== '') $selected[$f] = $f === 'brand' ? mb_strtolower($v) : $v;
+}
+
+$counts = array_fill_keys(FACET_FIELDS, []);
+$labels = [];  // бренд в нижнем регистре -> написание из первого товара
+$total = 0;
+foreach ($products as $p) {
+  if (!is_array($p)) continue;
+  $keys = facet_keys($p);
+  if ($category !== '' && $keys['category'] !== $category) continue;
+  if ($q !== '') {
+    $hay = mb_strtolower((string)($p['title'] ?? $p['name'] ?? '') . "\n" . (string)($p['short'] ?? ''));
+    if (mb_strpos($hay, $q) === false) continue;
+  }
+  if ($keys['brand'] !== null) {
+    $lower = mb_strtolower($keys['brand']);
+    $labels[$lower] = $labels[$lower] ?? $keys['brand'];
+    $keys['brand'] = $labels[$lower];
+  }
+  $miss = [];  // поля, чей фильтр товар не проходит
+  foreach ($selected as $f => $v) {
+    $k = $keys[$f];
+    if ($k === null || ($f === 'brand' ? mb_strtolower($k) : $k) !== $v) $miss[] = $f;
+  }
+  if (!$miss) $total++;
+  if (count($miss) > 1) continue;
+  foreach (FACET_FIELDS as $f) {
+    if ($keys[$f] === null || ($miss && $miss[0] !== $f)) continue;
+    $counts[$f][$keys[$f]] = ($counts[$f][$keys[$f]] ?? 0) + 1;
+  }
+}
+
+json_response_cached([
+  'category' => $category !== '' ? $category : null,
+  'total' => $total,
+  'facets' => array_map(fn($c) => (object)$c, $counts),
+], (int)@filemtime(PRODUCTS_JSON));
@@ -4,8 +4,8 @@ require __DIR__ . '/_config.php';
 $s = read_json_file(SETTINGS_JSON, []);
 if (!is_array($s)) $s = [];
 
-json_response(200, [
+json_response_cached([
   'theme_default' => $s['theme_default'] ?? 'blue',
   'logo_path' => $s['logo_path'] ?? '',
   'hero_bg_path' => $s['hero_bg_path'] ?? '',
-]);
+], (int)@filemtime(SETTINGS_JSON));
@@ -1,7 +1,17 @@
-/* Catalog filters (client-side)
-   - Loads /api/public/products
-   - Filters by category (window.__CATALOG_CATEGORY), search, brand, year
+/* Catalog filters
+   - Shard mode: the page names its category's static JSON (window.__CATALOG_DATA_URL,
+     /data/catalog-<cat>.<hash>.json written by the rebuild, cached forever); filtering,
+     counts, sorting happen in the browser. Only a text query goes to the server's ranked
+     search when there is one
+   - Server mode: /api/public/products?category=&q=&brand=...&limit=&cursor= filters, sorts
+     and pages on the server and returns facet counts; the page loads only what it shows.
+     Counts for the selects alone come from /api/public/facets
+   - Fallback (static hosting with PHP): counts from /api/public_facets.php; the whole list
+     is loaded from /api/public_products.php once a filter is used and filtered by category
+     (window.__CATALOG_CATEGORY), search, brand, year in the browser
    - Updates URL query params
+   - Paginated static pages (/catalog/<cat>/page/N/): without filters the server-rendered
+     page and its pager stay as they are; any filter searches the whole category
 */
 (function () {
   const grid = document.getElementById("catalogGrid");
@@ -19,8 +29,26 @@
   if (!grid || !ui.q || !ui.brand || !ui.year || !ui.cargo || !ui.outreach || !ui.sections || !ui.sort) return;
 
   const category = (window.__CATALOG_CATEGORY || "").trim();
+  const dataUrl = (window.__CATALOG_DATA_URL || "").trim();
+  const pager = document.getElementById("catalogPager");
+  const staticCards = grid.innerHTML;
+  let showingStatic = true;
   let all = [];
+  let allLoading = null;
   let filtered = [];
+  let serverMode = false;
+  let shardMode = false;
+  let searchApi = true;  // shard mode: ranked search on the server until it turns out to be missing
+  let phpFacets = false;
+  let requestSeq = 0;
+  let nextCursor = null;
+  const PAGE_LIMIT = 24;
+  const more = document.createElement("button");
+  more.type = "button";
+  more.className = "btn ghost catalog-more";
+  more.textContent = "Показать ещё";
+  more.hidden = true;
+  grid.insertAdjacentElement("afterend", more);
 
   const esc = (s) => (s || "").replace(/[&<>'"]/g, (c) => ({
     "&": "&amp;", "<": "&lt;", ">": "&gt;", "'": "&#39;", '"': "&quot;"
@@ -129,7 +157,7 @@ function cardHtml(p) {
     history.replaceState(null, "", url);
   }
 
-  function fillSelect(select, values, placeholder) {
+  function fillSelect(select, values, placeholder, counts) {
     const current = select.value;
     select.innerHTML = "";
     const opt0 = document.createElement("option");
@@ -139,7 +167,7 @@ function cardHtml(p) {
     values.forEach(v => {
       const o = document.createElement("option");
       o.value = v;
-      o.textContent = v;
+      o.textContent = counts ? `${v} (${counts[v] || 0})` : v;
       select.appendChild(o);
     });
     // keep if still present
@@ -186,6 +214,14 @@ function sortProducts(list, sort, q) {
     if (s === "name_asc") return list.slice().sort((a,b)=> (a.name||"").localeCompare(b.name||"", "ru"));
     if (s === "year_desc") return list.slice().sort((a,b)=> (parseInt(b.year||0,10)||0) - (parseInt(a.year||0,10)||0));
     if (s === "updated_desc") return list.slice().sort((a,b)=> (b.updated_at||"").localeCompare(a.updated_at||""));
+    if (s === "cargo_desc" || s === "outreach_desc") {
+      // larger first, products without the value last (server: spec_numbers())
+      const key = s === "cargo_desc" ? "_cargo" : "_outreach";
+      return list.slice().sort((a,b)=> {
+        if (a[key] == null || b[key] == null) return (a[key] == null) - (b[key] == null);
+        return b[key] - a[key];
+      });
+    }
     // relevance: naive scoring by name contains query
     const qq = (q||"").toLowerCase();
     if (!qq) return list;
@@ -200,46 +236,253 @@ function sortProducts(list, sort, q) {
     return list.slice().sort((a,b)=> score(b)-score(a));
   }
 
-  function apply() {
-  const q = ui.q.value.trim().toLowerCase();
-  const brand = ui.brand.value.trim().toLowerCase();
-  const year = ui.year.value.trim();
-  const cargo = ui.cargo.value.trim();
-  const outreach = ui.outreach.value.trim();
-  const sections = ui.sections.value.trim();
-
-  let list = all;
-  if (category) list = list.filter(p => (p.category || "kmu") === category);
-
-  if (q) {
-    list = list.filter(p => {
-      const n = (p.name || "").toLowerCase();
+  function currentFilters() {
+    return {
+      q: ui.q.value.trim(),
+      brand: ui.brand.value.trim(),
+      year: ui.year.value.trim(),
+      cargo: ui.cargo.value.trim(),
+      outreach: ui.outreach.value.trim(),
+      sections: ui.sections.value.trim(),
+      sort: ui.sort.value
+    };
+  }
+
+  function renderCards(list, append) {
+    const html = list.map(cardHtml).join("\n");
+    if (append) grid.insertAdjacentHTML("beforeend", html);
+    else grid.innerHTML = list.length ? html : `<p class="muted">Ничего не найдено. Попробуй снять фильтры.</p>`;
+    if (window.MIRCRANE && window.MIRCRANE.initCarousels) window.MIRCRANE.initCarousels(grid);
+  }
+
+  function showStatic() {
+    if (!showingStatic) {
+      grid.innerHTML = staticCards;
+      if (window.MIRCRANE && window.MIRCRANE.initCarousels) window.MIRCRANE.initCarousels(grid);
+    }
+    showingStatic = true;
+    more.hidden = true;
+  }
+
+  function facetLists(facets) {
+    const num = (obj, parse) => Object.keys(obj || {}).map(parse).filter(x => !Number.isNaN(x)).sort((a,b)=>a-b).map(x => String(x));
+    return {
+      brands: Object.keys(facets.brand || {}).sort((a,b)=>a.localeCompare(b,"ru")),
+      years: Object.keys(facets.year || {}).sort((a,b)=> (parseInt(b,10)||0) - (parseInt(a,10)||0)),
+      cargos: num(facets.cargo, parseFloat),
+      outreaches: num(facets.outreach, parseFloat),
+      sections: num(facets.sections, x => parseInt(x,10)),
+    };
+  }
+
+  function fillFacetSelects(lists, facets) {
+    const c = facets || {};
+    fillSelect(ui.brand, lists.brands, "Бренд: все", c.brand);
+    fillSelect(ui.year, lists.years, "Год: любой", c.year);
+    fillSelect(ui.cargo, lists.cargos, "Груз: любой", c.cargo);
+    fillSelect(ui.outreach, lists.outreaches, "Вылет: любой", c.outreach);
+    fillSelect(ui.sections, lists.sections, "Секций: любые", c.sections);
+  }
+
+  function filterParams(f) {
+    const sp = new URLSearchParams();
+    if (category) sp.set("category", category);
+    ["q","brand","year","cargo","outreach","sections"].forEach(k => { if (f[k]) sp.set(k, f[k]); });
+    return sp;
+  }
+
+  // only what cardHtml() draws: no description/specs text in the page response
+  const CARD_FIELDS = "id,category,slug,title,name,brand,model,year,status,short,image,images,specs_table";
+
+  function serverUrl(f, limit, cursor) {
+    const sp = filterParams(f);
+    if (f.sort && f.sort !== "relevance") sp.set("sort", f.sort);
+    sp.set("limit", String(limit));
+    if (cursor) sp.set("cursor", cursor);
+    sp.set("fields", CARD_FIELDS);
+    return "/api/public/products?" + sp.toString();
+  }
+
+  async function fetchServerPage(f, limit, cursor) {
+    const res = await fetch(serverUrl(f, limit, cursor));
+    if (!res.ok) throw new Error("HTTP " + res.status);
+    const data = await res.json();
+    if (!data || !Array.isArray(data.items) || !data.facets) throw new Error("unexpected response");
+    return data;
+  }
+
+  async function fetchFacets(url, f) {
+    const res = await fetch(url + "?" + filterParams(f).toString());
+    if (!res.ok) throw new Error("HTTP " + res.status);
+    const data = await res.json();
+    if (!data || !data.facets) throw new Error("unexpected response");
+    return data;
+  }
+
+  function restoreSelects(lists, q0) {
+    if (q0.brand && lists.brands.includes(q0.brand)) ui.brand.value = q0.brand;
+    if (q0.year && lists.years.includes(q0.year)) ui.year.value = q0.year;
+    if (q0.cargo && lists.cargos.includes(q0.cargo)) ui.cargo.value = q0.cargo;
+    if (q0.outreach && lists.outreaches.includes(q0.outreach)) ui.outreach.value = q0.outreach;
+    if (q0.sections && lists.sections.includes(q0.sections)) ui.sections.value = q0.sections;
+  }
+
+  function fromColumns(feed) {
+    const cols = feed.columns || {};
+    const strings = feed.strings || [];
+    (feed.encoded || []).forEach(k => { cols[k] = (cols[k] || []).map(i => i === null ? null : strings[i]); });
+    const out = [];
+    for (let i = 0; i < (feed.count || 0); i++) {
+      const p = {};
+      (feed.fields || []).forEach(k => { const v = (cols[k] || [])[i]; if (v !== null && v !== undefined) p[k] = v; });
+      out.push(p);
+    }
+    return out;
+  }
+
+  async function loadShard() {
+    const res = await fetch(dataUrl);
+    if (!res.ok) throw new Error("HTTP " + res.status);
+    const feed = await res.json();
+    if (!feed || feed.format !== "columns") throw new Error("unexpected response");
+    return fromColumns(feed).map(computeFacets);
+  }
+
+  function loadAll() {
+    if (!allLoading) {
+      allLoading = (async () => {
+        try {
+          const res = await fetch("/api/public_products.php");
+          all = (await res.json()).map(computeFacets);
+        } catch (e) {
+          // fallback: keep existing HTML cards and enable simple DOM-filter by title
+          console.warn("catalog filters: cannot load products", e);
+          all = [];
+        }
+      })();
+    }
+    return allLoading;
+  }
+
+  async function applyServer() {
+    const f = currentFilters();
+    const narrowed = f.q || f.brand || f.year || f.cargo || f.outreach || f.sections || f.sort !== "relevance";
+    const seq = ++requestSeq;
+    setQuery(f);
+    if (pager) pager.hidden = !!narrowed;
+    let data;
+    try {
+      data = narrowed ? await fetchServerPage(f, PAGE_LIMIT, null) : await fetchFacets("/api/public/facets", f);
+    } catch (e) {
+      console.warn("catalog filters: server query failed", e);
+      return false;
+    }
+    if (seq !== requestSeq) return true;  // a newer query is in flight
+    fillFacetSelects(facetLists(data.facets), data.facets);
+    if (!narrowed) {
+      showStatic();
+    } else {
+      renderCards(data.items, false);
+      showingStatic = false;
+      nextCursor = data.next_cursor;
+      more.hidden = !nextCursor;
+    }
+    if (ui.count) ui.count.textContent = `Найдено: ${data.total}`;
+    return true;
+  }
+
+  async function loadMore() {
+    if (!nextCursor) return;
+    const seq = requestSeq;
+    more.disabled = true;
+    try {
+      const data = await fetchServerPage(currentFilters(), PAGE_LIMIT, nextCursor);
+      if (seq !== requestSeq) return;
+      renderCards(data.items, true);
+      nextCursor = data.next_cursor;
+      more.hidden = !nextCursor;
+    } catch (e) {
+      console.warn("catalog filters: cannot load more", e);
+    } finally {
+      more.disabled = false;
+    }
+  }
+
+  function facetValue(p, field) {
+    if (field === "brand") return (p.brand || "").trim() || null;
+    if (field === "year") return (p.year || "").toString().trim() || null;
+    const v = p["_" + field];
+    return v != null ? String(v) : null;
+  }
+
+  // every filter of f except `skip` (counts of a field ignore its own selection)
+  function matches(p, f, skip) {
+    if (f.q && skip !== "q") {
+      const q = f.q.toLowerCase();
+      const n = (p.title || p.name || "").toLowerCase();
       const sh = (p.short || "").toLowerCase();
-      return n.includes(q) || sh.includes(q);
-    });
+      if (!n.includes(q) && !sh.includes(q)) return false;
+    }
+    if (f.brand && skip !== "brand" && (p.brand || "").trim().toLowerCase() !== f.brand.toLowerCase()) return false;
+    for (const field of ["year", "cargo", "outreach", "sections"]) {
+      if (f[field] && skip !== field && facetValue(p, field) !== f[field]) return false;
+    }
+    return true;
+  }
+
+  function localFacets(scope, f) {
+    const facets = { brand: {}, year: {}, cargo: {}, outreach: {}, sections: {} };
+    const labels = {};  // one spelling per brand, like the server
+    for (const p of scope) {
+      for (const field of Object.keys(facets)) {
+        let v = facetValue(p, field);
+        if (v == null || !matches(p, f, field)) continue;
+        if (field === "brand") v = labels[v.toLowerCase()] = labels[v.toLowerCase()] || v;
+        facets[field][v] = (facets[field][v] || 0) + 1;
+      }
+    }
+    return facets;
   }
-  if (brand) list = list.filter(p => ((p.brand || "").toLowerCase() === brand));
-  if (year) list = list.filter(p => ((p.year || "").toString() === year));
 
-  if (cargo) list = list.filter(p => (p._cargo != null && String(p._cargo) === cargo));
-  if (outreach) list = list.filter(p => (p._outreach != null && String(p._outreach) === outreach));
-  if (sections) list = list.filter(p => (p._sections != null && String(p._sections) === sections));
+  function apply() {
+  if (serverMode) return applyServer();
+  if (all === null) {  // PHP counts only so far: the list is needed now
+    loadAll().then(apply);
+    return;
+  }
+  const f = currentFilters();
+  if (shardMode && f.q && searchApi) {
+    // stemming/transliteration live in the server index; without it, substring match below
+    applyServer().then(ok => { if (!ok) { searchApi = false; apply(); } });
+    return;
+  }
+  more.hidden = true;
 
-  list = sortProducts(list, ui.sort.value, q);
+  let scope = all;
+  if (category) scope = scope.filter(p => (p.category || "kmu") === category);
+
+  let list = sortProducts(scope.filter(p => matches(p, f, null)), f.sort, f.q.toLowerCase());
 
   filtered = list;
-  grid.innerHTML = filtered.length ? filtered.map(cardHtml).join("\n") : `<p class="muted">Ничего не найдено. Попробуй снять фильтры.</p>`;
-  if (window.MIRCRANE && window.MIRCRANE.initCarousels) window.MIRCRANE.initCarousels(grid);
+  const narrowed = f.q || f.brand || f.year || f.cargo || f.outreach || f.sections || f.sort !== "relevance";
+  if (pager) pager.hidden = !!narrowed;
+  if (pager && !narrowed) {
+    showStatic();
+  } else {
+    renderCards(filtered, false);
+    showingStatic = false;
+  }
   if (ui.count) ui.count.textContent = `Найдено: ${filtered.length}`;
-  setQuery({
-    q: ui.q.value.trim(),
-    brand: ui.brand.value.trim(),
-    year: ui.year.value.trim(),
-    cargo: ui.cargo.value.trim(),
-    outreach: ui.outreach.value.trim(),
-    sections: ui.sections.value.trim(),
-    sort: ui.sort.value
-  });
+  setQuery(f);
+  if (shardMode) {
+    const facets = localFacets(scope, f);
+    fillFacetSelects(facetLists(facets), facets);
+  }
+  if (phpFacets) {
+    fetchFacets("/api/public_facets.php", currentFilters())
+      .then(d => fillFacetSelects(facetLists(d.facets), d.facets))
+      .catch(() => {});
+  }
 }
 
   function debounce(fn, ms) {
@@ -251,20 +494,54 @@ function sortProducts(list, sort, q) {
   }
 
   async function init() {
-    // Load products
-    try {
-      const res = await fetch("/api/public_products.php", { cache: "no-store" });
-      all = (await res.json()).map(computeFacets);
-    } catch (e) {
-      // fallback: keep existing HTML cards and enable simple DOM-filter by title
-      console.warn("catalog filters: cannot load products", e);
-      all = [];
-    }
-
     const q0 = getQuery();
     ui.q.value = q0.q || "";
     ui.sort.value = q0.sort || "relevance";
 
+    // The category's static shard: everything in the browser, no API round trips
+    if (dataUrl) {
+      try {
+        all = await loadShard();
+        shardMode = true;
+        const scope = category ? all.filter(p => (p.category || "kmu") === category) : all;
+        const facets = localFacets(scope, q0);
+        const lists = facetLists(facets);
+        fillFacetSelects(lists, facets);
+        restoreSelects(lists, q0);
+        listen();
+        const f = currentFilters();
+        if (f.q || f.brand || f.year || f.cargo || f.outreach || f.sections || f.sort !== "relevance") apply();
+        else if (ui.count) ui.count.textContent = `Найдено: ${scope.length}`;
+        return;
+      } catch (e) {
+        console.warn("catalog filters: cannot load shard", e);
+        all = [];
+      }
+    }
+
+    // Counts for the selects (no cards): server API, else PHP hosting's public_facets.php
+    for (const url of ["/api/public/facets", "/api/public_facets.php"]) {
+      try {
+        const data = await fetchFacets(url, q0);
+        serverMode = url === "/api/public/facets";
+        phpFacets = !serverMode;
+        if (phpFacets) all = null;  // loaded by the first apply() that needs it
+        const lists = facetLists(data.facets);
+        fillFacetSelects(lists, data.facets);
+        restoreSelects(lists, q0);
+        listen();
+        const f = currentFilters();
+        if (f.q || f.brand || f.year || f.cargo || f.outreach || f.sections || f.sort !== "relevance") apply();
+        else if (ui.count) ui.count.textContent = `Найдено: ${data.total}`;
+        return;
+      } catch (e) {
+        // try the next source
+      }
+    }
+
+    // Neither: load the whole list and count in the browser
+    await loadAll();
+
     // Build facets from data (category-scoped)
     let scope = all;
     if (category) scope = scope.filter(p => (p.category || "kmu") === category);
@@ -282,19 +559,16 @@ const outreaches = Array.from(new Set(scope.map(p => (p._outreach != null ? Stri
 const sections = Array.from(new Set(scope.map(p => (p._sections != null ? String(p._sections) : "")).filter(Boolean)))
   .map(x => parseInt(x,10)).filter(x => !Number.isNaN(x))
   .sort((a,b)=>a-b).map(x => String(x));
-fillSelect(ui.brand, brands, "Бренд: все");
-    fillSelect(ui.year, years, "Год: любой");
-    fillSelect(ui.cargo, cargos, "Груз: любой");
-    fillSelect(ui.outreach, outreaches, "Вылет: любой");
-    fillSelect(ui.sections, sections, "Секций: любые");
-
-    if (q0.brand && brands.includes(q0.brand)) ui.brand.value = q0.brand;
-    if (q0.year && years.includes(q0.year)) ui.year.value = q0.year;
-    if (q0.cargo && cargos.includes(q0.cargo)) ui.cargo.value = q0.cargo;
-    if (q0.outreach && outreaches.includes(q0.outreach)) ui.outreach.value = q0.outreach;
-    if (q0.sections && sections.includes(q0.sections)) ui.sections.value = q0.sections;
-
-    // Listeners
+fillFacetSelects({ brands, years, cargos, outreaches, sections });
+    restoreSelects({ brands, years, cargos, outreaches, sections }, q0);
+
+    listen();
+
+    // Render
+    if (all.length) apply();
+  }
+
+  function listen() {
     ui.q.addEventListener("input", debounce(apply, 120));
     ui.brand.addEventListener("change", apply);
     ui.year.addEventListener("change", apply);
@@ -313,9 +587,7 @@ fillSelect(ui.brand, brands, "Бренд: все");
       ui.sort.value = "relevance";
       apply();
     });
-
-    // Render
-    if (all.length) apply();
+    more.addEventListener("click", loadMore);
   }
 
   init();
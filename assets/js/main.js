@@ -165,13 +165,40 @@
 </article>`.trim();
   }
 
+  // Cards need only these fields; the Python server sends them column-wise (?fields=&format=columns)
+  const CARD_FIELDS = "id,category,slug,title,name,brand,model,year,status,image,images,featured,popular,featured_rank";
+
+  function fromColumns(feed){
+    const cols = feed.columns || {};
+    const strings = feed.strings || [];
+    (feed.encoded || []).forEach(f => { cols[f] = (cols[f] || []).map(i => i === null ? null : strings[i]); });
+    const out = [];
+    for(let i = 0; i < (feed.count || 0); i++){
+      const p = {};
+      (feed.fields || []).forEach(f => { const v = (cols[f] || [])[i]; if(v !== null && v !== undefined) p[f] = v; });
+      out.push(p);
+    }
+    return out;
+  }
+
+  let cardFeed = null;
+  function loadCardFeed(){
+    // one request per page for all card blocks; PHP hosting: the full list
+    if(!cardFeed){
+      cardFeed = fetch(`/api/public/products?fields=${CARD_FIELDS}&format=columns`)
+        .then(res => { if(!res.ok) throw new Error("HTTP " + res.status); return res.json(); })
+        .then(fromColumns)
+        .catch(() => fetch("/api/public_products.php").then(res => res.ok ? res.json().catch(()=>[]) : []));
+    }
+    return cardFeed;
+  }
+
   async function renderHomeFeatured(){
     const box = document.getElementById("homeFeatured");
     if(!box) return;
 
     try{
-      const res = await fetch("/api/public_products.php");
-      const products = await res.json().catch(()=>[]);
+      const products = await loadCardFeed();
       const kmu = (products || []).filter(p => (p.category || "kmu") === "kmu");
 
       let list = kmu.filter(p => p.featured === true || p.popular === true);
@@ -206,6 +233,63 @@
 
   renderHomeFeatured();
 
+  // ============================
+  // Site search: /catalog/?q= (SearchAction in the site's JSON-LD)
+  // ============================
+  async function initSiteSearch(){
+    const form = document.getElementById("siteSearch");
+    const box = document.getElementById("siteSearchResults");
+    if(!form || !box) return;
+    const q = (new URLSearchParams(location.search).get("q") || "").trim();
+    const input = form.querySelector("input[name=q]");
+    if(input) input.value = q;
+    if(!q) return;
+
+    const info = document.getElementById("siteSearchInfo");
+    const grid = document.getElementById("siteSearchGrid");
+    const more = document.getElementById("siteSearchMore");
+    box.hidden = false;
+    info.textContent = "Ищем…";
+
+    function show(items, total, append){
+      const html = items.map(homeCard).join("\n");
+      if(append) grid.insertAdjacentHTML("beforeend", html);
+      else grid.innerHTML = html;
+      info.textContent = total ? `Найдено: ${total}` : "Ничего не найдено. Попробуй другое написание или открой каталог.";
+      initCarousels(grid);
+    }
+
+    // Python server: ranked search on the server, page by page
+    let cursor = "0";
+    async function nextPage(append){
+      const res = await fetch(`/api/public/search?q=${encodeURIComponent(q)}&limit=24&cursor=${cursor}`);
+      if(!res.ok) throw new Error("HTTP " + res.status);
+      const data = await res.json();
+      show(data.items || [], data.total || 0, append);
+      cursor = data.next_cursor;
+      more.hidden = !cursor;
+    }
+    try{
+      await nextPage(false);
+      more.addEventListener("click", () => { more.disabled = true; nextPage(true).catch(()=>{}).finally(() => { more.disabled = false; }); });
+      return;
+    } catch(e){
+      // PHP hosting: no search endpoint, substring match over the full list
+    }
+    try{
+      const res = await fetch("/api/public_products.php");
+      const products = await res.json().catch(()=>[]);
+      const needle = q.toLowerCase();
+      const list = (products || []).filter(p =>
+        [p.title, p.brand, p.model, p.year, p.short, p.specs, p.description].join(" ").toLowerCase().includes(needle));
+      show(list, list.length, false);
+    } catch(e){
+      info.textContent = "Поиск недоступен. Обнови страницу.";
+    }
+  }
+
+  initSiteSearch();
+
   
   // ============================
   // Product pages: hydrate gallery & similar from products.json
@@ -219,10 +303,7 @@
     if(!cat || !slug) return;
 
     try{
-      const res = await fetch("/api/public_products.php?ts=" + Date.now(), { cache: "no-store" });
-      if(!res.ok) return;
-
-      const products = await res.json().catch(()=>[]);
+      const products = await loadCardFeed();
       const p = (products || []).find(x => (x.category || "kmu") === cat && (x.slug || "") === slug);
       if(!p) return;
 
@@ -438,7 +519,7 @@
 
   async function applyPublicSettings(){
     try{
-      const res = await fetch("/api/public_settings.php", {cache:"no-store"});
+      const res = await fetch("/api/public_settings.php");
       if(!res.ok) return;
       const s = await res.json();
 
@@ -1,21 +1,46 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, json, csv, time, ssl, base64
+import os, sys, json, csv, time, ssl, base64
 import mimetypes
 import io
 import traceback
 import hmac
+import hashlib
+import marshal
+import math
+import bisect
+import gzip
 import re
 import uuid
+import shutil
+import heapq
+import multiprocessing
+import smtplib
+import socket
+import sqlite3
+import threading
 
 from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from urllib.request import Request, urlopen
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 from pathlib import Path
+from collections import OrderedDict, deque
+from collections.abc import Mapping
 from datetime import datetime
 from email.parser import BytesParser
 from email.policy import default as email_default_policy
+from email.utils import parsedate_to_datetime
+from array import array
+
+from translit import RU_TRANSLIT
+
+try:
+    import brotli  # optional: pip install brotli -> .br sidecars
+except ImportError:
+    brotli = None
 
 # Ensure correct mime-types for modern/edge image formats
 mimetypes.add_type('image/avif', '.avif')
@@ -36,6 +61,52 @@ LEADS_CSV = os.path.join(LEADS_DIR, "leads.csv")
 # Products
 PRODUCTS_JSON = ROOT / "data" / "products.json"
 PRODUCTS_CSV  = ROOT / "data" / "products.csv"
+# Storage engine: "json" (products.json is the source of truth) or "sqlite" (products.json is an export)
+PRODUCTS_BACKEND = os.getenv("PRODUCTS_BACKEND", "json").strip().lower() or "json"
+PRODUCTS_DB = Path(os.getenv("PRODUCTS_DB", "") or (ROOT / "data" / "products.sqlite3"))
+# json backend: edits are appended to a journal and folded into products.json in the background
+PRODUCTS_JOURNAL = os.getenv("PRODUCTS_JOURNAL", "1").strip().lower() not in ("0", "false", "no")
+PRODUCTS_JOURNAL_PATH = ROOT / "data" / "products.journal.jsonl"
+PRODUCTS_JOURNAL_MAX_OPS = int(os.getenv("PRODUCTS_JOURNAL_MAX_OPS", "500"))
+PRODUCTS_JOURNAL_MAX_BYTES = int(os.getenv("PRODUCTS_JOURNAL_MAX_BYTES", str(4 * 1024 * 1024)))
+# LRU of normalized products and rendered cards, keyed by product content (entries, not products)
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "8192"))
+# POST /api/products/batch: max ops per request
+BATCH_MAX_OPS = int(os.getenv("BATCH_MAX_OPS", "2000"))
+# /api/public/products/changes?since=: product changes kept in memory (older versions get "full resync")
+PRODUCT_CHANGES_MAX = max(1, int(os.getenv("PRODUCT_CHANGES_MAX", "5000")))
+
+# Incremental rebuild: manifest of product/page hashes from the last rebuild
+REBUILD_MANIFEST_JSON = ROOT / "data" / ".rebuild-manifest.json"
+REBUILD_INCREMENTAL = os.getenv("REBUILD_INCREMENTAL", "1").strip().lower() not in ("0", "false", "no")
+# data/ files that are not for the public (prefixes: the journal's .compacting twin, sqlite -wal/-shm, *.tmp)
+_PRIVATE_DATA_PREFIXES = (PRODUCTS_JOURNAL_PATH.with_suffix(""), PRODUCTS_DB, REBUILD_MANIFEST_JSON)
+# Parallel rebuild: 0 = one process per CPU, 1 = serial
+REBUILD_WORKERS = int(os.getenv("REBUILD_WORKERS", "0") or "0")
+REBUILD_PARALLEL_MIN_PAGES = int(os.getenv("REBUILD_PARALLEL_MIN_PAGES", "200"))  # below this a pool costs more than it saves
+REBUILD_WRITE_BATCH = 256
+
+# Static catalog pages: cards per /catalog/<cat>/ page, the rest go to /catalog/<cat>/page/N/ (0 = everything on one page)
+CATALOG_PAGE_SIZE = max(0, int(os.getenv("CATALOG_PAGE_SIZE", "24") or "0"))
+
+# Admin mutations queue a rebuild on a background worker; a burst within the debounce window = one rebuild
+REBUILD_DEBOUNCE_SECONDS = float(os.getenv("REBUILD_DEBOUNCE_SECONDS", "1.5"))
+REBUILD_MAX_DELAY_SECONDS = float(os.getenv("REBUILD_MAX_DELAY_SECONDS", "15"))
+
+# Precompressed .gz (+ .br if brotli is installed) next to generated HTML, sitemap.xml, assets JS/CSS
+PRECOMPRESS = os.getenv("PRECOMPRESS", "1").strip().lower() not in ("0", "false", "no")
+PRECOMPRESS_MIN_BYTES = 256
+
+# Public JSON (/api/public/products, /api/public/settings): ETag/Last-Modified + 304, browser cache window
+PUBLIC_API_MAX_AGE = int(os.getenv("PUBLIC_API_MAX_AGE", "60"))
+PUBLIC_API_STALE_WHILE_REVALIDATE = int(os.getenv("PUBLIC_API_STALE_WHILE_REVALIDATE", "600"))
+# /api/public/products?category=&q=&brand=...&limit=&cursor= : page size when limit is not given, and its cap
+PUBLIC_API_DEFAULT_LIMIT = int(os.getenv("PUBLIC_API_DEFAULT_LIMIT", "24"))
+PUBLIC_API_MAX_LIMIT = int(os.getenv("PUBLIC_API_MAX_LIMIT", "100"))
+PUBLIC_API_CACHE_CONTROL = (
+    f"public, max-age={max(0, PUBLIC_API_MAX_AGE)}"
+    + (f", stale-while-revalidate={PUBLIC_API_STALE_WHILE_REVALIDATE}" if PUBLIC_API_STALE_WHILE_REVALIDATE > 0 else "")
+)
 
 # Site settings (logo, hero background, theme)
 SETTINGS_JSON = ROOT / "data" / "settings.json"
@@ -49,12 +120,32 @@ DEFAULT_SETTINGS = {
 # Optional notifications
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 TELEGRAM_CHAT_ID   = os.getenv("TELEGRAM_CHAT_ID", "").strip()
+TELEGRAM_API_URL   = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").strip().rstrip("/")
 
 SMTP_HOST = os.getenv("SMTP_HOST", "").strip()
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587").strip() or "587")
 SMTP_USER = os.getenv("SMTP_USER", "").strip()
 SMTP_PASS = os.getenv("SMTP_PASS", "").strip()
 SMTP_TO   = os.getenv("SMTP_TO", "").strip()
+SMTP_FROM = os.getenv("SMTP_FROM", "").strip() or SMTP_USER
+
+# Notifications go through an on-disk outbox (leads/outbox/) delivered by background workers:
+# /api/lead answers once the CSV row is written. Failed sends are retried with exponential
+# backoff (base * 2^attempt, capped), then moved to leads/outbox-dead.jsonl.
+LEAD_OUTBOX_DIR = Path(BASE_DIR) / "leads" / "outbox"
+LEAD_DEAD_LETTER = Path(BASE_DIR) / "leads" / "outbox-dead.jsonl"
+LEAD_NOTIFY_WORKERS = max(1, int(os.getenv("LEAD_NOTIFY_WORKERS", "2") or "2"))
+LEAD_NOTIFY_MAX_ATTEMPTS = max(1, int(os.getenv("LEAD_NOTIFY_MAX_ATTEMPTS", "8") or "8"))
+LEAD_NOTIFY_RETRY_BASE = float(os.getenv("LEAD_NOTIFY_RETRY_BASE", "5") or "5")
+LEAD_NOTIFY_RETRY_MAX = float(os.getenv("LEAD_NOTIFY_RETRY_MAX", "3600") or "3600")
+# Lead emails: SMTP sessions are kept open and reused (0 = connect per message); idle ones get a NOOP
+# every SMTP_KEEPALIVE_SECONDS and are closed after SMTP_IDLE_MAX_SECONDS without a message
+SMTP_POOL_SIZE = max(0, int(os.getenv("SMTP_POOL_SIZE", "2") or "2"))
+SMTP_KEEPALIVE_SECONDS = float(os.getenv("SMTP_KEEPALIVE_SECONDS", "60") or "60")
+SMTP_IDLE_MAX_SECONDS = float(os.getenv("SMTP_IDLE_MAX_SECONDS", "300") or "300")
+# Digest: leads within this many seconds of the first one go out as one email (0 = an email per lead)
+LEAD_EMAIL_DIGEST_SECONDS = float(os.getenv("LEAD_EMAIL_DIGEST_SECONDS", "0") or "0")
+LEAD_EMAIL_DIGEST_MAX = max(1, int(os.getenv("LEAD_EMAIL_DIGEST_MAX", "50") or "50"))
 
 RATE_LIMIT_SECONDS = int(os.getenv("RATE_LIMIT_SECONDS", "10"))
 
@@ -154,14 +245,11 @@ def save_lead(payload: dict, ip: str, referer: str = ""):
         f"Имя: {fields.get('name','')}\n"
         f"Комментарий: {fields.get('message','')}"
     )
+    # delivered in the background: a slow Telegram/SMTP never holds up the visitor
     try:
-        send_telegram(text)
-    except Exception:
-        pass
-    try:
-        send_email("Новая заявка — Мир манипуляторов", text)
-    except Exception:
-        pass
+        lead_outbox.enqueue("Новая заявка — Мир манипуляторов", text)
+    except Exception as e:
+        print("WARN: lead notification not queued:", repr(e))
 
     return True, "Заявка отправлена. Мы скоро свяжемся."
 
@@ -184,7 +272,13 @@ def ensure_products_seed():
     """Ensure products.json exists. If missing/empty and products.csv exists, seed from CSV."""
     os.makedirs(os.path.dirname(PRODUCTS_JSON), exist_ok=True)
 
-    products = read_json(PRODUCTS_JSON, None)
+    # Edits journaled before a restart are part of the catalog; a long journal is folded in the background
+    backend = product_store.backend
+    if isinstance(backend, JournaledJsonProductBackend):
+        backend.compact_if_due()
+        products = backend.load()
+    else:
+        products = read_json(PRODUCTS_JSON, None)
     if isinstance(products, list) and len(products) > 0:
         return
 
@@ -266,7 +360,7 @@ def ensure_products_seed():
 def send_telegram(text: str):
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         return False, "Telegram not configured"
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = json.dumps({"chat_id": TELEGRAM_CHAT_ID, "text": text, "disable_web_page_preview": True}).encode("utf-8")
     req = Request(url, data=payload, headers={"Content-Type": "application/json"})
     try:
@@ -276,30 +370,392 @@ def send_telegram(text: str):
     except Exception as e:
         return False, str(e)
 
+def telegram_configured() -> bool:
+    return bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
+
+def smtp_configured() -> bool:
+    # a relay without AUTH (local MTA, test stub) needs no SMTP_USER/SMTP_PASS, only a sender
+    return bool(SMTP_HOST and SMTP_TO and SMTP_FROM)
+
+def smtp_connect():
+    """New SMTP session: EHLO, STARTTLS when offered, login when credentials are set."""
+    s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15)
+    try:
+        s.ehlo()
+        try:
+            s.starttls(context=ssl.create_default_context())
+            s.ehlo()
+        except Exception:
+            pass
+        if SMTP_USER and SMTP_PASS:
+            s.login(SMTP_USER, SMTP_PASS)
+    except Exception:
+        s.close()
+        raise
+    return s
+
+class SmtpPool:
+    """
+    Up to `size` logged-in SMTP sessions kept between messages, so a burst of leads
+    costs one handshake (TCP + STARTTLS + AUTH) instead of one per email. A keepalive
+    thread sends NOOP to idle sessions every `keepalive` seconds and QUITs those idle
+    longer than `idle_max`. A pooled session the server has dropped is detected when
+    it is used (disconnect, reset or timeout, not an SMTP error reply): the message is
+    retried once on a fresh connection. size=0 connects
+    per message.
+    """
+
+    def __init__(self, connect, size: int = 2, keepalive: float = 60.0, idle_max: float = 300.0):
+        self.connect = connect
+        self.size = size
+        self.keepalive = keepalive
+        self.idle_max = idle_max
+        self._idle = []  # [(session, last used, monotonic)]
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"connects": 0, "reused": 0, "reconnects": 0, "noops": 0, "closed_idle": 0}
+
+    def _new(self):
+        s = self.connect()
+        with self._lock:
+            self._stats["connects"] += 1
+        return s
+
+    @staticmethod
+    def _close(s):
+        try:
+            s.quit()
+        except Exception:
+            try:
+                s.close()
+            except Exception:
+                pass
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                self._stats["reused"] += 1
+                return self._idle.pop()[0], True
+        return self._new(), False
+
+    def _checkin(self, s):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((s, time.monotonic()))
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._keepalive, name="smtp-keepalive", daemon=True)
+                    self._thread.start()
+                return
+        self._close(s)
+
+    def sendmail(self, from_addr: str, to_addrs: list, msg: str):
+        s, reused = self._checkout()
+        try:
+            s.sendmail(from_addr, to_addrs, msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+            # only a dead connection is retried; an SMTPException (5xx reply, refused recipients)
+            # is the server's answer to this message and goes to the caller as is
+            self._close(s)
+            if not reused:
+                raise
+            # the server closed a pooled session since its last NOOP: once more on a fresh one
+            with self._lock:
+                self._stats["reconnects"] += 1
+            s = self._new()
+            try:
+                s.sendmail(from_addr, to_addrs, msg)
+            except Exception:
+                self._close(s)
+                raise
+        except Exception:
+            self._close(s)
+            raise
+        self._checkin(s)
+
+    def _keepalive(self):
+        while True:
+            time.sleep(self.keepalive)
+            with self._lock:
+                if not self._idle:
+                    self._thread = None  # under the lock: the next check-in starts a new thread
+                    return
+                sessions = list(self._idle)
+            now = time.monotonic()
+            # one session at a time is taken out for its NOOP; the rest stay available to senders
+            for entry in sessions:
+                with self._lock:
+                    if entry not in self._idle:
+                        continue  # checked out meanwhile
+                    self._idle.remove(entry)
+                s, used = entry
+                if now - used > self.idle_max:
+                    self._close(s)
+                    with self._lock:
+                        self._stats["closed_idle"] += 1
+                    continue
+                try:
+                    ok = s.noop()[0] == 250
+                except Exception:
+                    ok = False
+                with self._lock:
+                    self._stats["noops"] += 1
+                    keep = ok and len(self._idle) < self.size
+                    if keep:
+                        self._idle.append(entry)
+                if not keep:
+                    self._close(s)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+smtp_pool = SmtpPool(smtp_connect, SMTP_POOL_SIZE, SMTP_KEEPALIVE_SECONDS, SMTP_IDLE_MAX_SECONDS)
+
 def send_email(subject: str, body: str):
-    if not (SMTP_HOST and SMTP_USER and SMTP_PASS and SMTP_TO):
+    if not smtp_configured():
         return False, "SMTP not configured"
     try:
-        import smtplib
         from email.mime.text import MIMEText
         msg = MIMEText(body, _charset="utf-8")
         msg["Subject"] = subject
-        msg["From"] = SMTP_USER
+        msg["From"] = SMTP_FROM
         msg["To"] = SMTP_TO
-
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15) as s:
-            s.ehlo()
-            try:
-                s.starttls(context=ssl.create_default_context())
-                s.ehlo()
-            except Exception:
-                pass
-            s.login(SMTP_USER, SMTP_PASS)
-            s.sendmail(SMTP_USER, [SMTP_TO], msg.as_string())
+        smtp_pool.sendmail(SMTP_FROM, [SMTP_TO], msg.as_string())
         return True, "sent"
     except Exception as e:
         return False, str(e)
 
+def send_email_digest(msgs: list):
+    """Several queued lead emails as one message (LEAD_EMAIL_DIGEST_SECONDS)."""
+    if len(msgs) == 1:
+        return send_email(msgs[0].get("subject") or "", msgs[0].get("text") or "")
+    body = ("\n\n" + "-" * 40 + "\n\n").join(
+        f"[{m.get('created_at') or ''}]\n{m.get('text') or ''}" for m in msgs)
+    return send_email(f"Новые заявки ({len(msgs)}) — Мир манипуляторов", body)
+
+# ============================
+# Lead notification outbox
+# ============================
+class LeadOutbox:
+    """
+    Durable queue of lead notifications. enqueue() writes one JSON file per channel
+    into `directory` (fsynced, atomic rename) and returns; a pool of `workers` threads
+    sends them through `senders` ({channel: fn(subject, text) -> (ok, info)}).
+    A failed send is rescheduled after base * 2^(attempts-1) seconds (at most
+    `retry_max`) and rewritten with its attempt count; after `max_attempts` it is
+    appended to `dead_letter` (JSON lines) and dropped from the outbox (if that write
+    fails, its file stays for the next run). Files left by a previous run are picked
+    up by start() and retried at once.
+
+    Channels in `digest_senders` ({channel: fn([message, ...]) -> (ok, info)}) wait
+    `digest_window` seconds after they are queued; whatever else of that channel is
+    queued by then goes out with them as one send (at most `digest_max`).
+    """
+
+    def __init__(self, directory: Path, dead_letter: Path, senders: dict, workers: int = 2,
+                 max_attempts: int = 8, retry_base: float = 5.0, retry_max: float = 3600.0,
+                 digest_senders: dict = None, digest_window: float = 0.0, digest_max: int = 50):
+        self.dir = Path(directory)
+        self.dead_letter = Path(dead_letter)
+        self.senders = senders
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.digest_senders = digest_senders if digest_window > 0 else {}
+        self.digest_window = digest_window
+        self.digest_max = digest_max
+        self._cond = threading.Condition()
+        self._heap = []       # (due, seq, message id); entries whose due no longer matches are stale
+        self._seq = 0
+        self._messages = {}   # id -> message dict (queued or in flight)
+        self._inflight = set()
+        self._threads = []
+        self._stats = {"sent": 0, "retried": 0, "dead": 0, "digests": 0, "last_error": None}
+
+    def _write(self, msg: dict):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.dir / f"{msg['id']}.json"
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(msg, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(path)
+
+    def _schedule(self, msg: dict):
+        """Caller holds the condition."""
+        self._seq += 1
+        self._messages[msg["id"]] = msg
+        heapq.heappush(self._heap, (msg["due"], self._seq, msg["id"]))
+        self._cond.notify()
+
+    def enqueue(self, subject: str, text: str, channels=None) -> list:
+        """Queues the notification for every configured channel (or `channels`); returns the message ids."""
+        if channels is None:
+            channels = [c for c, ok in (("telegram", telegram_configured()), ("email", smtp_configured())) if ok]
+        ids = []
+        now = time.time()
+        for channel in channels:
+            due = now + self.digest_window if channel in self.digest_senders else now
+            msg = {"id": f"{int(now * 1000)}-{uuid.uuid4().hex[:8]}-{channel}", "channel": channel,
+                   "subject": subject, "text": text, "attempts": 0, "due": due,
+                   "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z", "last_error": None}
+            self._write(msg)
+            with self._cond:
+                self._schedule(msg)
+            ids.append(msg["id"])
+        if ids:
+            self.start()
+        return ids
+
+    def start(self):
+        """Starts the workers (once) and schedules messages a previous run left on disk."""
+        with self._cond:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            for path in sorted(self.dir.glob("*.json")) if self.dir.is_dir() else []:
+                try:
+                    msg = json.loads(path.read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    continue
+                if isinstance(msg, dict) and msg.get("id") == path.stem and msg["id"] not in self._messages:
+                    msg["due"] = time.time()  # a restart often follows a config fix: retry right away
+                    self._schedule(msg)
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"lead-outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.retry_max, self.retry_base * (2 ** max(0, attempts - 1)))
+
+    def _next_group(self) -> list:
+        """Blocks until a message is due; returns it (with its digest companions), marked in flight."""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, mid = self._heap[0]
+                msg = self._messages.get(mid)
+                if msg is None or mid in self._inflight or msg["due"] != due:
+                    heapq.heappop(self._heap)  # stale: sent with a digest or rescheduled
+                    continue
+                wait = due - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                group = [msg]
+                if msg["channel"] in self.digest_senders:
+                    others = sorted((m for m in self._messages.values()
+                                     if m["channel"] == msg["channel"] and m["id"] != mid and m["id"] not in self._inflight),
+                                    key=lambda m: m["id"])
+                    group += others[:self.digest_max - 1]
+                self._inflight.update(m["id"] for m in group)
+                return group
+
+    def _send(self, group: list) -> tuple:
+        channel = group[0].get("channel")
+        try:
+            if channel in self.digest_senders:
+                return self.digest_senders[channel](group)
+            send = self.senders.get(channel)
+            if send is None:
+                return False, "unknown channel"
+            return send(group[0].get("subject") or "", group[0].get("text") or "")
+        except Exception as e:
+            return False, repr(e)
+
+    def _worker(self):
+        while True:
+            group = self._next_group()
+            ok, info = self._send(group)
+            undead = set()  # ids whose dead letter could not be written: their file stays in the outbox
+
+            try:
+                for msg in group:
+                    msg["attempts"] = int(msg.get("attempts") or 0) + 1
+                    path = self.dir / f"{msg['id']}.json"
+                    if ok:
+                        try:
+                            path.unlink()
+                        except OSError:
+                            pass
+                    elif msg["attempts"] >= self.max_attempts:
+                        msg["last_error"] = str(info)[:500]
+                        msg["failed_at"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+                        try:
+                            self.dead_letter.parent.mkdir(parents=True, exist_ok=True)
+                            with open(self.dead_letter, "a", encoding="utf-8") as f:
+                                f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+                        except OSError as e:
+                            undead.add(msg["id"])
+                            print("WARN: lead dead letter write failed:", repr(e))
+                            continue
+                        try:
+                            path.unlink()
+                        except OSError:
+                            pass
+                    else:
+                        msg["last_error"] = str(info)[:500]
+                        msg["due"] = time.time() + self._backoff(msg["attempts"])
+                        try:
+                            self._write(msg)
+                        except OSError as e:
+                            print("WARN: lead outbox write failed:", repr(e))
+            finally:
+                # always release the group, or its leads would never be retried until a restart
+                with self._cond:
+                    for msg in group:
+                        mid = msg["id"]
+                        self._inflight.discard(mid)
+                        if ok:
+                            self._stats["sent"] += 1
+                            del self._messages[mid]
+                        elif msg["attempts"] >= self.max_attempts:
+                            self._stats["dead"] += 1
+                            self._stats["last_error"] = msg["last_error"]
+                            del self._messages[mid]
+                            if mid in undead:
+                                print(f"WARN: lead notification {mid} failed, kept in the outbox for the next start: {msg['last_error']}")
+                            else:
+                                print(f"WARN: lead notification {mid} moved to dead letters: {msg['last_error']}")
+                        else:
+                            self._stats["retried"] += 1
+                            self._stats["last_error"] = msg["last_error"]
+                            self._schedule(msg)
+                    if ok and len(group) > 1:
+                        self._stats["digests"] += 1
+                    self._cond.notify_all()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Blocks until nothing is queued or in flight (tests, shutdown); False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._messages:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def status(self) -> dict:
+        with self._cond:
+            pending = sorted(self._messages.values(), key=lambda m: m["due"])
+            return dict(self._stats, pending=len(pending),
+                        next_attempt_in=round(max(0.0, pending[0]["due"] - time.time()), 1) if pending else None)
+
+lead_outbox = LeadOutbox(LEAD_OUTBOX_DIR, LEAD_DEAD_LETTER,
+                         {"telegram": lambda subject, text: send_telegram(text),
+                          "email": lambda subject, text: send_email(subject, text)},
+                         workers=LEAD_NOTIFY_WORKERS, max_attempts=LEAD_NOTIFY_MAX_ATTEMPTS,
+                         retry_base=LEAD_NOTIFY_RETRY_BASE, retry_max=LEAD_NOTIFY_RETRY_MAX,
+                         digest_senders={"email": lambda msgs: send_email_digest(msgs)},
+                         digest_window=LEAD_EMAIL_DIGEST_SECONDS, digest_max=LEAD_EMAIL_DIGEST_MAX)
+
 def _now_date():
     return datetime.utcnow().date().isoformat()
 
@@ -371,6 +827,76 @@ def specs_to_table(specs: str):
             rows.append({"k": "Параметр", "v": p})
     return rows
 
+# Числа из характеристик: "до 7 т", "14,5 м", "17,5 т·м", "7000 кг", "5–7 т"
+SPEC_DIMENSIONS = (  # (name, keywords of the spec row, unit); "грузовой момент" is checked before "груз"
+    ("moment", ("момент",), "t*m"),
+    ("cargo", ("грузопод", "груз"), "t"),
+    ("outreach", ("вылет", "радиус"), "m"),
+    ("sections", ("секц",), None),
+)
+# a number may group thousands with a (non-breaking/thin) space: "3 200 кг"
+_SPEC_NUMBER = r"(?:\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+)(?:[.,]\d+)?"
+_SPEC_VALUE_RE = re.compile(rf"({_SPEC_NUMBER})(?:\s*[-–—]\s*({_SPEC_NUMBER}))?\s*([^\d]{{0,12}})")
+_SPEC_GROUP_SPACES_RE = re.compile(r"[ \u00a0\u202f]")
+_SPEC_UNITS = (  # unit spelling prefix (lowercase, no spaces/dots/·) -> (unit, factor)
+    (("кнм", "knm"), "t*m", 1 / 9.80665),
+    (("тм", "tm", "тоннм", "тонным", "тоннам"), "t*m", 1.0),
+    (("кг", "kg"), "t", 0.001),
+    (("т", "t"), "t", 1.0),
+    (("мм", "mm"), "m", 0.001),
+    (("см", "cm"), "m", 0.01),
+    (("м", "m"), "m", 1.0),
+)
+
+def parse_spec_value(text):
+    """
+    First number of a spec value with its unit: "до 7 т" -> (7.0, "t"), "7000 кг" -> (7.0, "t"),
+    "14,5 м" -> (14.5, "m"), "17,5 т·м" -> (17.5, "t*m"), "5–7 т" -> (7.0, "t") (upper bound),
+    "1 500 кг" -> (1.5, "t"), "6" -> (6.0, None). None when there is no number.
+    """
+    m = _SPEC_VALUE_RE.search(str(text or ""))
+    if not m:
+        return None
+    value = float(_SPEC_GROUP_SPACES_RE.sub("", m.group(2) or m.group(1)).replace(",", "."))
+    unit = re.sub(r"[\s.·*×/\-]", "", m.group(3).lower())
+    for prefixes, name, factor in _SPEC_UNITS:
+        if unit.startswith(prefixes):
+            return round(value * factor, 3), name
+    return value, None
+
+def spec_numbers(p) -> dict:
+    """{"cargo": t, "outreach": m, "sections": n, "moment": t·m} from specs_table rows and the separate fields."""
+    out = {}
+    units = {}
+    for r in p.get("specs_table") or []:
+        if not isinstance(r, dict):
+            continue
+        k, v = str(r.get("k") or "").lower(), str(r.get("v") or "")
+        for name, keywords, unit in SPEC_DIMENSIONS:
+            text = v
+            if not any(kw in k for kw in keywords):
+                # rows without a key: "Параметр: Грузовой момент 25.6 т/м" -> the number after the keyword
+                low = v.lower()
+                at = min((low.find(kw) + len(kw) for kw in keywords if kw in low), default=None)
+                if at is None:
+                    continue
+                text = v[at:]
+            if name not in out:
+                parsed = parse_spec_value(text)
+                if parsed is not None and parsed[1] in (unit, None):
+                    out[name], units[name] = parsed
+            break
+    for name, _, unit in SPEC_DIMENSIONS:
+        if name not in out and p.get(name):
+            parsed = parse_spec_value(p.get(name))
+            if parsed is not None and parsed[1] in (unit, None):
+                out[name], units[name] = parsed
+    if out.get("cargo", 0) >= 100 and units.get("cargo") is None:
+        out["cargo"] /= 1000  # "7000" with no unit: kilograms
+    if "sections" in out:
+        out["sections"] = float(math.floor(out["sections"] + 0.5))
+    return out
+
 def esc(s: str) -> str:
     return (s or "").replace("&","&amp;").replace("<","&lt;").replace(">","&gt;").replace('"',"&quot;").replace("'","&#39;")
 
@@ -415,7 +941,7 @@ def _parse_images_value(val):
 
 def get_product_images(p):
     """Return normalized list of images for product (max 10), fallback to placeholder."""
-    if not isinstance(p, dict):
+    if not isinstance(p, Mapping):
         return [_IMG_PLACEHOLDER]
     imgs = []
     if "images" in p:
@@ -429,7 +955,8 @@ def get_product_images(p):
         main = main.strip()
         if main not in imgs:
             imgs.insert(0, main)
-    imgs = [x for x in imgs if isinstance(x, str) and x.strip()]
+    # dedupe: aliases (image2.., img*, photo*) stay in the record, so re-normalizing must not add them twice
+    imgs = list(dict.fromkeys(x for x in imgs if isinstance(x, str) and x.strip()))
     if not imgs:
         imgs = [_IMG_PLACEHOLDER]
     return imgs[:10]
@@ -501,10 +1028,1698 @@ def normalize_products_list(prods):
         return out
     for x in prods:
         if isinstance(x, dict):
-            out.append(normalize_product(x))
+            out.append(product_cache.normalized(x))
     return out
 
 
+# ============================
+# Product cache (normalized records + card HTML)
+# ============================
+class ProductCache:
+    """
+    Bounded LRU shared by normalization and card rendering, keyed by a content
+    hash of the product as passed in. A product that did not change is normalized
+    and its card rendered once, however many times it is listed (catalog pages,
+    "Похожие товары", store reloads, later rebuilds in this process).
+
+    The key is blake2b over marshal.dumps(p, 0): ~4x cheaper than product_hash() and
+    stable within a process, which is all an in-memory cache needs (the rebuild
+    manifest keeps product_hash()). Cached normalized dicts are handed out as
+    shallow copies: callers may set keys, nested lists are shared and not mutated.
+    Pool workers are spawned, so each starts with an empty cache and its own counters.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(0, max_entries)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"normalize_hits": 0, "normalize_misses": 0, "card_hits": 0, "card_misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(p: dict):
+        if isinstance(p, Product):
+            p = p.to_dict()
+        try:
+            raw = marshal.dumps(p, 0)  # v0: no back-references/interning flags, same data -> same bytes
+        except ValueError:  # not plain JSON data
+            return product_hash(p)
+        return hashlib.blake2b(raw, digest_size=16).digest()
+
+    def _get(self, k):
+        with self._lock:
+            v = self._data.get(k)
+            if v is not None:
+                self._data.move_to_end(k)
+            return v
+
+    def _put(self, k, v):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._data[k] = v
+            self._data.move_to_end(k)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def normalized(self, p: dict) -> dict:
+        """normalize_product(p), memoized. On a miss p is normalized in place, as before."""
+        k = ("n", self.key(p))
+        hit = self._get(k)
+        if hit is not None:
+            self._count("normalize_hits")
+            return dict(hit)
+        self._count("normalize_misses")
+        out = normalize_product(p)
+        self._put(k, dict(out))
+        return out
+
+    def card(self, p: dict, render) -> str:
+        k = ("c", self.key(p))
+        hit = self._get(k)
+        if hit is not None:
+            self._count("card_hits")
+            return hit
+        self._count("card_misses")
+        html = render(p)
+        self._put(k, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts, entries=len(self._data), max_entries=self.max_entries)
+
+product_cache = ProductCache(PRODUCT_CACHE_SIZE)
+
+
+# ============================
+# Product model (compact in-memory form)
+# ============================
+_MISSING = object()
+_KEY_ORDERS = {}  # key order tuple -> shared instance (most products have the same few orders)
+
+def _interned(v):
+    return sys.intern(v) if type(v) is str and len(v) <= 64 else v
+
+class Product(Mapping):
+    """
+    Slotted, read-only form of a normalized product for long-lived caches
+    (ProductStore keeps one per product). Short repeated strings (category,
+    brand, city, status, ...) are interned, images is a tuple of str and
+    specs_table a tuple of (k, v) pairs. Unknown keys (image2.., custom admin
+    fields) go to `extra`; the original key order is kept as a shared tuple,
+    so to_dict() gives back exactly the dict (and JSON) it was built from.
+
+    A read-only collections.abc.Mapping for the code that expects dicts:
+    get(), p[key], `key in p`, keys(), items(), values(), dict(p); helpers that
+    accept either check isinstance(p, Mapping). Equality and hashing stay by
+    identity (caches compare snapshots with `is`).
+    """
+    FIELDS = (
+        "id", "slug", "category", "brand", "model", "year", "status", "price", "city",
+        "title", "short", "description", "specs", "cta", "cargo", "outreach", "sections",
+        "control", "featured", "featured_rank", "image", "images", "specs_table",
+    )
+    _INTERN = frozenset(("category", "brand", "model", "year", "status", "price", "city", "cta",
+                         "cargo", "outreach", "sections", "control", "featured_rank", "image"))
+    _FIELD_SET = frozenset(FIELDS)
+    __slots__ = FIELDS + ("_order", "_extra", "_packed")
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Product":
+        self = cls.__new__(cls)
+        extra = None
+        packed = 0  # bit 1: images packed to tuple, bit 2: specs_table packed to pairs
+        for k, v in d.items():
+            if k not in cls._FIELD_SET:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+                continue
+            if k in cls._INTERN:
+                v = _interned(v)
+            elif k == "images" and type(v) is list and all(type(x) is str for x in v):
+                v = tuple(v)
+                packed |= 1
+            elif k == "specs_table" and type(v) is list and all(type(r) is dict and list(r) == ["k", "v"] for r in v):
+                v = tuple((_interned(r["k"]), _interned(r["v"])) for r in v)
+                packed |= 2
+            object.__setattr__(self, k, v)
+        order = tuple(d)
+        object.__setattr__(self, "_order", _KEY_ORDERS.setdefault(order, order))
+        object.__setattr__(self, "_extra", extra)
+        object.__setattr__(self, "_packed", packed)
+        return self
+
+    def _value(self, k):
+        v = getattr(self, k, _MISSING) if k in self._FIELD_SET else (self._extra or {}).get(k, _MISSING)
+        if v is _MISSING:
+            return v
+        if k == "images" and self._packed & 1:
+            return list(v)
+        if k == "specs_table" and self._packed & 2:
+            return [{"k": a, "v": b} for a, b in v]
+        return v
+
+    def to_dict(self) -> dict:
+        return {k: self._value(k) for k in self._order}
+
+    def get(self, key, default=None):
+        v = self._value(key)
+        return default if v is _MISSING else v
+
+    def __getitem__(self, key):
+        v = self._value(key)
+        if v is _MISSING:
+            raise KeyError(key)
+        return v
+
+    def __contains__(self, key):
+        return key in self._order
+
+    def keys(self):
+        return self._order
+
+    def items(self):
+        return [(k, self._value(k)) for k in self._order]
+
+    def values(self):
+        return [self._value(k) for k in self._order]
+
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Product is read-only; build a new one with Product.from_dict()")
+
+    def __repr__(self):
+        return f"Product(id={self.get('id')!r}, slug={self.get('slug')!r})"
+
+
+# ============================
+# Product storage backends
+# ============================
+def _products_json_text(prods: list) -> str:
+    return json.dumps(prods, ensure_ascii=False, indent=2)
+
+def _file_stamp(path: Path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def apply_product_op(prods: list, op: dict) -> list:
+    """
+    Applies one journal op to a product list (in place) and returns it.
+    Ops carry whole records, so replaying a suffix of ops that is already
+    contained in `prods` leaves it unchanged (compaction is crash-safe).
+    """
+    kind, pid = op.get("op"), op.get("id")
+    if kind == "delete":
+        prods[:] = [x for x in prods if x.get("id") != pid]
+    elif kind in ("create", "update"):
+        rec = op.get("product")
+        if not isinstance(rec, (dict, Product)):
+            return prods
+        for i, cur in enumerate(prods):
+            if cur.get("id") == pid:
+                prods[i] = rec
+                break
+        else:
+            if kind == "create":
+                prods.append(rec)
+    return prods
+
+class JsonProductBackend:
+    """products.json is the data: every mutation rewrites the whole file."""
+    name = "json"
+    row_writes = False
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def stamp(self):
+        return _file_stamp(self.path)
+
+    def load(self) -> list:
+        return read_json(self.path, [])
+
+    def replace_all(self, prods: list):
+        write_json_atomic(self.path, prods)
+
+    def export(self, prods: list) -> bool:
+        """Writes normalized products back if they differ from the file. True if the data changed."""
+        return write_text_if_changed(self.path, _products_json_text(prods))[1]
+
+class JournaledJsonProductBackend(JsonProductBackend):
+    """
+    products.json + an append-only journal (data/products.journal.jsonl):
+    create/update/delete append one JSON line {"seq", "ts", "op", "id", "product"}
+    instead of rewriting the catalog. The data is products.json with the journal
+    replayed on top.
+
+    Compaction folds the journal into products.json: the journal is rotated to
+    products.journal.compacting.jsonl (new ops keep going to a fresh journal),
+    products.json is rewritten outside the lock and the rotated file is dropped.
+    It runs in a background thread once the journal passes PRODUCTS_JOURNAL_MAX_OPS
+    / PRODUCTS_JOURNAL_MAX_BYTES (checked after every append and at startup) and
+    only then: rebuilds read the in-memory catalog, so products.json alone lags
+    behind the journal in between. A crash at any point is harmless: the rotated
+    file is replayed on next load.
+
+    seq is monotonic across compactions (a fresh journal starts with a "base" line),
+    so changes_since(seq) gives consumers the exact ids changed after a point.
+    """
+    name = "json+journal"
+    row_writes = True
+
+    def __init__(self, path: Path, journal: Path, max_ops: int, max_bytes: int):
+        super().__init__(path)
+        self.journal = journal
+        self.rotated = journal.with_name(journal.name.replace(".jsonl", ".compacting.jsonl"))
+        self.max_ops = max_ops
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._epoch = 0          # bumped whenever products.json is replaced; a compaction started before it is void
+        self._compacting = False
+        self.seq = 0
+        self._ops = 0
+        self._bytes = 0
+        self._tail_checked = False  # repaired before the first append, not here: render workers import this module too
+        for f in (self.rotated, self.journal):
+            for op in self._read_ops(f):
+                self.seq = max(self.seq, int(op.get("seq") or 0))
+                if op.get("op") != "base":
+                    self._ops += 1
+        self._bytes = _file_stamp(self.journal)[1] if self.journal.exists() else 0
+
+    def _drop_torn_tail(self):
+        """A crash mid-append can leave a partial last line; cut it so the next op starts on its own line."""
+        try:
+            with open(self.journal, "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    print("WARN: dropping partial last line of", self.journal.name)
+                    f.truncate(data.rfind(b"\n") + 1)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _read_ops(path: Path) -> list:
+        out = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # a torn last line after a crash: everything before it is intact
+                        print("WARN: skipping broken journal line in", path.name)
+                        continue
+                    if isinstance(op, dict):
+                        out.append(op)
+        except OSError:
+            pass
+        return out
+
+    def stamp(self):
+        return (_file_stamp(self.path), _file_stamp(self.rotated), _file_stamp(self.journal))
+
+    def load(self) -> list:
+        with self._lock:
+            prods = read_json(self.path, [])
+            if not isinstance(prods, list):
+                prods = []
+            for f in (self.rotated, self.journal):
+                for op in self._read_ops(f):
+                    apply_product_op(prods, op)
+        return prods
+
+    def apply_ops(self, ops: list):
+        """Appends ops ({"op", "id", "product"?}) with one write and one fsync."""
+        if not ops:
+            return
+        with self._lock:
+            if not self._tail_checked:
+                self._drop_torn_tail()
+                self._tail_checked = True
+            ts = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+            chunks = []
+            for op in ops:
+                self.seq += 1
+                rec = {"seq": self.seq, "ts": ts, "op": op["op"], "id": str(op.get("id") or "")}
+                if op.get("product") is not None:
+                    rec["product"] = op["product"]
+                chunks.append(json.dumps(rec, ensure_ascii=False) + "\n")
+            data = "".join(chunks).encode("utf-8")
+            with open(self.journal, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._ops += len(ops)
+            self._bytes += len(data)
+        self.compact_if_due()
+
+    def compact_if_due(self) -> bool:
+        """Starts a background compaction if the journal is past a threshold (and none is running)."""
+        with self._lock:
+            due = bool(self._ops) and (self._ops >= self.max_ops or self._bytes >= self.max_bytes) and not self._compacting
+            if due:
+                self._compacting = True
+        if due:
+            threading.Thread(target=self._compact_in_background, name="products-compaction", daemon=True).start()
+        return due
+
+    def insert(self, p: dict):
+        self.apply_ops([{"op": "create", "id": p.get("id"), "product": p}])
+
+    def update(self, p: dict) -> bool:
+        self.apply_ops([{"op": "update", "id": p.get("id"), "product": p}])
+        return True
+
+    def delete(self, pid: str) -> bool:
+        self.apply_ops([{"op": "delete", "id": pid}])
+        return True
+
+    def _reset_journal(self):
+        """Caller holds the lock and has just made products.json current."""
+        self._write_base()
+        try:
+            self.rotated.unlink()
+        except OSError:
+            pass
+        self._ops = 0
+        self._epoch += 1
+
+    def _write_base(self):
+        line = json.dumps({"seq": self.seq, "op": "base"}) + "\n"
+        _write_text_atomic(self.journal, line)
+        self._bytes = len(line.encode("utf-8"))
+
+    def replace_all(self, prods: list):
+        # journal first: a crash before the new products.json loses edits the import
+        # overwrites anyway, while the other order would replay old ops over the import
+        with self._lock:
+            self._reset_journal()
+            write_json_atomic(self.path, prods)
+
+    def export(self, prods: list) -> bool:
+        """products.json is the compaction base here, not an export: only compact() rewrites it."""
+        return False
+
+    def compact(self) -> bool:
+        """Folds the journal into products.json. Returns False if there was nothing to do."""
+        with self._lock:
+            if not self._ops:
+                return False
+            epoch = self._epoch
+            if self.journal.exists():
+                if self.rotated.exists():
+                    # leftover of an interrupted compaction: keep op order, rotated first
+                    with open(self.rotated, "ab") as dst, open(self.journal, "rb") as src:
+                        shutil.copyfileobj(src, dst)
+                    self.journal.unlink()
+                else:
+                    os.replace(self.journal, self.rotated)
+            self._write_base()
+            self._ops = 0
+
+        prods = read_json(self.path, [])
+        if not isinstance(prods, list):
+            prods = []
+        for op in self._read_ops(self.rotated):
+            apply_product_op(prods, op)
+        text = _products_json_text(normalize_products_list(prods))
+
+        with self._lock:
+            if self._epoch != epoch:
+                return False  # replace_all/export rewrote products.json meanwhile, including these ops
+            _write_text_atomic(self.path, text)
+            try:
+                self.rotated.unlink()
+            except OSError:
+                pass
+            self._epoch += 1
+        return True
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print("WARN: products journal compaction failed:", repr(e))
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def changes_since(self, seq: int):
+        """[{"seq", "op", "id"}, ...] after seq, or None if those ops were already compacted away."""
+        with self._lock:
+            ops = self._read_ops(self.rotated) + self._read_ops(self.journal)
+        base = min((int(o.get("seq") or 0) for o in ops if o.get("op") == "base"), default=None)
+        if base is not None and seq < base:
+            return None
+        return [{"seq": o["seq"], "op": o["op"], "id": o.get("id")} for o in ops
+                if o.get("op") != "base" and int(o.get("seq") or 0) > seq]
+
+class SqliteProductBackend:
+    """
+    One row per product (JSON document + indexed id/slug/category); a mutation is
+    a single-row transaction. Row order is insertion order (rid), like the list
+    order in products.json. On first open an empty database is filled from
+    products.json; afterwards products.json is only an export (see export()).
+    """
+    name = "sqlite"
+    row_writes = True
+
+    def __init__(self, path: Path, json_path: Path):
+        self.path = path
+        self.json_path = json_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        """The shared connection; callers hold self._lock."""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS products (
+                    rid INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT, slug TEXT, category TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS products_id ON products(id);
+                CREATE INDEX IF NOT EXISTS products_slug ON products(slug);
+                CREATE INDEX IF NOT EXISTS products_category ON products(category);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO meta(key, value) VALUES ('generation', 0);
+            """)
+            if not conn.execute("SELECT 1 FROM products LIMIT 1").fetchone():
+                seed = normalize_products_list(read_json(self.json_path, []))
+                if seed:
+                    self._transaction(conn, lambda c: self._insert_all(c, seed))
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _transaction(conn, fn):
+        """Runs fn(conn) in one IMMEDIATE transaction and bumps the generation."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            out = fn(conn)
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return out
+
+    def _insert_all(self, conn, prods: list):
+        conn.executemany("INSERT INTO products(id, slug, category, data) VALUES (?, ?, ?, ?)",
+                         [self._row(p) for p in prods])
+
+    @staticmethod
+    def _row(p: dict):
+        return (str(p.get("id") or ""), str(p.get("slug") or ""), str(p.get("category") or "kmu"),
+                json.dumps(p, ensure_ascii=False))
+
+    def _write(self, fn):
+        with self._lock:
+            return self._transaction(self._db(), fn)
+
+    def stamp(self):
+        with self._lock:
+            return self._db().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def load(self) -> list:
+        with self._lock:
+            rows = self._db().execute("SELECT data FROM products ORDER BY rid").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def get(self, pid: str):
+        with self._lock:
+            row = self._db().execute("SELECT data FROM products WHERE id = ? ORDER BY rid LIMIT 1", (pid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def insert(self, p: dict):
+        self._write(lambda c: c.execute("INSERT INTO products(id, slug, category, data) VALUES (?, ?, ?, ?)", self._row(p)))
+
+    def update(self, p: dict) -> bool:
+        pid, slug, cat, data = self._row(p)
+        return self._write(lambda c: c.execute(
+            "UPDATE products SET slug = ?, category = ?, data = ? "
+            "WHERE rid = (SELECT rid FROM products WHERE id = ? ORDER BY rid LIMIT 1)",
+            (slug, cat, data, pid)).rowcount) > 0
+
+    def delete(self, pid: str) -> bool:
+        return self._write(lambda c: c.execute("DELETE FROM products WHERE id = ?", (pid,)).rowcount) > 0
+
+    def apply_ops(self, ops: list):
+        """All ops in one transaction."""
+        def fn(c):
+            for op in ops:
+                if op["op"] == "delete":
+                    c.execute("DELETE FROM products WHERE id = ?", (str(op["id"]),))
+                    continue
+                pid, slug, cat, data = self._row(op["product"])
+                hit = c.execute(
+                    "UPDATE products SET slug = ?, category = ?, data = ? "
+                    "WHERE rid = (SELECT rid FROM products WHERE id = ? ORDER BY rid LIMIT 1)",
+                    (slug, cat, data, pid)).rowcount
+                if not hit and op["op"] == "create":
+                    c.execute("INSERT INTO products(id, slug, category, data) VALUES (?, ?, ?, ?)", (pid, slug, cat, data))
+        self._write(fn)
+
+    def replace_all(self, prods: list):
+        def fn(c):
+            c.execute("DELETE FROM products")
+            self._insert_all(c, prods)
+        self._write(fn)
+
+    def export(self, prods: list) -> bool:
+        """Keeps products.json (static hosting, PHP endpoints, backups) in sync; the data itself did not change."""
+        write_text_if_changed(self.json_path, _products_json_text(prods))
+        return False
+
+def make_products_backend(name: str = None):
+    name = (name or PRODUCTS_BACKEND).lower()
+    if name == "sqlite":
+        return SqliteProductBackend(PRODUCTS_DB, PRODUCTS_JSON)
+    if name != "json":
+        print("WARN: unknown PRODUCTS_BACKEND, using json:", repr(name))
+    if PRODUCTS_JOURNAL:
+        return JournaledJsonProductBackend(PRODUCTS_JSON, PRODUCTS_JOURNAL_PATH,
+                                           PRODUCTS_JOURNAL_MAX_OPS, PRODUCTS_JOURNAL_MAX_BYTES)
+    return JsonProductBackend(PRODUCTS_JSON)
+
+
+# ============================
+# Product store (in-memory)
+# ============================
+class ProductChangeLog:
+    """
+    Bounded ring of (version, op, id) for the catalog versions a ProductStore went
+    through; op is "created", "updated" or "deleted". `floor` is the oldest version
+    a client can ask changes since: everything newer is still in the ring.
+    Not thread-safe on its own (the store's lock guards it).
+    """
+
+    def __init__(self, size: int, floor: int):
+        self.size = size
+        self.entries = deque()
+        self.floor = floor
+
+    def record(self, version: int, changes: list):
+        if len(changes) > self.size:
+            # one version bigger than the ring (CSV import): nothing before it can be served
+            self.entries.clear()
+            self.floor = version
+            return
+        self.entries.extend((version, op, pid) for op, pid in changes)
+        while len(self.entries) > self.size:
+            self.floor = self.entries.popleft()[0]
+
+    def since(self, version: int):
+        """Entries newer than version, oldest first; None when version is older than the ring."""
+        if version < self.floor:
+            return None
+        out = []
+        for e in reversed(self.entries):
+            if e[0] <= version:
+                break
+            out.append(e)
+        out.reverse()
+        return out
+
+def diff_products(old, new) -> list:
+    """[(op, id)] turning the product list old into new; unchanged products are the same objects in both."""
+    before = {_product_key(p): p for p in old}
+    out = []
+    for p in new:
+        k = _product_key(p)
+        o = before.pop(k, None)
+        if o is None:
+            out.append(("created", k))
+        elif o is not p:
+            out.append(("updated", k))
+    out.extend(("deleted", k) for k in before)
+    return out
+
+class ProductStore:
+    """
+    Process-wide cache of the normalized catalog and its JSON response bytes.
+
+    Every access asks the backend for its stamp (file (mtime, size) of products.json
+    and the journal, or the SQLite write generation); data is re-loaded and
+    re-normalized only when the stamp changed or after invalidate(). A reload builds
+    a new snapshot and swaps it in with one assignment, so request threads always
+    see a consistent (products, body, gzip body, version, modified, etag) tuple.
+    `modified` is a whole second that grows with every version (Last-Modified);
+    `etag` is a hash of the body, so it also survives server restarts.
+    `version` starts from the clock in milliseconds, so it keeps growing across
+    restarts; every swap is diffed into a ProductChangeLog (changes_since()).
+
+    Mutations go through the store: single-row writes on backends that have them,
+    otherwise the whole list is rewritten. If the snapshot was current before the
+    write, the change is applied to it in memory (the response bytes are then
+    re-serialized on first use) instead of re-reading the catalog.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._stamp = None
+        seed = int(time.time() * 1000)
+        self._snap = ([], b"[]", None, seed, 0, '"' + hashlib.blake2b(b"[]", digest_size=12).hexdigest() + '"')
+        self._changes = ProductChangeLog(PRODUCT_CHANGES_MAX, seed + 1)
+        self._loaded = False
+        self._derived = {}
+        self._derived_locks = {}
+
+    def _current(self):
+        stamp = self.backend.stamp()
+        if stamp is not None and stamp == self._stamp:
+            return self._snap
+        with self._lock:
+            stamp = self.backend.stamp()
+            if stamp is None or stamp != self._stamp:
+                # unchanged products keep their Product object, so derived() values see them as unchanged
+                old = {p.get("id"): p for p in self._snap[0]}
+                prods = []
+                for d in normalize_products_list(self.backend.load()):
+                    p = old.get(d.get("id"))
+                    prods.append(p if p is not None and p.keys() == tuple(d) and p.to_dict() == d else Product.from_dict(d))
+                self._swap(prods)
+                self._stamp = stamp
+            return self._snap
+
+    def _swap(self, prods):
+        """Installs a new unserialized snapshot and logs what changed; caller holds the lock."""
+        old, _, _, version, modified, _ = self._snap
+        # strictly increasing seconds: two versions never share a Last-Modified
+        self._snap = (prods, None, None, version + 1, max(int(time.time()), modified + 1), None)
+        if self._loaded:
+            self._changes.record(version + 1, diff_products(old, prods))
+        self._loaded = True
+
+    def changes_since(self, version: int):
+        """(current version, products, [(version, op, id)] after `version` or None if it is no longer known)."""
+        self._current()
+        with self._lock:
+            prods, _, _, current, _, _ = self._snap
+            if version > current:
+                return current, prods, None  # another process or a clock set back: cannot be diffed
+            return current, prods, self._changes.since(version)
+
+    def products(self) -> list:
+        """Normalized products as read-only Product objects (dict-like; to_dict() for a mutable copy)."""
+        return list(self._current()[0])
+
+    def response(self):
+        """(json bytes, gzip bytes or None, version, modified, etag) of the normalized list."""
+        snap = self._current()
+        if snap[1] is None:
+            with self._lock:
+                if self._snap is snap:
+                    prods, _, _, version, modified, _ = snap
+                    body = json.dumps([p.to_dict() for p in prods], ensure_ascii=False).encode("utf-8")
+                    gz = gzip.compress(body, 6, mtime=0) if len(body) >= PRECOMPRESS_MIN_BYTES else None
+                    etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+                    self._snap = snap = (prods, body, gz, version, modified, etag)
+                else:
+                    snap = self._snap
+            if snap[1] is None:
+                return self.response()
+        return snap[1:]
+
+    @property
+    def version(self) -> int:
+        return self._current()[3]
+
+    @property
+    def modified(self) -> int:
+        """Last-Modified second of the current version."""
+        return self._current()[4]
+
+    def derived(self, name: str, build):
+        """
+        build(products, previous) for the current snapshot, built once per version
+        (query indexes and the like). `previous` is the value built for an older
+        snapshot or None; unchanged products are the same objects in both.
+        While one thread builds, the others get the previous value (one version
+        behind, but consistent in itself) instead of waiting.
+        """
+        prods = self._current()[0]
+        hit = self._derived.get(name)
+        if hit is not None and hit[0] is prods:
+            return hit[1]
+        # one lock per name, not the store lock: a slow build must not hold up writes or other names
+        lock = self._derived_locks.setdefault(name, threading.Lock())
+        if not lock.acquire(blocking=hit is None):
+            return hit[1]
+        try:
+            hit = self._derived.get(name)
+            if hit is None or hit[0] is not prods:
+                hit = self._derived[name] = (prods, build(prods, hit[1] if hit else None))
+            return hit[1]
+        finally:
+            lock.release()
+
+    def invalidate(self):
+        """Forces a reload on next access (admin writes; mtime alone can miss same-size writes within one tick)."""
+        with self._lock:
+            self._stamp = None
+
+    def _mutate(self, write, op):
+        """Runs the backend write; applies op (or a list of ops) to the snapshot if it was current, else drops it."""
+        with self._lock:
+            fresh = self._stamp is not None and self.backend.stamp() == self._stamp
+            result = write()
+            if fresh:
+                prods = list(self._snap[0])
+                for o in (op if isinstance(op, list) else [op]):
+                    if o.get("product") is not None:
+                        o = dict(o, product=Product.from_dict(o["product"]))
+                    apply_product_op(prods, o)
+                self._swap(prods)
+                self._stamp = self.backend.stamp()
+            else:
+                self._stamp = None
+        return result
+
+    def _plain(self) -> list:
+        """Current catalog as plain dicts (whole-file writes)."""
+        return [p.to_dict() for p in self._current()[0]]
+
+    def get(self, pid: str):
+        getter = getattr(self.backend, "get", None)
+        if getter is not None:
+            return getter(pid)
+        for p in self._current()[0]:
+            if p.get("id") == pid:
+                return p.to_dict()
+        return None
+
+    def create(self, p: dict):
+        op = {"op": "create", "id": p.get("id"), "product": normalize_product(dict(p))}
+        if self.backend.row_writes:
+            self._mutate(lambda: self.backend.insert(p), op)
+        else:
+            prods = self._plain() + [p]
+            self._mutate(lambda: self.backend.replace_all(prods), op)
+
+    def update(self, p: dict) -> bool:
+        op = {"op": "update", "id": p.get("id"), "product": normalize_product(dict(p))}
+        if self.get(p.get("id")) is None:
+            return False
+        if self.backend.row_writes:
+            return self._mutate(lambda: self.backend.update(p), op)
+        prods = apply_product_op(self._plain(), op)
+        self._mutate(lambda: self.backend.replace_all(prods), op)
+        return True
+
+    def delete(self, pid: str) -> bool:
+        op = {"op": "delete", "id": pid}
+        if self.get(pid) is None:
+            return False
+        if self.backend.row_writes:
+            return self._mutate(lambda: self.backend.delete(pid), op)
+        prods = apply_product_op(self._plain(), op)
+        self._mutate(lambda: self.backend.replace_all(prods), op)
+        return True
+
+    def apply_batch(self, ops: list):
+        """Applies already validated ops ({"op": create|update|delete, "id", "product"?}) as one write."""
+        if not ops:
+            return
+        if self.backend.row_writes:
+            self._mutate(lambda: self.backend.apply_ops(ops), ops)
+            return
+        prods = self._plain()
+        for op in ops:
+            apply_product_op(prods, op)
+        self._mutate(lambda: self.backend.replace_all(prods), ops)
+
+    def save(self, prods: list):
+        """Replaces the whole catalog (CSV import)."""
+        self.backend.replace_all(prods)
+        self.invalidate()
+
+    def load_for_rebuild(self) -> list:
+        """Plain copy of the current catalog for the generator; backends that export products.json refresh it."""
+        prods = self._plain()
+        if self.backend.export(prods):
+            self.invalidate()
+        return prods
+
+product_store = ProductStore(make_products_backend())
+
+
+# ============================
+# Product mutations (single + batch)
+# ============================
+def new_product_id(taken=None) -> str:
+    n = int(time.time()*1000)
+    while taken is not None and f"p{n}" in taken:
+        n += 1
+    return f"p{n}"
+
+def merge_product_update(p: dict, cur: dict) -> dict:
+    """Admin "update": p replaces cur, but keeps flags/specs fields the form did not send."""
+    p["id"] = cur.get("id")
+    if "featured" not in p:
+        p["featured"] = cur.get("featured", False)
+    if "featured_rank" not in p:
+        p["featured_rank"] = cur.get("featured_rank", "")
+    if "cta" not in p:
+        p["cta"] = cur.get("cta", "Узнать цену")
+
+    for k in ("cargo","outreach","sections","control"):
+        if k not in p and k in cur:
+            p[k] = cur.get(k)
+
+    normalize_product(p)
+    p["featured"] = bool(p.get("featured", False))
+    p["featured_rank"] = (p.get("featured_rank") or "").strip()
+    return p
+
+# Derived on normalize: patching the source field must not keep the old derived value
+_PATCH_DERIVED = {
+    "specs": ("specs_table",),
+    **{k: ("specs", "specs_table") for k in ("cargo", "outreach", "sections", "control")},
+    "images": ("image",) + tuple(f"{k}{i}" for i in range(2, 11) for k in ("image", "img", "photo")),
+}
+
+def prepare_product_batch(raw_ops, current: list):
+    """
+    Validates a batch against the current catalog and turns it into store ops.
+
+    raw ops: {"op": "create", "product": {...}} | {"op": "update", "product": {"id", ...}}
+             | {"op": "patch", "id", "fields": {...}} | {"op": "delete", "id"}
+    Ops see the effect of earlier ops in the same batch (create then patch works).
+    Only touched products are normalized. Returns (ops, results, ok); when ok is
+    False nothing must be applied.
+    """
+    results, ops = [], []
+    if not isinstance(raw_ops, list) or not raw_ops:
+        return [], [{"ok": False, "error": "ops must be a non-empty list"}], False
+    if len(raw_ops) > BATCH_MAX_OPS:
+        return [], [{"ok": False, "error": f"too many ops (max {BATCH_MAX_OPS})"}], False
+
+    state = {}
+    for p in current:
+        state.setdefault(p.get("id"), p)
+    ok = True
+    for raw in raw_ops:
+        kind = raw.get("op") if isinstance(raw, dict) else None
+        res = {"ok": True, "op": kind}
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError("op must be an object")
+            if kind in ("create", "update") and not isinstance(raw.get("product"), dict):
+                raise ValueError("product must be an object")
+            if kind == "create":
+                p = dict(raw["product"])
+                p["id"] = new_product_id(state)
+                normalize_product(p)
+                p["featured"] = bool(p.get("featured", False))
+                p["featured_rank"] = (p.get("featured_rank") or "").strip()
+                state[p["id"]] = p
+                ops.append({"op": "create", "id": p["id"], "product": p})
+            elif kind in ("update", "patch"):
+                pid = raw["product"].get("id") if kind == "update" else raw.get("id")
+                if not pid:
+                    raise ValueError("id required")
+                cur = state.get(pid)
+                if cur is None:
+                    raise LookupError("not found")
+                if kind == "update":
+                    p = merge_product_update(dict(raw["product"]), cur)
+                else:
+                    fields = raw.get("fields")
+                    if not isinstance(fields, dict) or not fields:
+                        raise ValueError("fields must be a non-empty object")
+                    if "id" in fields and fields["id"] != pid:
+                        raise ValueError("id cannot be patched")
+                    p = dict(cur)
+                    for src, derived in _PATCH_DERIVED.items():
+                        if src in fields:
+                            for k in derived:
+                                if k not in fields:
+                                    p.pop(k, None)
+                    p.update(fields)
+                    normalize_product(p)
+                    p["featured"] = bool(p.get("featured", False))
+                    p["featured_rank"] = (p.get("featured_rank") or "").strip()
+                state[pid] = p
+                ops.append({"op": "update", "id": pid, "product": p})
+            elif kind == "delete":
+                pid = raw.get("id")
+                if not pid:
+                    raise ValueError("id required")
+                if pid not in state:
+                    raise LookupError("not found")
+                del state[pid]
+                ops.append({"op": "delete", "id": pid})
+            else:
+                raise ValueError("unknown op")
+            res["id"] = ops[-1]["id"]
+        except (ValueError, LookupError) as e:
+            ok = False
+            res = {"ok": False, "op": kind, "error": str(e).strip("'")}
+            pid = raw.get("id") if isinstance(raw, dict) else None
+            if not pid and isinstance(raw, dict) and isinstance(raw.get("product"), dict):
+                pid = raw["product"].get("id")
+            if pid:
+                res["id"] = pid
+        results.append(res)
+    return ops, results, ok
+
+
+# ============================
+# Search index (full text over the catalog)
+# ============================
+SEARCH_FIELD_WEIGHTS = (("title", 3.0), ("brand", 2.5), ("model", 2.5), ("short", 1.5),
+                        ("specs", 1.0), ("description", 0.5), ("year", 1.0))
+SEARCH_PREFIX_MIN = 2        # the last word of a query matches as a prefix from this length
+SEARCH_PREFIX_MAX_TERMS = 64  # and expands to at most this many index terms
+SEARCH_MAX_GROUPS = 256      # score groups of a multi-word query before falling back to per-product sums
+_SEARCH_TOKEN_RE = re.compile(r"[0-9a-zа-яё]+")
+_SEARCH_PARTS_RE = re.compile(r"[0-9]+|[^0-9]+")
+_CYRILLIC_RE = re.compile(r"[а-я]")
+# light stemmer: the longest of these endings is cut, keeping at least 3 letters
+_RU_ENDING_RE = re.compile(
+    r"^(.{3,}?)(иями|ями|ами|ого|его|ому|ему|ыми|ими|ией|ий|ый|ой|ая|яя|ое|ее|ые|ие|ую|юю|ам|ям|ах|ях|ом|ем|ов|ев|ей"
+    r"|ия|ии|ию|а|я|о|е|ы|и|у|ю|ь|й)$"
+)
+_TRANSLIT_TABLE = str.maketrans(RU_TRANSLIT)
+# Cyrillic letters typed for their Latin look-alikes in model codes ("РК 24001" = "PK 24001")
+_HOMOGLYPHS = str.maketrans("авекмнорстух", "abekmhopctyx")
+_HOMOGLYPH_WORD_RE = re.compile(r"[авекмнорстух]{1,4}")
+_SEARCH_WORD_CACHE = {}  # word of an indexed text -> its terms; the vocabulary of a catalog is small
+
+def _search_term(word: str) -> str:
+    """One lowercased word -> index term: ё→е, Russian endings cut, transliterated to Latin."""
+    word = word.replace("ё", "е")
+    if _CYRILLIC_RE.search(word):
+        m = _RU_ENDING_RE.match(word)
+        if m:
+            word = m.group(1)
+        word = word.translate(_TRANSLIT_TABLE)
+    return word
+
+def _word_terms(word: str, query: bool) -> tuple:
+    parts = _SEARCH_PARTS_RE.findall(word)
+    if len(parts) > 1 and not query:
+        parts = [word] + parts
+    terms = [_search_term(t) for t in parts]
+    if not query:
+        terms += [t.translate(_HOMOGLYPHS) for t in parts if _HOMOGLYPH_WORD_RE.fullmatch(t)]
+    return tuple(dict.fromkeys(t for t in terms if len(t) > 1 or t.isdigit()))
+
+def search_terms(text: str, query: bool = False) -> list:
+    """
+    Index terms of a text. Mixed letter/digit words also give their parts:
+    "pk23500" -> pk23500, pk, 23500; a query uses only the parts, so it matches "PK 23500" too.
+    """
+    words = _SEARCH_TOKEN_RE.findall(str(text or "").lower())
+    if query:
+        return [t for w in words for t in _word_terms(w, True)]
+    cache, out = _SEARCH_WORD_CACHE, []
+    for w in words:
+        terms = cache.get(w)
+        if terms is None:
+            terms = _word_terms(w, False)
+            if len(cache) < 200000:
+                cache[w] = terms
+        out.extend(terms)
+    return out
+
+def _search_text(p, field: str) -> str:
+    if field == "specs" and not (p.get("specs") or "").strip():
+        return " ".join(f"{k} {v}" for k, v in _spec_pairs(p))
+    if field == "title":
+        return _display_title(p)
+    return str(p.get(field) or "")
+
+def _spec_pairs(p):
+    for r in p.get("specs_table") or []:
+        if isinstance(r, dict):
+            yield r.get("k", ""), r.get("v", "")
+
+
+# ============================
+# Public catalog query (filters, sort, cursor)
+# ============================
+RANGE_FIELDS = tuple(name for name, _, _ in SPEC_DIMENSIONS)  # ?cargo_min=5&outreach_min=12&outreach_max=16
+PUBLIC_QUERY_PARAMS = ("category", "q", "brand", "year", "cargo", "outreach", "sections", "sort", "limit", "cursor") + \
+    tuple(f"{f}_{end}" for f in RANGE_FIELDS for end in ("min", "max"))
+FACET_FIELDS = ("brand", "year", "cargo", "outreach", "sections")
+PUBLIC_SORTS = ("relevance", "name_asc", "year_desc", "updated_desc",
+                "cargo_desc", "cargo_asc", "outreach_desc", "outreach_asc", "moment_desc")
+_FACET_SPEC_KEYWORDS = {
+    "cargo": ("грузопод", "груз", "грузовой"),
+    "outreach": ("вылет", "радиус"),
+    "sections": ("секц",),
+}
+_FACET_NUMBER_RE = re.compile(r"-?\d+(\.\d+)?")
+
+def _facet_number(val):
+    """firstNumber() of catalog-filters.js: "7.0 т" -> 7.0, "12,5 м" -> 12.5."""
+    m = _FACET_NUMBER_RE.search(str(val or "").replace(",", ".", 1))
+    return float(m.group(0)) if m else None
+
+def _js_number(x: float) -> str:
+    """String(x) as the browser prints it: 7.0 -> "7", 12.5 -> "12.5"."""
+    return str(int(x)) if x == int(x) else repr(x)
+
+def facet_keys(p) -> dict:
+    """Filter values of a product, same rules as computeFacets() in catalog-filters.js (None = not set)."""
+    out = {
+        "category": p.get("category") or "kmu",
+        "brand": (p.get("brand") or "").strip() or None,
+        "year": str(p.get("year") or "").strip() or None,
+    }
+    rows = p.get("specs_table") or []
+    for field, keywords in _FACET_SPEC_KEYWORDS.items():
+        raw = None
+        for r in rows:
+            k = str((r or {}).get("k") or "").lower() if isinstance(r, dict) else ""
+            if k and any(kw in k for kw in keywords):
+                raw = r.get("v")
+                break
+        num = _facet_number(raw)
+        if num is not None and field == "sections":
+            num = float(math.floor(num + 0.5))  # Math.round
+        out[field] = _js_number(num) if num is not None else None
+    return out
+
+def _display_title(p) -> str:
+    return p.get("title") or p.get("name") or ""
+
+_popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))  # int.bit_count: Python 3.10+
+_BYTE_BITS = [tuple(b for b in range(8) if v >> b & 1) for v in range(256)]
+_NONZERO_BYTE = re.compile(rb"[^\x00]")
+SORT_SUBSET_MAX = 4096  # fewer matches -> sort them, more -> walk the presorted order
+FILTER_FIELDS = ("category",) + FACET_FIELDS
+
+def _bitset(ix, nbytes: int) -> int:
+    ba = bytearray(nbytes)
+    for i in ix:
+        ba[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(ba, "little")
+
+class _CatalogDocs:
+    """
+    Append-only per-product data shared by consecutive CatalogIndex versions. A
+    product object is added once under a docno (its bit in every bitset) with its
+    filter keys, sort keys and search postings; versions differ only in which
+    docnos are live and in their order. Unchanged products are the same objects
+    in consecutive snapshots, so a new version indexes only new and changed ones.
+
+    Readers of older versions keep using it while a newer one appends: lists only
+    grow, and dicts that readers iterate are replaced rather than mutated.
+    """
+    LEVELS_CACHE = 256
+
+    def __init__(self):
+        self.docs = []          # docno -> product (keeps the object alive, so its id() stays unique)
+        self.docno_of = {}      # id(product) -> docno
+        self.years = []         # docno -> year (year_desc)
+        self.names = []         # docno -> name_asc key
+        self.updated = []       # docno -> updated_at (updated_desc)
+        self.labels = {}        # lowercased brand -> brand as first seen
+        self.masks = {f: {} for f in FILTER_FIELDS}  # field -> value -> bitset of docnos
+        self.numbers = {f: [] for f in RANGE_FIELDS}  # field -> docno -> spec_numbers() value or None
+        self.ranges = {f: ((), {}) for f in RANGE_FIELDS}  # field -> (sorted values, value -> bitset of docnos)
+        self.postings = {}      # term -> (docnos, weights), docnos ascending
+        self.terms = []         # sorted, for prefix lookups
+        self._levels = OrderedDict()  # term -> (posting length, {weight: frozenset of docnos})
+        self._levels_lock = threading.Lock()
+
+    def add(self, prods) -> None:
+        """Indexes products that are not in docno_of yet."""
+        values = {f: {} for f in FILTER_FIELDS}
+        numbers = {f: {} for f in RANGE_FIELDS}
+        new_terms = []
+        for p in prods:
+            d = len(self.docs)
+            keys = facet_keys(p)
+            label = keys["brand"]
+            if label:
+                keys["brand"] = label.lower()
+                self.labels.setdefault(keys["brand"], label)
+            for f in FILTER_FIELDS:
+                if keys[f] is not None:
+                    values[f].setdefault(keys[f], []).append(d)
+            self.years.append(int(_facet_number(p.get("year")) or 0))
+            self.names.append(_display_title(p).casefold().replace("ё", "е"))
+            self.updated.append(str(p.get("updated_at") or ""))
+            nums = spec_numbers(p)
+            for f in RANGE_FIELDS:
+                v = nums.get(f)
+                self.numbers[f].append(v)
+                if v is not None:
+                    numbers[f].setdefault(v, []).append(d)
+            weights = {}
+            for field, w in SEARCH_FIELD_WEIGHTS:
+                for t in search_terms(_search_text(p, field)):
+                    weights[t] = weights.get(t, 0.0) + w
+            for t, w in weights.items():
+                post = self.postings.get(t)
+                if post is None:
+                    post = self.postings[t] = (array("i"), array("f"))
+                    new_terms.append(t)
+                post[0].append(d)
+                post[1].append(w)
+            self.docs.append(p)
+            self.docno_of[id(p)] = d
+        nbytes = (len(self.docs) + 7) // 8
+        for f, vals in values.items():
+            masks = dict(self.masks[f])
+            for v, ix in vals.items():
+                masks[v] = masks.get(v, 0) | _bitset(ix, nbytes)
+            self.masks[f] = masks
+        for f, vals in numbers.items():
+            if vals:
+                masks = dict(self.ranges[f][1])
+                for v, ix in vals.items():
+                    masks[v] = masks.get(v, 0) | _bitset(ix, nbytes)
+                self.ranges[f] = (tuple(sorted(masks)), masks)
+        if new_terms:
+            self.terms = sorted(self.terms + new_terms)
+
+    def levels(self, term: str) -> dict:
+        """weight -> docnos having `term` with that field weight (cached, extended as the posting grows)."""
+        docs, weights = self.postings[term]
+        n = len(docs)
+        with self._levels_lock:
+            hit = self._levels.get(term)
+            if hit is not None:
+                self._levels.move_to_end(term)
+        if hit is not None and hit[0] == n:
+            return hit[1]
+        start, levels = (hit[0], dict(hit[1])) if hit is not None else (0, {})
+        new = {}
+        for d, w in zip(docs[start:n], weights[start:n]):
+            new.setdefault(w, []).append(d)
+        for w, ix in new.items():
+            levels[w] = levels[w].union(ix) if w in levels else frozenset(ix)
+        with self._levels_lock:
+            self._levels[term] = (n, levels)
+            while len(self._levels) > self.LEVELS_CACHE:
+                self._levels.popitem(last=False)
+        return levels
+
+class CatalogIndex:
+    """
+    Query structures over one store snapshot (ProductStore.derived builds it once
+    per version). Every filter value is a bitset (an int, bit = docno), so
+    combining filters is `&` and a facet count is a popcount: both run in C and
+    cost ~n/64 word operations. Pages in name/updated/year order are taken from
+    the presorted catalog without sorting the whole answer.
+
+    `q` goes through the inverted index: words are folded by search_terms()
+    (Cyrillic and Latin spellings meet in the transliteration of tools/build.py,
+    Палфингер = palfinger; Russian endings are cut, краны = кран), every word must
+    match, the last one also as a prefix. Relevance is BM25-like over field-weighted
+    term counts (title > brand/model > short > specs/year > description). Products
+    with equal per-word weights share one score, so a query is a handful of set
+    intersections over weight groups instead of a loop over every matching product.
+    """
+    K1 = 1.2
+    SEARCH_CACHE = 64
+    FACETS_CACHE = 256
+
+    def __init__(self, prods, previous=None):
+        shared = previous._docs if previous is not None else None
+        if shared is None or len(shared.docs) > 2 * len(prods) + 1000:
+            shared = _CatalogDocs()
+        shared.add([p for p in prods if id(p) not in shared.docno_of])
+        self._docs = shared
+        self.items = prods
+        self.n = len(prods)
+        docno_of = shared.docno_of
+        self.order = order = array("i", [docno_of[id(p)] for p in prods])  # docnos in catalog order
+        self.ndocs = len(shared.docs)
+        self.nbytes = (self.ndocs + 7) // 8
+        self.pos = pos = array("i", [-1]) * self.ndocs
+        for i, d in enumerate(order):
+            pos[d] = i
+        self.all = _bitset(order, self.nbytes)
+        self._orders = {}
+        self._searches = OrderedDict()
+        self._facets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bits(self, mask: int) -> list:
+        """Set bits of mask, ascending."""
+        raw = mask.to_bytes(self.nbytes, "little")
+        out = []
+        for m in _NONZERO_BYTE.finditer(raw):
+            j = m.start()
+            base = j << 3
+            out.extend(base + b for b in _BYTE_BITS[raw[j]])
+        return out
+
+    def _expand(self, word: str, prefix: bool) -> list:
+        postings, terms = self._docs.postings, self._docs.terms
+        if not prefix or len(word) < SEARCH_PREFIX_MIN:
+            return [word] if word in postings else []
+        lo = bisect.bisect_left(terms, word)
+        hi = bisect.bisect_left(terms, word + "\uffff", lo)
+        return terms[lo:min(hi, lo + SEARCH_PREFIX_MAX_TERMS)]
+
+    def search(self, q: str):
+        """(bitset of matches, [(score, docnos)] best first) or None when q has no searchable words."""
+        with self._lock:
+            hit = self._searches.get(q)
+            if hit is not None:
+                self._searches.move_to_end(q)
+                return hit
+        words = list(dict.fromkeys(search_terms(q, query=True)))
+        if not words:
+            return None
+        k1, shared = self.K1, self._docs
+        per_word = []
+        for k, word in enumerate(words):
+            by = {}
+            for t in self._expand(word, k == len(words) - 1):
+                for w, s in shared.levels(t).items():
+                    by[w] = by[w] | s if w in by else s
+            levels, seen = [], frozenset()
+            for w in sorted(by, reverse=True):  # a product under several expansions counts at its best weight
+                s = by[w] - seen if seen else by[w]
+                if s:
+                    levels.append((w, s))
+                    seen = seen | s
+            per_word.append((seen, levels))
+        per_word.sort(key=lambda x: len(x[0]))
+        cand = per_word[0][0]
+        for docs, _ in per_word[1:]:
+            cand = cand & docs
+        groups, scores = {0.0: cand}, None
+        for docs, levels in per_word:
+            idf = math.log(1.0 + (self.n - len(docs) + 0.5) / (len(docs) + 0.5))
+            parts = [(idf * w * (k1 + 1) / (w + k1), s) for w, s in levels]
+            if scores is None and len(groups) * len(parts) > SEARCH_MAX_GROUPS:
+                scores = {d: sc for sc, g in groups.items() for d in g}
+            if scores is not None:
+                for part, s in parts:
+                    for d in s & cand:
+                        scores[d] += part
+                continue
+            nxt = {}
+            for sc, g in groups.items():
+                for part, s in parts:
+                    x = g & s
+                    if x:
+                        key = sc + part
+                        nxt[key] = nxt[key] | x if key in nxt else x
+            groups = nxt
+        if scores is not None:
+            groups = {}
+            for d, sc in scores.items():
+                groups.setdefault(sc, set()).add(d)
+        ranked = sorted(groups.items(), key=lambda x: -x[0])
+        nbytes = max(self.nbytes, (max(cand) >> 3) + 1) if cand else self.nbytes
+        hit = (_bitset(cand, nbytes) & self.all, ranked)
+        with self._lock:
+            self._searches[q] = hit
+            while len(self._searches) > self.SEARCH_CACHE:
+                self._searches.popitem(last=False)
+        return hit
+
+    def _range_mask(self, field: str, lo, hi) -> int:
+        """Products with lo <= value <= hi (either end may be None): bisect the sorted values, OR their bitsets."""
+        values, masks = self._docs.ranges[field]
+        i = 0 if lo is None else bisect.bisect_left(values, lo)
+        j = len(values) if hi is None else bisect.bisect_right(values, hi)
+        out = 0
+        for v in values[i:j]:
+            out |= masks[v]
+        return out
+
+    def _cond_masks(self, conds: dict, q: str) -> dict:
+        out = {}
+        for f, k in conds.items():
+            out[f] = self._range_mask(f[:-len("_range")], *k) if f.endswith("_range") else self._docs.masks[f].get(k, 0)
+        found = self.search(q) if q else None
+        if found is not None:
+            out["q"] = found[0]
+        return out
+
+    @staticmethod
+    def _combine(masks: dict, base: int, skip=None) -> int:
+        """AND of the condition masks; `skip` leaves out one field (its value and its range)."""
+        for f, m in masks.items():
+            if skip is None or (f != skip and f != skip + "_range"):
+                base &= m
+        return base
+
+    def facets(self, conds: dict, q: str = "", masks=None) -> dict:
+        """value -> count per filter field; each field is counted without its own selection."""
+        if masks is None:
+            masks = self._cond_masks(conds, q)
+        labels = self._docs.labels
+        out = {}
+        for f in FACET_FIELDS:
+            base = self._combine(masks, self.all, skip=f)
+            counts = {}
+            for v, m in self._docs.masks[f].items():
+                c = _popcount(base & m)
+                if c:
+                    counts[labels[v] if f == "brand" else v] = c
+            out[f] = counts
+        return out
+
+    def facet_counts(self, conds: dict, q: str = "", masks=None) -> tuple:
+        """(total, facets) of a selection; memoized, so each selection is counted once per catalog version."""
+        key = (tuple(sorted(conds.items())), q)
+        with self._lock:
+            hit = self._facets.get(key)
+            if hit is not None:
+                self._facets.move_to_end(key)
+                return hit
+        if masks is None:
+            masks = self._cond_masks(conds, q)
+        hit = (_popcount(self._combine(masks, self.all)), self.facets(conds, q, masks))
+        with self._lock:
+            self._facets[key] = hit
+            while len(self._facets) > self.FACETS_CACHE:
+                self._facets.popitem(last=False)
+        return hit
+
+    def _order(self, sort: str) -> tuple:
+        """(docnos in sort order, rank of each docno); ties keep the catalog order."""
+        hit = self._orders.get(sort)
+        if hit is None:
+            if sort == "relevance":
+                return self.order, self.pos
+            shared = self._docs
+            if sort == "name_asc":
+                order = sorted(self.order, key=shared.names.__getitem__)
+            elif sort == "year_desc":
+                years = shared.years
+                order = sorted(self.order, key=lambda d: -years[d])
+            elif sort.endswith(("_asc", "_desc")) and sort.rsplit("_", 1)[0] in RANGE_FIELDS:
+                # numeric spec; products without the value go last either way
+                field, direction = sort.rsplit("_", 1)
+                vals = shared.numbers[field]
+                order = sorted((d for d in self.order if vals[d] is not None), key=vals.__getitem__,
+                               reverse=direction == "desc")
+                order += [d for d in self.order if vals[d] is None]
+            else:  # updated_desc; reverse=True keeps equal timestamps in catalog order
+                order = sorted(self.order, key=shared.updated.__getitem__, reverse=True)
+            rank = array("i", [-1]) * self.ndocs
+            for r, d in enumerate(order):
+                rank[d] = r
+            hit = self._orders[sort] = (order, rank)
+        return hit
+
+    def _take(self, docs, member: bytes, sort: str, skip: int, take: int, count: int) -> tuple:
+        """
+        Up to `take` docnos of `docs` (a bitset when member is None, else an iterable
+        filtered by the member bytes) in sort order after the first `skip`; (docnos, skip left).
+        """
+        order, rank = self._order(sort)
+        if count <= SORT_SUBSET_MAX:
+            if member is None:
+                ix = self._bits(docs)
+            else:
+                nd = self.ndocs
+                ix = [d for d in docs if d < nd and member[d >> 3] >> (d & 7) & 1]
+            ix.sort(key=rank.__getitem__)
+            if skip >= len(ix):
+                return [], skip - len(ix)
+            return ix[skip:skip + take], 0
+        if member is None:
+            member, docs = docs.to_bytes(self.nbytes, "little"), None
+        out = []
+        for d in order:
+            if member[d >> 3] >> (d & 7) & 1 and (docs is None or d in docs):
+                if skip:
+                    skip -= 1
+                else:
+                    out.append(d)
+                    if len(out) == take:
+                        break
+        return out, skip
+
+    def page(self, conds: dict, q: str = "", sort: str = "relevance", start: int = 0, limit: int = 24):
+        """(positions of the page, total, facets)."""
+        masks = self._cond_masks(conds, q)
+        mask = self._combine(masks, self.all)
+        total, facets = self.facet_counts(conds, q, masks)
+        if not limit or start >= total:
+            return [], total, facets
+        if sort != "relevance" or "q" not in masks:
+            res, _ = self._take(mask, None, sort, start, limit, total)
+        else:  # by score, catalog order within a score
+            member = mask.to_bytes(self.nbytes, "little")
+            res = []
+            for _, docs in self.search(q)[1]:
+                got, start = self._take(docs, member, "relevance", start, limit - len(res), len(docs))
+                res.extend(got)
+                if len(res) == limit:
+                    break
+        return [self.pos[d] for d in res], total, facets
+
+def parse_public_query(qs: dict) -> dict:
+    """Query-string params of /api/public/products -> normalized query; ValueError on bad input."""
+    def one(name):
+        return (qs.get(name) or [""])[-1].strip()
+    conds = {}
+    if one("category"):
+        conds["category"] = one("category")
+    for f in FACET_FIELDS:
+        if one(f):
+            conds[f] = one(f).lower() if f == "brand" else one(f)
+    for f in RANGE_FIELDS:
+        lo, hi = one(f + "_min"), one(f + "_max")
+        if lo or hi:
+            try:
+                bounds = tuple(float(x.replace(",", ".")) if x else None for x in (lo, hi))
+            except ValueError:
+                bounds = (math.nan,)
+            if not all(x is None or math.isfinite(x) for x in bounds):
+                raise ValueError(f"{f}_min and {f}_max must be numbers")
+            conds[f + "_range"] = bounds
+    sort = one("sort") or "relevance"
+    if sort not in PUBLIC_SORTS:
+        raise ValueError("sort must be one of: " + ", ".join(PUBLIC_SORTS))
+    try:
+        limit = int(one("limit")) if one("limit") else PUBLIC_API_DEFAULT_LIMIT
+        cursor = int(one("cursor") or "0")
+    except ValueError:
+        raise ValueError("limit and cursor must be integers")
+    if limit < 0 or cursor < 0:
+        raise ValueError("limit and cursor must be >= 0")
+    return {"conds": conds, "q": one("q").lower(), "sort": sort,
+            "limit": min(limit, PUBLIC_API_MAX_LIMIT), "cursor": cursor}
+
+def catalog_index() -> CatalogIndex:
+    """Index of the current catalog version (warmed after each rebuild and at startup)."""
+    return product_store.derived("catalog_index", CatalogIndex)
+
+def public_products_page(query: dict, fields=None, columnar: bool = False) -> dict:
+    """
+    One page of the filtered catalog + total and facet counts (limit=0: counts only).
+    `fields` projects the items; columnar puts them under "columns" (encode_columns()) instead of "items".
+    """
+    index = catalog_index()
+    start, limit = query["cursor"], query["limit"]
+    res, total, facets = index.page(query["conds"], query["q"], query["sort"], start, limit)
+    if columnar:
+        page = {"columns": encode_columns([index.items[i] for i in res], fields)}
+    else:
+        page = {"items": [project_product(index.items[i], fields) for i in res]}
+    return {
+        **page,
+        "total": total,
+        "next_cursor": str(start + limit) if limit and start + limit < total else None,
+        "facets": facets,
+    }
+
+def public_facets(query: dict) -> dict:
+    """/api/public/facets: value -> count per filter field for the category and the current selections."""
+    total, facets = catalog_index().facet_counts(query["conds"], query["q"])
+    return {"category": query["conds"].get("category"), "total": total, "facets": facets}
+
+SEARCH_RESULT_FIELDS = ("id", "slug", "category", "title", "brand", "model", "year", "price", "status", "city", "short", "image")
+
+def public_search(query: dict) -> dict:
+    """/api/public/search: ranked hits as light cards (no description/specs)."""
+    index = catalog_index()
+    start, limit = query["cursor"], query["limit"]
+    res, total, _ = index.page(query["conds"], query["q"], "relevance", start, limit)
+    items = []
+    for i in res:
+        p = index.items[i]
+        item = {k: p.get(k) for k in SEARCH_RESULT_FIELDS if p.get(k) not in (None, "")}
+        item["url"] = f"/catalog/{p.get('category') or 'kmu'}/{p.get('slug', '')}/"
+        items.append(item)
+    return {
+        "q": query["q"],
+        "items": items,
+        "total": total,
+        "next_cursor": str(start + limit) if limit and start + limit < total else None,
+    }
+
+# ?fields=id,slug,title&format=columns on /api/public/products
+PUBLIC_FEED_FORMATS = ("rows", "columns")
+# fields= accepts product keys only; kept in this order, so a==b,a and one cache entry per set
+PUBLIC_FEED_FIELDS = Product.FIELDS + ("name", "popular", "updated_at")
+_PUBLIC_FEED_FIELD_RANK = {f: i for i, f in enumerate(PUBLIC_FEED_FIELDS)}
+
+def parse_feed_params(qs: dict) -> tuple:
+    """(fields in canonical order or None for all, columnar) from the query string; ValueError on bad input."""
+    raw = (qs.get("fields") or [""])[-1]
+    names = set(f.strip() for f in raw.split(",") if f.strip())
+    unknown = sorted(names - _PUBLIC_FEED_FIELD_RANK.keys())
+    if unknown:
+        raise ValueError("unknown field: " + unknown[0][:64])
+    fields = tuple(sorted(names, key=_PUBLIC_FEED_FIELD_RANK.get)) or None
+    fmt = (qs.get("format") or [""])[-1].strip() or "rows"
+    if fmt not in PUBLIC_FEED_FORMATS:
+        raise ValueError("format must be one of: " + ", ".join(PUBLIC_FEED_FORMATS))
+    return fields, fmt == "columns"
+
+def project_product(p, fields) -> dict:
+    """The product's dict, or only `fields` of it (in that order, missing ones left out)."""
+    if fields is None:
+        return p.to_dict()
+    return {k: p[k] for k in fields if k in p}
+
+def encode_columns(prods, fields=None) -> dict:
+    """
+    Column-wise form of a product list: one array per field (null where a product
+    has no such key). Columns of repeated strings (brand, city, status, category...)
+    hold indexes into the shared `strings` table and are listed in `encoded`.
+    """
+    if fields is None:
+        fields = list(dict.fromkeys(k for p in prods for k in p.keys()))
+    strings, index = [], {}
+    columns, encoded = {}, []
+    for f in fields:
+        col = [p.get(f) for p in prods]
+        present = [v for v in col if v is not None]
+        if present and all(type(v) is str for v in present) and len(set(present)) * 2 <= len(present):
+            out = []
+            for v in col:
+                if v is not None:
+                    i = index.get(v)
+                    if i is None:
+                        i = index[v] = len(strings)
+                        strings.append(v)
+                    v = i
+                out.append(v)
+            col = out
+            encoded.append(f)
+        columns[f] = col
+    return {"format": "columns", "count": len(prods), "fields": list(fields),
+            "columns": columns, "strings": strings, "encoded": encoded}
+
+def encode_feed(prods, fields, columnar: bool) -> bytes:
+    if columnar:
+        data = encode_columns(prods, fields)
+    else:
+        data = [project_product(p, fields) for p in prods]
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class PublicFeeds:
+    """
+    Encoded projections of the whole catalog for one store version (ProductStore.derived),
+    a few kept. A missing variant is built by one thread; concurrent requests for
+    the same variant wait for it instead of encoding the catalog again.
+    """
+    MAX_VARIANTS = 16
+
+    def __init__(self, prods, previous=None):
+        self.prods = prods
+        self._variants = OrderedDict()
+        self._building = {}  # key -> lock held while that variant is encoded
+        self._lock = threading.Lock()
+
+    def get(self, fields, columnar: bool) -> tuple:
+        """(json bytes, gzip bytes or None, etag); fields as parse_feed_params returns them."""
+        key = (fields, columnar)
+        with self._lock:
+            hit = self._variants.get(key)
+            if hit is not None:
+                self._variants.move_to_end(key)
+                return hit
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                hit = self._variants.get(key)
+            if hit is None:
+                body = encode_feed(self.prods, fields, columnar)
+                gz = gzip.compress(body, 6, mtime=0) if len(body) >= PRECOMPRESS_MIN_BYTES else None
+                hit = (body, gz, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"')
+                with self._lock:
+                    self._variants[key] = hit
+                    while len(self._variants) > self.MAX_VARIANTS:
+                        self._variants.popitem(last=False)
+                    self._building.pop(key, None)
+        return hit
+
+
+def public_changes(since: int, fields=None) -> dict:
+    """
+    /api/public/products/changes?since=<version>: products created/updated/deleted after
+    that version, one entry per id (its net change, current record), or full_resync
+    when the version is older than the change ring.
+    """
+    version, prods, log = product_store.changes_since(since)
+    if log is None:
+        return {"version": version, "since": since, "full_resync": True, "changes": [], "url": "/api/public/products"}
+    net = {}  # id -> [first op, version of the last change]
+    for v, op, pid in log:
+        hit = net.get(pid)
+        if hit is None:
+            net[pid] = [op, v]
+        else:
+            hit[1] = v
+    current = {}
+    if net:
+        for p in prods:
+            k = _product_key(p)
+            if k in net:
+                current[k] = p
+    changes = []
+    for pid, (first, v) in sorted(net.items(), key=lambda kv: kv[1][1]):
+        p = current.get(pid)
+        if p is None:
+            if first == "created":
+                continue  # created and deleted again since `since`
+            changes.append({"op": "deleted", "id": pid, "version": v})
+        else:
+            changes.append({"op": "created" if first == "created" else "updated", "id": pid, "version": v,
+                            "product": project_product(p, fields)})
+    return {"version": version, "since": since, "full_resync": False, "changes": changes}
+
+
 # --------------------------
 # Upload helpers (NO cgi)
 # --------------------------
@@ -772,7 +2987,83 @@ def site_footer():
 </footer>
 """.strip()
 
+# ============================
+# Compiled templates + shared fragments
+# ============================
+class Template:
+    """
+    Page skeleton compiled once into literal chunks around {{name}} slots.
+    render() only joins strings: no parsing or formatting per page.
+    """
+    _SLOT = re.compile(r"\{\{(\w+)\}\}")
+
+    def __init__(self, src: str):
+        pieces = self._SLOT.split(src)
+        self.literals = tuple(pieces[0::2])
+        self.slots = tuple(pieces[1::2])
+
+    def render(self, **ctx) -> str:
+        out = [self.literals[0]]
+        for name, lit in zip(self.slots, self.literals[1:]):
+            out.append(ctx[name])
+            out.append(lit)
+        return "".join(out)
+
+_fragments = {}
+
+def fragment(key: str, build):
+    """Invariant HTML/JSON (header per section, footer, static JSON-LD), built once per rebuild."""
+    v = _fragments.get(key)
+    if v is None:
+        v = _fragments[key] = build()
+    return v
+
+def reset_fragments():
+    """Called at the start of every rebuild so SITE_URL/footer year changes are picked up."""
+    _fragments.clear()
+
+def _ld_json(*dynamic) -> str:
+    """Same bytes as json.dumps([org_ld(), website_ld(), *dynamic], ensure_ascii=False)."""
+    parts = [
+        fragment("ld:org", lambda: json.dumps(org_ld(), ensure_ascii=False)),
+        fragment("ld:website", lambda: json.dumps(website_ld(), ensure_ascii=False)),
+    ]
+    for item in dynamic:
+        if isinstance(item, str):
+            parts.append(item)
+        else:
+            parts.append(json.dumps(item, ensure_ascii=False))
+    return "[" + ", ".join(parts) + "]"
+
+def _header(active="/catalog/"):
+    return fragment(f"header:{active}", lambda: site_header(active))
+
+def _footer():
+    return fragment("footer", site_footer)
+
+
+_CARD_TPL = Template("""
+    <article class="product">
+      <div class="pimg">
+        {{carousel}}
+        <a class="pimg-link" href="{{href}}" aria-label="Открыть карточку"></a>
+      </div>
+      <div class="pbody">
+        <h3 class="ptitle"><a href="{{href}}">{{title}}</a></h3>
+        <p class="muted">{{short}}</p>
+        <div class="meta">{{tags}}</div>
+        <div class="actions">
+          <a class="btn sm" href="{{href}}">Подробнее</a>
+          <a class="btn primary sm" href="{{href}}#request">Узнать цену</a>
+        </div>
+      </div>
+    </article>
+    """.strip())
+
 def render_product_card(p):
+    return product_cache.card(p, _render_product_card)
+
+def _render_product_card(p):
     p = normalize_product(p)
     href = f"/catalog/{esc(p.get('category','kmu'))}/{esc(p.get('slug',''))}/"
     title = esc(p.get("title") or p.get("name") or "")
@@ -787,28 +3078,15 @@ def render_product_card(p):
     if city: tags.append(f'<span class="tag">{city}</span>')
     tags.append(f'<span class="tag">{price}</span>')
 
-    return f"""
-    <article class="product">
-      <div class="pimg">
-        {carousel_html(images, title)}
-        <a class="pimg-link" href="{href}" aria-label="Открыть карточку"></a>
-      </div>
-      <div class="pbody">
-        <h3 class="ptitle"><a href="{href}">{title}</a></h3>
-        <p class="muted">{short}</p>
-        <div class="meta">{''.join(tags)}</div>
-        <div class="actions">
-          <a class="btn sm" href="{href}">Подробнее</a>
-          <a class="btn primary sm" href="{href}#request">Узнать цену</a>
-        </div>
-      </div>
-    </article>
-    """.strip()
-
-def render_catalog_page(cat, prods):
-    cards = "\n".join([render_product_card(p) for p in prods if (p.get("category") or "kmu") == cat])
+    return _CARD_TPL.render(
+        carousel=carousel_html(images, title),
+        href=href,
+        title=title,
+        short=short,
+        tags="".join(tags),
+    )
 
-    filters = f"""
+_CATALOG_FILTERS_HTML = """
       <div class="card pad catalog-filters">
         <div class="filters-grid">
           <label class="field filters-search">
@@ -848,6 +3126,8 @@ def render_catalog_page(cat, prods):
               <option value="name_asc">По названию (A→Z)</option>
               <option value="year_desc">По году (новые сверху)</option>
               <option value="updated_desc">По обновлению</option>
+              <option value="cargo_desc">По грузоподъёмности</option>
+              <option value="outreach_desc">По вылету</option>
             </select>
           </label>
         </div>
@@ -857,54 +3137,215 @@ def render_catalog_page(cat, prods):
           <button class="btn btn-ghost" type="button" id="f_clear">Сбросить</button>
         </div>
 
-        <div class="muted small">Фильтры работают на клиенте и не мешают SEO: страницы товаров остаются статическими.</div>
+        <div class="muted small">Фильтры не перезагружают страницу и не мешают SEO: страницы товаров остаются статическими.</div>
       </div>
     """
 
-    return f"""<!doctype html>
+_CATALOG_TPL = Template("""<!doctype html>
 <html lang="ru">
 <head>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width,initial-scale=1" />
-  <title>Каталог {cat.upper()} — Мир манипуляторов</title>
-  <meta name="description" content="Каталог {cat.upper()}: товары в наличии и под заказ. Детальные страницы, характеристики и форма запроса цены." />
-  <link rel="canonical" href="{abs_url(f"/catalog/{cat}/")}" />
+  <title>Каталог {{CAT}}{{page_suffix}} — Мир манипуляторов</title>
+  <meta name="description" content="Каталог {{CAT}}: товары в наличии и под заказ. Детальные страницы, характеристики и форма запроса цены." />
+  <link rel="canonical" href="{{canonical}}" />{{rel_links}}
   <meta name="robots" content="index, follow" />
-  <meta property="og:title" content="Каталог {cat.upper()} — Мир манипуляторов" />
-  <meta property="og:description" content="Каталог {cat.upper()}: товары в наличии и под заказ. Детальные страницы, характеристики и форма запроса цены." />
+  <meta property="og:title" content="Каталог {{CAT}}{{page_suffix}} — Мир манипуляторов" />
+  <meta property="og:description" content="Каталог {{CAT}}: товары в наличии и под заказ. Детальные страницы, характеристики и форма запроса цены." />
   <meta property="og:type" content="website" />
-  <meta property="og:url" content="{abs_url(f"/catalog/{cat}/")}" />
-  <meta property="og:image" content="{abs_url("/assets/img/favicon.svg")}" />
+  <meta property="og:url" content="{{canonical}}" />
+  <meta property="og:image" content="{{og_image}}" />
   <meta name="twitter:card" content="summary" />
-  <script type="application/ld+json">{json.dumps([org_ld(), website_ld(), breadcrumb_ld([("Главная","/"),("Каталог","/catalog/"),(cat.upper(), f"/catalog/{cat}/")])], ensure_ascii=False)}</script>
+  <script type="application/ld+json">{{ld_json}}</script>
   <link rel="stylesheet" href="/assets/css/styles.css" />
 </head>
 <body>
-  {site_header("/catalog/")}
+  {{header}}
   <main class="container">
     <section class="section">
       <nav class="breadcrumbs" aria-label="breadcrumb">
   <a href="/">Главная</a><span class="bc-sep">/</span>
   <a href="/catalog/">Каталог</a><span class="bc-sep">/</span>
-  <span>{cat.upper()}</span>
+  <span>{{CAT}}</span>
 </nav>
-<h1>Каталог: {cat.upper()}</h1>
+<h1>Каталог: {{CAT}}</h1>
       <p class="lead">Нажми на карточку, чтобы открыть детальную страницу товара с характеристиками и формой запроса.</p>
-      {filters}
+      {{filters}}
       <div class="products" id="catalogGrid">
-        {cards if cards.strip() else '<p class="muted">Пока нет товаров в этой категории.</p>'}
+        {{cards}}
       </div>
+      {{pager}}
     </section>
   </main>
-  {site_footer()}
+  {{footer}}
   <script src="/assets/js/main.js"></script>
-  <script>window.__CATALOG_CATEGORY = "{cat}";</script>
+  <script>window.__CATALOG_CATEGORY = "{{cat}}"; window.__CATALOG_PAGE = {{page}}; window.__CATALOG_DATA_URL = {{data_url}};</script>
   <script src="/assets/js/catalog-filters.js"></script>
 </body>
-</html>"""
+</html>""")
 
-def render_product_page(p, prods):
-    p = normalize_product(p)
+_PAGER_DIR = "page"  # /catalog/<cat>/page/N/ (a product with this slug would shadow the pager)
+
+def catalog_page_count(n: int) -> int:
+    if CATALOG_PAGE_SIZE <= 0 or n <= 0:
+        return 1
+    return -(-n // CATALOG_PAGE_SIZE)
+
+def catalog_page_path(cat: str, page: int) -> str:
+    return f"/catalog/{cat}/" if page <= 1 else f"/catalog/{cat}/{_PAGER_DIR}/{page}/"
+
+def _pager_html(cat: str, page: int, pages: int) -> str:
+    if pages <= 1:
+        return ""
+    shown = sorted({1, pages} | {n for n in range(page - 2, page + 3) if 1 <= n <= pages})
+    items = []
+    if page > 1:
+        items.append(f'<a class="btn ghost" rel="prev" href="{catalog_page_path(cat, page - 1)}">← Назад</a>')
+    prev = 0
+    for n in shown:
+        if n - prev > 1:
+            items.append('<span class="pager-gap">…</span>')
+        if n == page:
+            items.append(f'<span class="btn primary" aria-current="page">{n}</span>')
+        else:
+            items.append(f'<a class="btn ghost" href="{catalog_page_path(cat, n)}">{n}</a>')
+        prev = n
+    if page < pages:
+        items.append(f'<a class="btn ghost" rel="next" href="{catalog_page_path(cat, page + 1)}">Вперёд →</a>')
+    return '<nav class="pager" id="catalogPager" aria-label="Страницы каталога">' + "".join(items) + "</nav>"
+
+def render_catalog_page(cat, prods, page: int = 1, data_url: str = ""):
+    """Page `page` of the category; prods is the whole catalog, data_url the category's shard (write_catalog_shards())."""
+    members = [p for p in prods if (p.get("category") or "kmu") == cat]
+    pages = catalog_page_count(len(members))
+    page = min(max(1, page), pages)
+    if CATALOG_PAGE_SIZE > 0:
+        members = members[(page - 1) * CATALOG_PAGE_SIZE:page * CATALOG_PAGE_SIZE]
+    return render_catalog_slice(cat, members, page, pages, data_url)
+
+def render_catalog_slice(cat, items, page: int = 1, pages: int = 1, data_url: str = ""):
+    """Renders one catalog page from the products already picked for it."""
+    cards = "\n".join([render_product_card(p) for p in items])
+    path = catalog_page_path(cat, page)
+    rel_links = ""
+    if page > 1:
+        rel_links += f'\n  <link rel="prev" href="{abs_url(catalog_page_path(cat, page - 1))}" />'
+    if page < pages:
+        rel_links += f'\n  <link rel="next" href="{abs_url(catalog_page_path(cat, page + 1))}" />'
+    crumbs = [("Главная","/"),("Каталог","/catalog/"),(cat.upper(), f"/catalog/{cat}/")]
+    if page > 1:
+        crumbs.append((f"Страница {page}", path))
+
+    return _CATALOG_TPL.render(
+        CAT=cat.upper(),
+        cat=cat,
+        page_suffix=f" — страница {page}" if page > 1 else "",
+        canonical=abs_url(path),
+        rel_links=rel_links,
+        og_image=fragment("og:favicon", lambda: abs_url("/assets/img/favicon.svg")),
+        ld_json=_ld_json(breadcrumb_ld(crumbs)),
+        header=_header("/catalog/"),
+        filters=_CATALOG_FILTERS_HTML,
+        cards=cards if cards.strip() else '<p class="muted">Пока нет товаров в этой категории.</p>',
+        pager=_pager_html(cat, page, pages),
+        page=str(page),
+        data_url=json.dumps(data_url),
+        footer=_footer(),
+    )
+
+# ============================
+# Similar products index
+# ============================
+SIMILAR_LIMIT = 3
+_SIMILAR_WINDOW = 6  # neighbours taken on each side of a product in every ordering
+
+def _first_number(val):
+    m = re.search(r"\d+(?:[.,]\d+)?", str(val or ""))
+    return float(m.group(0).replace(",", ".")) if m else None
+
+def _spec_value(p: dict, field: str, keywords):
+    v = _first_number(p.get(field))
+    if v is not None:
+        return v
+    for r in p.get("specs_table") or []:
+        if isinstance(r, dict) and any(kw in str(r.get("k") or "").lower() for kw in keywords):
+            v = _first_number(r.get("v"))
+            if v is not None:
+                return v
+    return None
+
+def _similarity_features(p: dict):
+    year = _first_number(p.get("year"))
+    return (
+        (p.get("brand") or "").strip().lower(),
+        year,
+        _spec_value(p, "cargo", ("груз",)),
+        _spec_value(p, "outreach", ("вылет", "радиус")),
+        _spec_value(p, "sections", ("секц",)),
+    )
+
+def _similarity_score(a, b) -> float:
+    """Higher is more similar: same brand, close year, close cargo/outreach/sections."""
+    score = 0.0
+    if a[0] and a[0] == b[0]:
+        score += 3.0
+    if a[1] is not None and b[1] is not None:
+        score += max(0.0, 2.0 - abs(a[1] - b[1]) / 3.0)
+    for x, y in zip(a[2:], b[2:]):
+        if x is not None and y is not None:
+            top = max(abs(x), abs(y)) or 1.0
+            score += max(0.0, 1.0 - 2.0 * abs(x - y) / top)
+    return score
+
+def build_similar_index(prods) -> dict:
+    """
+    product key -> indices (into prods) of its "Похожие товары", best first.
+    Candidates are the neighbours of a product within its category when sorted
+    by (brand, year) and by (year, cargo), so the build is O(n log n) instead of
+    comparing every pair; small categories are compared exhaustively.
+    """
+    by_cat = {}
+    for i, p in enumerate(prods):
+        by_cat.setdefault(p.get("category") or "kmu", []).append(i)
+
+    index = {}
+    for members in by_cat.values():
+        feats = {i: _similarity_features(prods[i]) for i in members}
+        exhaustive = len(members) <= 2 * _SIMILAR_WINDOW + 1
+        orderings = []
+        if not exhaustive:
+            def num(v):
+                return v if v is not None else -1.0
+            orderings = [
+                sorted(members, key=lambda i: (feats[i][0], num(feats[i][1]), i)),
+                sorted(members, key=lambda i: (num(feats[i][1]), num(feats[i][2]), i)),
+            ]
+        positions = [{i: pos for pos, i in enumerate(order)} for order in orderings]
+
+        for i in members:
+            if exhaustive:
+                cands = members
+            else:
+                cands = set()
+                for order, pos in zip(orderings, positions):
+                    at = pos[i]
+                    cands.update(order[max(0, at - _SIMILAR_WINDOW):at + _SIMILAR_WINDOW + 1])
+            own_id = prods[i].get("id")
+            ranked = sorted(
+                (j for j in cands if j != i and prods[j].get("id") != own_id),
+                key=lambda j: (-_similarity_score(feats[i], feats[j]), j),
+            )
+            index[_product_key(prods[i])] = ranked[:SIMILAR_LIMIT]
+    return index
+
+def similar_products(p, prods, similar_index=None):
+    """Products shown in the "Похожие товары" block of p's page."""
+    if similar_index is None:
+        similar_index = build_similar_index(prods)
+    return [prods[j] for j in similar_index.get(_product_key(p), [])]
+
+def render_product_page(p, prods, similar_index=None):
+    p = product_cache.normalized(p)
     title = esc(p.get("title") or p.get("name") or "")
     cat = p.get("category") or "kmu"
     slug = p.get("slug") or ""
@@ -940,7 +3381,7 @@ def render_product_page(p, prods):
         specs_html = '<p class="muted">Характеристики уточняйте у менеджера.</p>'
 
     # Similar products
-    similar = [x for x in prods if (x.get("category") or "kmu")==cat and x.get("id")!=p.get("id")][:3]
+    similar = similar_products(p, prods, similar_index)
     similar_html = ""
     if similar:
         similar_cards = "\n".join(render_product_card(x) for x in similar)
@@ -950,11 +3391,12 @@ def render_product_page(p, prods):
 </section>"""
 
     # Schema.org
+    page_url = abs_url(f"/catalog/{cat}/{slug}/")
     product_ld = {
         "@context":"https://schema.org",
         "@type":"Product",
         "name": p.get("title") or p.get("name") or "",
-        "url": abs_url(f"/catalog/{cat}/{slug}/"),
+        "url": page_url,
         "description": p.get("short") or "",
         "image": [],
     }
@@ -970,75 +3412,104 @@ def render_product_page(p, prods):
         "priceCurrency":"RUB",
         "price": re.sub(r"[^0-9.]", "", str(p.get("price") or "")) or "0",
         "availability":"https://schema.org/InStock",
-        "url": abs_url(f"/catalog/{cat}/{slug}/")
-    }
-
-    faq_ld = {
-        "@context":"https://schema.org",
-        "@type":"FAQPage",
-        "mainEntity":[
-            {"@type":"Question","name":"Как узнать цену и наличие?","acceptedAnswer":{"@type":"Answer","text":"Оставьте заявку — мы быстро уточним цену, наличие и комплектацию."}},
-            {"@type":"Question","name":"Есть доставка и установка?","acceptedAnswer":{"@type":"Answer","text":"Да, организуем доставку и при необходимости установку/подключение."}},
-        ]
+        "url": page_url
     }
 
     hero_img = carousel_html(images, title, large=True)
 
-    return f"""<!doctype html>
+    return _PRODUCT_TPL.render(
+        title=title,
+        meta_description=short or title,
+        canonical=page_url,
+        og_image=og_img_abs,
+        ld_json=_ld_json(
+            breadcrumb_ld([("Главная","/"),("Каталог","/catalog/"),(cat.upper(), f"/catalog/{cat}/"),(title, f"/catalog/{cat}/{slug}/")]),
+            product_ld,
+            fragment("ld:faq", lambda: json.dumps(_FAQ_LD, ensure_ascii=False)),
+        ),
+        header=_header("/catalog/"),
+        cat=esc(cat),
+        CAT=esc(cat).upper(),
+        tag_brand=f'<span class="tag">{brand}</span>' if brand else '',
+        tag_model=f'<span class="tag">Модель: {model}</span>' if model else '',
+        tag_year=f'<span class="tag">Год: {year}</span>' if year else '',
+        tag_status=f'<span class="tag">{status}</span>' if status else '',
+        tag_city=f'<span class="tag">{city}</span>' if city else '',
+        price=price,
+        short=short,
+        cta=esc(p.get("cta") or "Узнать цену и наличие"),
+        hero_img=hero_img,
+        desc_html=desc_html,
+        specs_html=specs_html,
+        slug=esc(slug),
+        similar_html=similar_html,
+        footer=_footer(),
+    )
+
+_FAQ_LD = {
+    "@context":"https://schema.org",
+    "@type":"FAQPage",
+    "mainEntity":[
+        {"@type":"Question","name":"Как узнать цену и наличие?","acceptedAnswer":{"@type":"Answer","text":"Оставьте заявку — мы быстро уточним цену, наличие и комплектацию."}},
+        {"@type":"Question","name":"Есть доставка и установка?","acceptedAnswer":{"@type":"Answer","text":"Да, организуем доставку и при необходимости установку/подключение."}},
+    ]
+}
+
+_PRODUCT_TPL = Template("""<!doctype html>
 <html lang="ru">
 <head>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width,initial-scale=1" />
-  <title>{title} — Мир манипуляторов</title>
-  <meta name="description" content="{short or title}" />
-  <link rel="canonical" href="{abs_url(f"/catalog/{cat}/{slug}/")}" />
+  <title>{{title}} — Мир манипуляторов</title>
+  <meta name="description" content="{{meta_description}}" />
+  <link rel="canonical" href="{{canonical}}" />
   <meta property="og:type" content="product" />
-  <meta property="og:title" content="{title}" />
-  <meta property="og:description" content="{short or title}" />
-  <meta property="og:url" content="{abs_url(f"/catalog/{cat}/{slug}/")}" />
-  <meta property="og:image" content="{og_img_abs}" />
+  <meta property="og:title" content="{{title}}" />
+  <meta property="og:description" content="{{meta_description}}" />
+  <meta property="og:url" content="{{canonical}}" />
+  <meta property="og:image" content="{{og_image}}" />
   <meta name="twitter:card" content="summary_large_image" />
   <link rel="stylesheet" href="/assets/css/styles.css" />
-  <script type="application/ld+json">{json.dumps([org_ld(), website_ld(), breadcrumb_ld([("Главная","/"),("Каталог","/catalog/"),(cat.upper(), f"/catalog/{cat}/"),(title, f"/catalog/{cat}/{slug}/")]), product_ld, faq_ld], ensure_ascii=False)}</script>
+  <script type="application/ld+json">{{ld_json}}</script>
   <style>
-    .specs-table{{width:100%;border-collapse:collapse}}
-    .specs-table td{{border-bottom:1px solid rgba(255,255,255,.08);padding:10px 8px;vertical-align:top}}
-    .specs-table td:first-child{{opacity:.85;width:45%}}
-    .crumbs{{font-size:.9rem;opacity:.85;margin:14px 0}}
-    .crumbs a{{color:inherit}}
-    .product-gallery{{border-radius:14px;overflow:hidden;border:1px solid var(--line)}}
-    .product-gallery .carousel{{height:100%}}
-    .product-gallery .carousel-track{{aspect-ratio:16/10}}
+    .specs-table{width:100%;border-collapse:collapse}
+    .specs-table td{border-bottom:1px solid rgba(255,255,255,.08);padding:10px 8px;vertical-align:top}
+    .specs-table td:first-child{opacity:.85;width:45%}
+    .crumbs{font-size:.9rem;opacity:.85;margin:14px 0}
+    .crumbs a{color:inherit}
+    .product-gallery{border-radius:14px;overflow:hidden;border:1px solid var(--line)}
+    .product-gallery .carousel{height:100%}
+    .product-gallery .carousel-track{aspect-ratio:16/10}
   </style>
 </head>
 <body>
-  {site_header("/catalog/")}
+  {{header}}
   <main class="container">
-    <div class="crumbs"><a href="/">Главная</a> · <a href="/catalog/">Каталог</a> · <a href="/catalog/{esc(cat)}/">{esc(cat).upper()}</a> · {title}</div>
+    <div class="crumbs"><a href="/">Главная</a> · <a href="/catalog/">Каталог</a> · <a href="/catalog/{{cat}}/">{{CAT}}</a> · {{title}}</div>
 
     <section class="section">
       <div class="grid2">
         <div>
-          <h1 style="margin-top:0">{title}</h1>
+          <h1 style="margin-top:0">{{title}}</h1>
           <div class="meta">
-            {f'<span class="tag">{brand}</span>' if brand else ''}
-            {f'<span class="tag">Модель: {model}</span>' if model else ''}
-            {f'<span class="tag">Год: {year}</span>' if year else ''}
-            {f'<span class="tag">{status}</span>' if status else ''}
-            {f'<span class="tag">{city}</span>' if city else ''}
-            <span class="tag">{price}</span>
+            {{tag_brand}}
+            {{tag_model}}
+            {{tag_year}}
+            {{tag_status}}
+            {{tag_city}}
+            <span class="tag">{{price}}</span>
           </div>
 
-          <p class="muted">{short}</p>
+          <p class="muted">{{short}}</p>
           <div class="actions">
-            <a class="btn primary" href="#request">{esc(p.get("cta") or "Узнать цену и наличие")}</a>
-            <a class="btn ghost" href="/catalog/{esc(cat)}/">Назад в каталог</a>
+            <a class="btn primary" href="#request">{{cta}}</a>
+            <a class="btn ghost" href="/catalog/{{cat}}/">Назад в каталог</a>
           </div>
           <p class="notice">💡 Наличие и комплектацию уточняем быстро. Возможна доставка и установка.</p>
         </div>
         <div>
           <div class="card pad product-gallery">
-            {hero_img}
+            {{hero_img}}
           </div>
         </div>
       </div>
@@ -1047,21 +3518,21 @@ def render_product_page(p, prods):
     <section class="section">
       <div class="card pad">
         <h2 style="margin-top:0">Описание</h2>
-        {desc_html}
+        {{desc_html}}
       </div>
     </section>
 
     <section class="section">
       <div class="card pad">
         <h2 style="margin-top:0">Характеристики</h2>
-        {specs_html}
+        {{specs_html}}
       </div>
     </section>
 
     <section class="section" id="request">
       <div class="card pad">
         <h2 style="margin-top:0">Запросить цену</h2>
-        <form class="lead-form" data-lead-type="price" data-page="/catalog/{esc(cat)}/{esc(slug)}/">
+        <form class="lead-form" data-lead-type="price" data-page="/catalog/{{cat}}/{{slug}}/">
           <div class="grid2">
             <label class="field"><span>Имя</span><input class="input" name="name" required placeholder="Как к вам обращаться?"></label>
             <label class="field"><span>Телефон</span><input class="input" name="phone" required placeholder="+7..." inputmode="tel"></label>
@@ -1072,28 +3543,646 @@ def render_product_page(p, prods):
       </div>
     </section>
 
-    {similar_html}
+    {{similar_html}}
   </main>
-  {site_footer()}
+  {{footer}}
   <script src="/assets/js/main.js"></script>
 </body>
 </html>
-"""
+""")
+
+# ============================
+# Page rendering (serial / process pool)
+# ============================
+_pool_prods = None
+_pool_similar = None
+
+def _render_pool_init(prods, similar_index):
+    # Runs once per worker process: the product list is shipped once, not per page
+    global _pool_prods, _pool_similar
+    reset_fragments()
+    _pool_prods = prods
+    _pool_similar = similar_index
+
+def _render_job(job, prods, similar_index):
+    kind, arg = job[0], job[1]
+    if kind == "catalog":
+        _, cat, page, pages, members, data_url = job
+        return render_catalog_slice(cat, [prods[i] for i in members], page, pages, data_url)
+    return render_product_page(prods[arg], prods, similar_index)
+
+def _render_pool_chunk(jobs):
+    return [_render_job(j, _pool_prods, _pool_similar) for j in jobs]
+
+def rebuild_workers(workers: int = None) -> int:
+    if workers is None:
+        workers = REBUILD_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+def render_pages(jobs, prods, similar_index, workers: int = None):
+    """
+    Renders ("catalog", cat, page, pages, [index, ...], data_url) / ("product", index) jobs.
+    Yields (offset, [html, ...]) batches in job order so the caller can write
+    pages while the pool keeps rendering. Small batches stay in-process.
+    """
+    workers = rebuild_workers(workers)
+    done = 0
+    if workers > 1 and len(jobs) >= REBUILD_PARALLEL_MIN_PAGES:
+        size = max(1, min(REBUILD_WRITE_BATCH, -(-len(jobs) // (workers * 4))))
+        chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+        try:
+            # spawn, not fork: the server process runs request, rebuild, outbox and SMTP threads,
+            # and a forked child can inherit a lock one of them held at that moment
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_render_pool_init, initargs=(prods, similar_index)) as ex:
+                for htmls in ex.map(_render_pool_chunk, chunks):
+                    yield done, htmls
+                    done += len(htmls)
+        except (OSError, BrokenProcessPool) as e:
+            print("WARN: parallel rebuild failed, continuing serially:", repr(e))
+    for i in range(done, len(jobs), REBUILD_WRITE_BATCH):
+        yield i, [_render_job(j, prods, similar_index) for j in jobs[i:i + REBUILD_WRITE_BATCH]]
 
-def rebuild_static():
-    prods = read_json(PRODUCTS_JSON, [])
-    prods = normalize_products_list(prods)
-    write_json_atomic(PRODUCTS_JSON, prods)
 
+# ============================
+# Incremental rebuild (manifest)
+# ============================
+def product_hash(p: dict) -> str:
+    """Stable content hash of a normalized product."""
+    if isinstance(p, Product):
+        p = p.to_dict()
+    raw = json.dumps(p, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _product_key(p: dict) -> str:
+    return str(p.get("id") or f'{p.get("category") or "kmu"}/{p.get("slug") or ""}')
+
+def _render_salt() -> str:
+    """Everything except product data that affects the HTML: templates (this file), SITE_URL, footer year."""
+    try:
+        h = hashlib.sha1(Path(__file__).read_bytes())
+    except Exception:
+        h = hashlib.sha1()
+    h.update(f"|{SITE_URL}|{datetime.utcnow().year}".encode("utf-8"))
+    return h.hexdigest()
+
+def _deps_signature(keys, hashes) -> str:
+    raw = "\n".join(f"{k}:{hashes.get(k, '')}" for k in keys)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def load_rebuild_manifest() -> dict:
+    m = read_json(REBUILD_MANIFEST_JSON, None)
+    if not isinstance(m, dict) or not isinstance(m.get("pages"), dict) or not isinstance(m.get("products"), dict):
+        return {"salt": "", "products": {}, "pages": {}}
+    return m
+
+def _same_as_published(path: Path, text: str, h: str, known_hash: str = "") -> bool:
+    """known_hash is the hash recorded when path was last written (skips reading it back)."""
+    if not path.exists():
+        return False
+    if known_hash:
+        return known_hash == h
+    try:
+        return path.read_text(encoding="utf-8") == text
+    except Exception:
+        return False
+
+def _write_text_atomic(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    tmp.replace(path)
+
+def write_text_if_changed(path: Path, text: str, known_hash: str = "") -> tuple:
+    """
+    Writes text (atomically) only if it differs from what is on disk.
+    Returns (hash, written).
+    """
+    h = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    if _same_as_published(path, text, h, known_hash):
+        return h, False
+    _write_text_atomic(path, text)
+    return h, True
+
+# ============================
+# Precompressed sidecars
+# ============================
+_SIDECAR_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # preference order
+
+def write_sidecars(path: Path) -> int:
+    """
+    Writes path.gz (and path.br when brotli is available) if missing or older
+    than path. Compression happens here, at rebuild time, never per request.
+    Returns the number of sidecars written.
+    """
+    if not PRECOMPRESS:
+        return 0
+    try:
+        src_mtime = path.stat().st_mtime
+    except OSError:
+        return 0
+    data = None
+    written = 0
+    for enc, suffix in _SIDECAR_ENCODINGS:
+        if enc == "br" and brotli is None:
+            continue
+        side = path.with_name(path.name + suffix)
+        try:
+            if side.stat().st_mtime >= src_mtime:
+                continue
+        except OSError:
+            pass
+        if data is None:
+            data = path.read_bytes()
+            if len(data) < PRECOMPRESS_MIN_BYTES:
+                return 0
+        blob = brotli.compress(data, quality=11) if enc == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+        tmp = side.with_name(side.name + ".tmp")
+        tmp.write_bytes(blob)
+        tmp.replace(side)
+        written += 1
+    return written
+
+def precompress_assets() -> int:
+    written = 0
+    for sub, pattern in (("css", "*.css"), ("js", "*.js")):
+        for pth in (Path(ASSETS_DIR) / sub).rglob(pattern):
+            written += write_sidecars(pth)
+    return written
+
+
+# ============================
+# Catalog data shards (/data/catalog-<cat>.<hash>.json)
+# ============================
+# What catalog-filters.js needs to filter, sort and draw cards in the browser
+CATALOG_SHARD_FIELDS = ("id", "category", "slug", "title", "name", "brand", "model", "year", "status", "short",
+                        "image", "images", "specs_table", "updated_at")
+CATALOG_SHARD_DIR = ROOT / "data"
+_SHARD_URL_RE = re.compile(r"^/data/catalog-[^/]+\.[0-9a-f]{12}\.json$")
+
+def catalog_shard_name(cat: str, body: bytes) -> str:
+    return f"catalog-{cat}.{hashlib.blake2b(body, digest_size=6).hexdigest()}.json"
+
+def write_catalog_shards(prods, cats, keep=()) -> dict:
+    """
+    One columnar JSON file (encode_columns()) per category, named by a hash of its
+    bytes, so a URL never changes content and can be cached forever. Existing files
+    are left alone; shards neither current nor in `keep` (the previous rebuild's,
+    still referenced by pages browsers may hold) are deleted with their sidecars.
+    Returns {cat: file name}.
+    """
+    names = {}
+    for cat in cats:
+        members = [p for p in prods if (p.get("category") or "kmu") == cat]
+        body = encode_feed(members, CATALOG_SHARD_FIELDS, True)
+        name = names[cat] = catalog_shard_name(cat, body)
+        path = CATALOG_SHARD_DIR / name
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_bytes(body)
+            tmp.replace(path)
+        write_sidecars(path)
+    live = set(names.values()) | set(keep)
+    for path in CATALOG_SHARD_DIR.glob("catalog-*.json*"):
+        base = path.name
+        for suffix in (".gz", ".br"):
+            if base.endswith(suffix):
+                base = base[:-len(suffix)]
+        if base not in live and _SHARD_URL_RE.match("/data/" + base):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    return names
+
+
+# ============================
+# Staged publish (per-category swap)
+# ============================
+_STAGING_PREFIX = ".staging-"
+_RETIRED_PREFIX = ".old-"
+_SPARE_PREFIX = ".spare-"
+_PAGE_FILES = ("index.html", "index.html.gz", "index.html.br")
+
+def _split_catalog_rel(rel: str):
+    """ "catalog/<cat>/<sub...>" -> (cat, sub) """
+    _, cat, sub = rel.split("/", 2)
+    return cat, sub
+
+def _publishable_slug(slug) -> bool:
+    """Slugs become directory names: no separators, no dot-dirs (staging dirs start with a dot)."""
+    slug = str(slug or "")
+    return bool(slug) and not slug.startswith(".") and "/" not in slug and "\\" not in slug
+
+def _is_page_dir(path) -> bool:
+    """A directory the generator owns: nothing but index.html and its sidecars."""
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return False
+    return "index.html" in names and all(n in _PAGE_FILES for n in names)
+
+def _link_or_copy(src, dst: Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _link_tree(src, dst: Path):
+    """Hard-links every file under src into dst unless dst already has it (or a fresher base file)."""
+    for dirpath, _dirnames, filenames in os.walk(src):
+        rel = os.path.relpath(dirpath, src)
+        out_dir = dst if rel == "." else dst / rel
+        for fn in filenames:
+            out = out_dir / fn
+            if out.exists() or fn.endswith(".tmp"):
+                continue
+            base, ext = os.path.splitext(fn)
+            if ext in (".gz", ".br") and (out_dir / base).exists():
+                continue  # base was re-rendered into staging, its old sidecar is stale
+            _link_or_copy(os.path.join(dirpath, fn), out)
+
+try:
+    import ctypes
+    _renameat2 = ctypes.CDLL(None, use_errno=True).renameat2  # Linux, glibc >= 2.28
+    _renameat2.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint)
+except (ImportError, OSError, AttributeError, TypeError):
+    _renameat2 = None
+
+def _exchange_paths(a: Path, b: Path) -> bool:
+    """Swaps two existing paths in one step (renameat2 RENAME_EXCHANGE). False where that is unsupported."""
+    if _renameat2 is None:
+        return False
+    AT_FDCWD, RENAME_EXCHANGE = -100, 2
+    return _renameat2(AT_FDCWD, os.fsencode(str(a)), AT_FDCWD, os.fsencode(str(b)), RENAME_EXCHANGE) == 0
+
+def _replace_with_link(src: Path, dst: Path):
+    """dst becomes a hard link (or copy) of src in one rename: dst may be linked into the live tree."""
+    tmp = dst.with_name(dst.name + ".tmp")
+    try:
+        tmp.unlink()
+    except OSError:
+        pass
+    _link_or_copy(src, tmp)
+    os.replace(tmp, dst)
+
+def cleanup_staging():
+    """Removes staging/retired trees left behind by an interrupted rebuild."""
+    catalog = ROOT / "catalog"
+    if not catalog.is_dir():
+        return
+    for entry in os.scandir(catalog):
+        if entry.is_dir(follow_symlinks=False) and entry.name.startswith((_STAGING_PREFIX, _RETIRED_PREFIX)):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+class CatalogPublisher:
+    """
+    Readers never see a half-written page or a missing category: changed pages of
+    a category are written into catalog/.staging-<cat>-<token>/ and the directory
+    is published by exchanging it with catalog/<cat> in one renameat2(RENAME_EXCHANGE).
+    Product directories that are no longer generated are not carried over, so
+    deleted/renamed products disappear from the tree.
+
+    The tree that is swapped out is kept as catalog/.spare-<cat>/ and becomes the
+    next staging dir, so a publish only touches the pages where the spare differs
+    from the new state (what changed in this and the previous publish): re-rendered
+    pages are written, the others hard-linked from the live tree, dropped ones
+    removed. `spares` ({cat: {"live": ino, "spare": ino, "pages": {sub: hash}}},
+    kept in the rebuild manifest) records what each spare holds; a spare that does
+    not match it (first run, interrupted rebuild) is refilled from the whole live
+    category once. Without RENAME_EXCHANGE (not Linux, some filesystems) the swap
+    falls back to two renames.
+    """
+
+    def __init__(self, old_pages: dict, spares: dict = None):
+        self.old_pages = old_pages
+        self.old_spares = spares or {}
+        self.spares = {}
+        self.token = uuid.uuid4().hex[:10]
+        self.catalog = ROOT / "catalog"
+        self.staging = {}  # cat -> staging dir
+        self.have = {}     # cat -> {sub: hash} a reused spare held; absent: filled from live at publish
+        self.written = {}  # cat -> subs rendered into the staging dir
+        self.old_by_cat = {}
+        for rel, page in old_pages.items():
+            cat, sub = _split_catalog_rel(rel)
+            self.old_by_cat.setdefault(cat, {})[sub] = (page or {}).get("hash") or ""
+        self.stats = {"swapped": 0, "pruned": 0, "linked": 0}
+
+    def _stage_dir(self, cat: str) -> Path:
+        d = self.staging.get(cat)
+        if d is None:
+            d = self.catalog / f"{_STAGING_PREFIX}{cat}-{self.token}"
+            spare = self.catalog / f"{_SPARE_PREFIX}{cat}"
+            rec = self.old_spares.get(cat) or {}
+            try:
+                ino = os.lstat(spare).st_ino
+            except OSError:
+                ino = None
+            if ino is not None and rec.get("pages") is not None and rec.get("spare") == ino:
+                # renamed away while it is being changed: an interrupted rebuild leaves a .staging- dir, not a stale spare
+                os.rename(spare, d)
+                self.have[cat] = rec["pages"]
+            else:
+                if ino is not None:
+                    shutil.rmtree(spare, ignore_errors=True)
+                d.mkdir(parents=True)
+            self.staging[cat] = d
+        return d
+
+    def emit(self, rel: str, html: str, known_hash: str = "") -> tuple:
+        """Stages a rendered page unless the live copy already has these bytes. Returns (hash, written)."""
+        h = hashlib.sha1(html.encode("utf-8")).hexdigest()
+        if _same_as_published(ROOT / rel, html, h, known_hash):
+            return h, False
+        cat, sub = _split_catalog_rel(rel)
+        target = self._stage_dir(cat) / sub
+        for suffix in (".gz", ".br"):
+            try:
+                target.with_name(target.name + suffix).unlink()
+            except OSError:
+                pass
+        # never in place: a spare file can be a hard link of the live page
+        _write_text_atomic(target, html)
+        write_sidecars(target)
+        self.written.setdefault(cat, set()).add(sub)
+        return h, True
+
+    def _has_orphans(self, cat: str, subs: set, live: Path = None, prefix: str = "") -> bool:
+        live = live or self.catalog / cat
+        if not live.is_dir():
+            return False
+        for entry in os.scandir(live):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if _is_page_dir(entry.path):
+                if f"{prefix}{entry.name}/index.html" not in subs:
+                    return True
+            elif prefix == "" and entry.name == _PAGER_DIR and self._has_orphans(cat, subs, Path(entry.path), f"{_PAGER_DIR}/"):
+                return True
+        return False
+
+    def _fill(self, cat: str, stage: Path, subs: set, live: Path = None, prefix: str = ""):
+        live = live or self.catalog / cat
+        if not live.is_dir():
+            return
+        for entry in os.scandir(live):
+            if entry.is_dir(follow_symlinks=False):
+                if f"{prefix}{entry.name}/index.html" not in subs and _is_page_dir(entry.path):
+                    self.stats["pruned"] += 1
+                    continue
+                if prefix == "" and entry.name == _PAGER_DIR:
+                    self._fill(cat, stage / entry.name, subs, Path(entry.path), f"{_PAGER_DIR}/")
+                    continue
+                _link_tree(entry.path, stage / entry.name)
+            elif not (stage / entry.name).exists() and not entry.name.endswith(".tmp"):
+                base, ext = os.path.splitext(entry.name)
+                if ext in (".gz", ".br") and (stage / base).exists():
+                    continue
+                _link_or_copy(entry.path, stage / entry.name)
+
+    def _sync(self, cat: str, stage: Path, want: dict):
+        """Turns a reused spare from self.have[cat] into `want` ({sub: hash}), touching only the differences."""
+        have = self.have[cat]
+        live = self.catalog / cat
+        written = self.written.get(cat, set())
+        for sub in have:
+            if sub in want:
+                continue
+            page = stage / sub
+            for suffix in ("", ".gz", ".br"):
+                try:
+                    page.with_name(page.name + suffix).unlink()
+                except OSError:
+                    pass
+            parent = page.parent
+            while parent != stage and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+            self.stats["pruned"] += 1
+        for sub, h in want.items():
+            page = stage / sub
+            if sub in written or (have.get(sub) == h and page.exists()):
+                continue
+            src = live / sub
+            if not src.exists():
+                continue
+            page.parent.mkdir(parents=True, exist_ok=True)
+            for suffix in ("", ".gz", ".br"):
+                s, d = src.with_name(src.name + suffix), page.with_name(page.name + suffix)
+                if s.exists():
+                    _replace_with_link(s, d)
+                else:
+                    try:
+                        d.unlink()
+                    except OSError:
+                        pass
+            self.stats["linked"] += 1
+
+    def _swap(self, cat: str, stage: Path):
+        live = self.catalog / cat
+        if not live.exists():
+            os.rename(stage, live)
+            self.spares[cat] = {"live": os.lstat(live).st_ino, "spare": None, "pages": None}
+            return
+        if _exchange_paths(stage, live):
+            # stage now holds the previous live tree: the next publish starts from it
+            old_live = os.lstat(stage).st_ino
+            os.rename(stage, self.catalog / f"{_SPARE_PREFIX}{cat}")
+            known = (self.old_spares.get(cat) or {}).get("live") == old_live
+            self.spares[cat] = {"live": os.lstat(live).st_ino, "spare": old_live,
+                                "pages": self.old_by_cat.get(cat, {}) if known else None}
+            return
+        retired = self.catalog / f"{_RETIRED_PREFIX}{cat}-{self.token}"
+        try:
+            os.rename(live, retired)
+            os.rename(stage, live)
+        except OSError as e:
+            # e.g. Windows refuses to rename a directory with open handles: publish file by file instead
+            print("WARN: directory swap failed, publishing in place:", repr(e))
+            if retired.exists() and not live.exists():
+                os.rename(retired, live)
+            self._replace_in_place(stage, live)
+            return
+        shutil.rmtree(retired, ignore_errors=True)
+
+    def _replace_in_place(self, stage: Path, live: Path):
+        for dirpath, _dirnames, filenames in os.walk(stage):
+            rel = os.path.relpath(dirpath, stage)
+            out_dir = live if rel == "." else live / rel
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for fn in filenames:
+                src = Path(dirpath) / fn
+                if (out_dir / fn).exists() and os.path.samefile(src, out_dir / fn):
+                    continue
+                os.replace(src, out_dir / fn)
+        for d in (live, live / _PAGER_DIR):
+            if not d.is_dir():
+                continue
+            for entry in os.scandir(d):
+                rel = os.path.relpath(entry.path, live)
+                if entry.is_dir(follow_symlinks=False) and not (stage / rel).exists() and _is_page_dir(entry.path):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+        shutil.rmtree(stage, ignore_errors=True)
+
+    def publish(self, pages: dict) -> dict:
+        """Swaps in every staged category (and every category with stale product dirs)."""
+        current = {}
+        for rel, page in pages.items():
+            cat, sub = _split_catalog_rel(rel)
+            current.setdefault(cat, {})[sub] = (page or {}).get("hash") or ""
+        for cat, want in current.items():
+            if cat in self.staging:
+                continue
+            if cat in self.old_spares:
+                stale = any(sub not in want for sub in self.old_by_cat.get(cat, {}))
+            else:
+                stale = self._has_orphans(cat, set(want))  # not published by us yet: look at the tree
+            if stale:
+                self._stage_dir(cat)
+        for cat, stage in list(self.staging.items()):
+            want = current.get(cat, {})
+            if cat in self.have:
+                self._sync(cat, stage, want)
+            else:
+                self._fill(cat, stage, set(want))
+            self._swap(cat, stage)
+            self.stats["swapped"] += 1
+        for cat, rec in self.old_spares.items():
+            if cat in current and cat not in self.staging:
+                self.spares[cat] = rec
+
+        # Categories without products any more: drop what the previous rebuild published for them
+        for rel in self.old_pages:
+            cat, sub = _split_catalog_rel(rel)
+            if cat in current:
+                continue
+            shutil.rmtree(self.catalog / f"{_SPARE_PREFIX}{cat}", ignore_errors=True)
+            page = ROOT / rel
+            for pth in (page, page.with_name(page.name + ".gz"), page.with_name(page.name + ".br")):
+                try:
+                    pth.unlink()
+                except OSError:
+                    pass
+            parent = page.parent
+            while parent != self.catalog and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+            self.stats["pruned"] += 1
+        return self.stats
+
+
+_rebuild_lock = threading.Lock()
+_products_lock = threading.Lock()  # read-modify-write of products.json (admin CRUD vs rebuild)
+
+def rebuild_static(full: bool = False, workers: int = None) -> dict:
+    """
+    Renders /catalog/<cat>/ (+ /catalog/<cat>/page/N/), /catalog/<cat>/<slug>/, sitemap.xml and robots.txt.
+
+    Incremental by default: every page remembers the hashes of the products it is
+    built from (product page: itself + "Похожие товары"; category page: all members).
+    A page is re-rendered only when that signature changes, and a file is written
+    only when the rendered bytes differ. full=True (or REBUILD_INCREMENTAL=0)
+    re-renders everything but still skips unchanged writes.
+
+    Stale pages are rendered across a process pool of `workers` processes
+    (default REBUILD_WORKERS); workers=1 renders serially. Output is identical.
+
+    Pages are published per category through CatalogPublisher (staging dir +
+    rename swap); product dirs that are no longer generated are pruned. The
+    manifest is saved only after publishing, so the next rebuild diffs against
+    what is actually live.
+    """
+    with _rebuild_lock:
+        return _rebuild_static(full, workers)
+
+def _rebuild_static(full: bool, workers) -> dict:
+    cleanup_staging()
+    with _products_lock:
+        prods = product_store.load_for_rebuild()
+    reset_fragments()
+
+    old = load_rebuild_manifest()
+    salt = _render_salt()
+    force = full or not REBUILD_INCREMENTAL or old.get("salt") != salt
+    old_products = old.get("products") or {}
+    old_pages = old.get("pages") or {}
+
+    hashes = {}
+    for p in prods:
+        hashes[_product_key(p)] = product_hash(p)
+    changed = [k for k, h in hashes.items() if old_products.get(k) != h]
+    removed = [k for k in old_products if k not in hashes]
+
+    stats = {"full": force, "products": len(prods), "changed": len(changed), "removed": len(removed),
+             "pages": 0, "rendered": 0, "written": 0}
+    pages = {}
+
+    # 1) decide which pages are stale, 2) render them (serial or process pool), 3) write in batches
+    jobs = []
+    pending = []
+
+    def plan(rel: str, deps: list, job):
+        stats["pages"] += 1
+        sig = _deps_signature(deps, hashes)
+        prev = old_pages.get(rel) or {}
+        if not force and prev.get("sig") == sig and prev.get("hash") and (ROOT / rel).exists():
+            pages[rel] = prev
+            return
+        jobs.append(job)
+        pending.append((rel, sig, prev))
+
+    similar = build_similar_index(prods)
+    cat_pages = {}
     cats = sorted(set((p.get("category") or "kmu") for p in prods))
+    # written before the pages that point at them
+    shards = write_catalog_shards(prods, [c for c in cats if _publishable_slug(c)],
+                                  keep=(old.get("shards") or {}).values())
+    stats["shards"] = len(shards)
     for cat in cats:
-        cat_dir = ROOT / "catalog" / cat
-        cat_dir.mkdir(parents=True, exist_ok=True)
-        (cat_dir / "index.html").write_text(render_catalog_page(cat, prods), encoding="utf-8")
-        for p in [x for x in prods if (x.get("category") or "kmu") == cat]:
-            pdir = cat_dir / (p.get("slug") or "")
-            pdir.mkdir(parents=True, exist_ok=True)
-            (pdir / "index.html").write_text(render_product_page(p, prods), encoding="utf-8")
+        if not _publishable_slug(cat):
+            print("WARN: skipping category with unusable name:", repr(cat))
+            continue
+        data_url = "/data/" + shards[cat]
+        members = [i for i, x in enumerate(prods) if (x.get("category") or "kmu") == cat]
+        pages_n = catalog_page_count(len(members))
+        size = CATALOG_PAGE_SIZE if CATALOG_PAGE_SIZE > 0 else max(1, len(members))
+        for page in range(1, pages_n + 1):
+            chunk = members[(page - 1) * size:page * size]
+            rel = catalog_page_path(cat, page).lstrip("/") + "index.html"
+            # the page count and the shard URL are part of the signature: every page of the category carries them
+            plan(rel, [f"#pages:{pages_n}", f"#data:{data_url}"] + [_product_key(prods[i]) for i in chunk],
+                 ("catalog", cat, page, pages_n, chunk, data_url))
+            cat_pages[cat] = pages_n
+        for i in members:
+            p = prods[i]
+            if not _publishable_slug(p.get("slug")) or p.get("slug") == _PAGER_DIR:
+                print("WARN: skipping product with unusable slug:", repr(p.get("slug")))
+                continue
+            deps = [_product_key(p)] + [_product_key(x) for x in similar_products(p, prods, similar)]
+            plan(f"catalog/{cat}/{p.get('slug') or ''}/index.html", deps, ("product", i))
+
+    publisher = CatalogPublisher(old_pages, old.get("spares"))
+    try:
+        for start, htmls in render_pages(jobs, prods, similar, workers):
+            for (rel, sig, prev), html in zip(pending[start:start + len(htmls)], htmls):
+                stats["rendered"] += 1
+                h, written = publisher.emit(rel, html, prev.get("hash", ""))
+                if written:
+                    stats["written"] += 1
+                pages[rel] = {"sig": sig, "hash": h}
+        stats.update(publisher.publish(pages))
+    finally:
+        cleanup_staging()
+
+    # Sidecars are checked for every page, so unchanged pages get them too (e.g. after enabling PRECOMPRESS)
+    stats["compressed"] = 0
+    for rel in pages:
+        stats["compressed"] += write_sidecars(ROOT / rel)
 
     urls = [
         "/", "/catalog/", "/services/", "/brands/", "/about/", "/contacts/", "/blog/",
@@ -1101,9 +4190,11 @@ def rebuild_static():
         "/admin/","/admin/leads/",
     ]
     for cat in cats:
-        urls.append(f"/catalog/{cat}/")
+        for page in range(1, cat_pages.get(cat, 0) + 1):
+            urls.append(catalog_page_path(cat, page))
     for p in prods:
-        urls.append(f"/catalog/{p.get('category','kmu')}/{p.get('slug','')}/")
+        if _publishable_slug(p.get("slug")) and p.get("slug") != _PAGER_DIR:
+            urls.append(f"/catalog/{p.get('category','kmu')}/{p.get('slug','')}/")
 
     try:
         for pth in (ROOT / "blog").glob("*/index.html"):
@@ -1123,8 +4214,145 @@ def rebuild_static():
         xml.append("    <changefreq>weekly</changefreq>")
         xml.append("  </url>")
     xml.append("</urlset>")
-    (ROOT / "sitemap.xml").write_text("\n".join(xml), encoding="utf-8")
-    (ROOT / "robots.txt").write_text("User-agent: *\nAllow: /\nSitemap: /sitemap.xml\n", encoding="utf-8")
+    write_text_if_changed(ROOT / "sitemap.xml", "\n".join(xml))
+    stats["compressed"] += write_sidecars(ROOT / "sitemap.xml") + precompress_assets()
+    write_text_if_changed(ROOT / "robots.txt", "User-agent: *\nAllow: /\nSitemap: /sitemap.xml\n")
+
+    write_json_atomic(REBUILD_MANIFEST_JSON, {
+        "salt": salt,
+        "built_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "products": hashes,
+        "pages": pages,
+        "shards": shards,
+        "spares": publisher.spares,
+    })
+    return stats
+
+
+# ============================
+# Background rebuild queue
+# ============================
+class RebuildQueue:
+    """
+    One background worker runs rebuild_static(). Requests that arrive while a
+    rebuild is pending are coalesced into it: the worker waits until no new
+    request came for `debounce` seconds (but at most `max_delay` after the first),
+    so 50 admin edits in a row produce one rebuild. Every request gets a ticket id
+    whose status can be polled.
+    """
+
+    MAX_TICKETS = 500
+
+    def __init__(self, debounce: float, max_delay: float):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._pending = []       # tickets waiting for the next rebuild
+        self._pending_full = False
+        self._first_at = 0.0
+        self._due = 0.0
+        self._running = []
+        self._tickets = OrderedDict()
+        self._last = {"started_at": None, "finished_at": None, "duration": None, "stats": None, "error": None}
+        self._thread = None
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, name="rebuild-queue", daemon=True)
+            self._thread.start()
+
+    def submit(self, reason: str = "", full: bool = False, delay: float = None) -> str:
+        """Queues a rebuild; delay overrides the debounce window (0 = start as soon as possible)."""
+        ticket = uuid.uuid4().hex[:12]
+        now = time.monotonic()
+        with self._cond:
+            if not self._pending:
+                self._first_at = now
+            self._pending.append(ticket)
+            self._pending_full = self._pending_full or full
+            self._due = min(now + (self.debounce if delay is None else delay), self._first_at + self.max_delay)
+            self._tickets[ticket] = {
+                "status": "queued",
+                "reason": reason,
+                "queued_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                "finished_at": None,
+                "error": None,
+            }
+            while len(self._tickets) > self.MAX_TICKETS:
+                self._tickets.popitem(last=False)
+            self._ensure_worker()
+            self._cond.notify_all()
+        return ticket
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                while True:
+                    delay = self._due - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                batch, full = self._pending, self._pending_full
+                self._pending, self._pending_full = [], False
+                self._running = batch
+                for t in batch:
+                    if t in self._tickets:
+                        self._tickets[t]["status"] = "running"
+                self._last["started_at"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+            t0 = time.monotonic()
+            stats, error = None, None
+            try:
+                stats = rebuild_static(full=full)
+                catalog_index()  # index the new version before the first search asks for it
+            except Exception as e:
+                error = str(e)
+                traceback.print_exc()
+            duration = round(time.monotonic() - t0, 3)
+
+            with self._cond:
+                finished = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+                for t in batch:
+                    info = self._tickets.get(t)
+                    if info is not None:
+                        info["status"] = "error" if error else "done"
+                        info["finished_at"] = finished
+                        info["error"] = error
+                self._running = []
+                self._last.update({"finished_at": finished, "duration": duration, "stats": stats, "error": error})
+                self._cond.notify_all()
+
+    def wait(self, ticket: str, timeout: float = None) -> dict:
+        """Blocks until the ticket's rebuild finished (or timeout); returns its status."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                info = self._tickets.get(ticket)
+                if info is None or info["status"] in ("done", "error"):
+                    return self.status(ticket, _locked=True)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return self.status(ticket, _locked=True)
+                self._cond.wait(remaining)
+
+    def status(self, ticket: str = None, _locked: bool = False) -> dict:
+        if not _locked:
+            with self._cond:
+                return self.status(ticket, _locked=True)
+        out = {
+            "queue_depth": len(self._pending),
+            "running": bool(self._running),
+            "last_rebuild": dict(self._last),
+            "product_cache": product_cache.stats(),
+        }
+        if ticket:
+            info = self._tickets.get(ticket)
+            out["ticket"] = dict(info, id=ticket) if info else {"id": ticket, "status": "unknown"}
+        return out
+
+rebuild_queue = RebuildQueue(REBUILD_DEBOUNCE_SECONDS, REBUILD_MAX_DELAY_SECONDS)
 
 
 class Handler(SimpleHTTPRequestHandler):
@@ -1136,6 +4364,58 @@ class Handler(SimpleHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(b)
 
+    def _not_modified(self, etags, modified: int) -> bool:
+        """Conditional GET: If-None-Match against any of etags, else If-Modified-Since against modified."""
+        inm = self.headers.get("If-None-Match")
+        if inm is not None:
+            for tag in inm.split(","):
+                tag = tag.strip()
+                if tag.startswith("W/"):
+                    tag = tag[2:]  # weak comparison is fine for GET
+                if tag == "*" or tag in etags:
+                    return True
+            return False
+        ims = self.headers.get("If-Modified-Since")
+        if ims and modified:
+            try:
+                return modified <= parsedate_to_datetime(ims).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+        return False
+
+    def _cached_json(self, body: bytes, gz, etag: str, modified: int, cache_control: str):
+        """
+        JSON bytes with validators: 304 without a body when the client copy is current.
+        gz is the gzip body, None, or a function making it (per-query responses: only
+        called when a gzip 200 is actually sent).
+        """
+        self._vary_encoding = gz is not None
+        gz_etag = etag[:-1] + '-gz"'  # strong ETag: the gzip body is a different representation
+        use_gz = gz is not None and "gzip" in self._accepted_encodings()
+        if self._not_modified((etag, gz_etag), modified):
+            self.send_response(304)
+            body = None
+        else:
+            self.send_response(200)
+            if use_gz:
+                body = gz() if callable(gz) else gz
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            if use_gz:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", gz_etag if use_gz else etag)
+        if modified:
+            self.send_header("Last-Modified", self.date_time_string(modified))
+        self.send_header("Cache-Control", cache_control)
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def _products_response(self, cache_control: str = "private, no-cache"):
+        """Normalized catalog from the in-memory store; pre-gzipped bytes when the client accepts gzip."""
+        body, gz, _version, modified, etag = product_store.response()
+        self._cached_json(body, gz, etag, modified, cache_control)
+
     def _text(self, code: int, text: str, ctype="text/plain; charset=utf-8"):
         b = text.encode("utf-8")
         self.send_response(code)
@@ -1166,10 +4446,94 @@ class Handler(SimpleHTTPRequestHandler):
             if p.startswith('/admin') or p.endswith('.html'):
                 self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
                 self.send_header('Pragma', 'no-cache')
+            elif _SHARD_URL_RE.match(p):
+                self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
         except Exception:
             pass
+        if getattr(self, "_vary_encoding", False):
+            self.send_header("Vary", "Accept-Encoding")
+            self._vary_encoding = False
         super().end_headers()
 
+    def _accepted_encodings(self) -> set:
+        """Content codings from Accept-Encoding with q > 0."""
+        out = set()
+        for part in (self.headers.get("Accept-Encoding") or "").split(","):
+            coding, _, params = part.partition(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            q = 1.0
+            m = re.search(r"q\s*=\s*([0-9.]+)", params)
+            if m:
+                try:
+                    q = float(m.group(1))
+                except ValueError:
+                    q = 0.0
+            if q > 0:
+                out.add(coding)
+        return out
+
+    def send_head(self):
+        """Static files: serve a fresh .br/.gz sidecar when the client accepts it."""
+        self._vary_encoding = False
+        path = self.translate_path(self.path)
+        # leads/ holds names and phones (leads.csv, the notification outbox and its dead letters),
+        # data/ the product journal, the sqlite store and the rebuild manifest: admin only
+        real, leads_dir = os.path.realpath(path), os.path.realpath(LEADS_DIR)
+        private = real == leads_dir or real.startswith(leads_dir + os.sep)
+        private = private or any(real.startswith(os.path.realpath(p)) for p in _PRIVATE_DATA_PREFIXES)
+        if private and not self._require_admin():
+            return None
+        if os.path.isdir(path):
+            if not urlparse(self.path).path.endswith("/"):
+                return super().send_head()  # redirect to the slash URL
+            for index in ("index.html", "index.htm"):
+                if os.path.isfile(os.path.join(path, index)):
+                    path = os.path.join(path, index)
+                    break
+            else:
+                return super().send_head()
+        try:
+            src_mtime = os.stat(path).st_mtime
+        except OSError:
+            return super().send_head()
+
+        accepted = None
+        for enc, suffix in _SIDECAR_ENCODINGS:
+            try:
+                if os.stat(path + suffix).st_mtime < src_mtime:
+                    continue  # stale sidecar, never serve old content
+            except OSError:
+                continue
+            self._vary_encoding = True
+            if accepted is None:
+                accepted = self._accepted_encodings()
+            if enc not in accepted:
+                continue
+            try:
+                f = open(path + suffix, "rb")
+            except OSError:
+                continue
+            ims = self.headers.get("If-Modified-Since")
+            if ims and not self.headers.get("If-None-Match"):
+                try:
+                    if int(src_mtime) <= parsedate_to_datetime(ims).timestamp():
+                        f.close()
+                        self.send_response(304)
+                        self.end_headers()
+                        return None
+                except (TypeError, ValueError, IndexError, OverflowError):
+                    pass
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Encoding", enc)
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Last-Modified", self.date_time_string(int(src_mtime)))
+            self.end_headers()
+            return f
+        return super().send_head()
+
     def do_GET(self):
         parsed = urlparse(self.path)
         path = parsed.path
@@ -1187,29 +4551,105 @@ class Handler(SimpleHTTPRequestHandler):
                 return
 
         # Public products (for catalog filters, no auth)
+        if path == "/api/public/products/changes":
+            qs = parse_qs(parsed.query, keep_blank_values=True)
+            raw = (qs.get("since") or [""])[-1].strip()
+            # ASCII only ("²".isdigit() is True but int() rejects it); versions are millisecond clocks, well under 20 digits
+            if not (raw.isascii() and raw.isdigit() and len(raw) <= 20):
+                return self._json(400, {"ok": False, "error": "since must be a catalog version" if raw else "since required"})
+            try:
+                fields, columnar = parse_feed_params(qs)
+            except ValueError as e:
+                return self._json(400, {"ok": False, "error": str(e)})
+            since = int(raw)
+            if columnar:
+                return self._json(400, {"ok": False, "error": "format=columns is not supported for changes"})
+            b = json.dumps(public_changes(since, fields), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(b)))
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(b)
+            return
+
         if path == "/api/public/products":
-            return self._json(200, normalize_products_list(read_json(PRODUCTS_JSON, [])))
+            qs = parse_qs(parsed.query, keep_blank_values=True)
+            try:
+                fields, columnar = parse_feed_params(qs)
+                query = parse_public_query(qs) if any(k in qs for k in PUBLIC_QUERY_PARAMS) else None
+            except ValueError as e:
+                return self._json(400, {"ok": False, "error": str(e)})
+            if query is None:
+                if fields is None and not columnar:
+                    return self._products_response(PUBLIC_API_CACHE_CONTROL)
+                modified = product_store.modified
+                b, gz, etag = product_store.derived("public_feeds", PublicFeeds).get(fields, columnar)
+                return self._cached_json(b, gz, etag, modified, PUBLIC_API_CACHE_CONTROL)
+            modified = product_store.modified
+            b = json.dumps(public_products_page(query, fields, columnar), ensure_ascii=False).encode("utf-8")
+            gz = (lambda: gzip.compress(b, 5, mtime=0)) if len(b) >= PRECOMPRESS_MIN_BYTES else None
+            etag = '"' + hashlib.blake2b(b, digest_size=12).hexdigest() + '"'
+            return self._cached_json(b, gz, etag, modified, PUBLIC_API_CACHE_CONTROL)
+
+        # Filter counts for the catalog selects (without the products)
+        if path == "/api/public/facets":
+            try:
+                query = parse_public_query(parse_qs(parsed.query))
+            except ValueError as e:
+                return self._json(400, {"ok": False, "error": str(e)})
+            modified = product_store.modified
+            b = json.dumps(public_facets(query), ensure_ascii=False).encode("utf-8")
+            gz = (lambda: gzip.compress(b, 5, mtime=0)) if len(b) >= PRECOMPRESS_MIN_BYTES else None
+            etag = '"' + hashlib.blake2b(b, digest_size=12).hexdigest() + '"'
+            return self._cached_json(b, gz, etag, modified, PUBLIC_API_CACHE_CONTROL)
+
+        # Site search (/catalog/?q=, the SearchAction of website_ld)
+        if path == "/api/public/search":
+            try:
+                query = parse_public_query(parse_qs(parsed.query))
+            except ValueError as e:
+                return self._json(400, {"ok": False, "error": str(e)})
+            if not query["q"]:
+                return self._json(400, {"ok": False, "error": "q required"})
+            modified = product_store.modified
+            b = json.dumps(public_search(query), ensure_ascii=False).encode("utf-8")
+            etag = '"' + hashlib.blake2b(b, digest_size=12).hexdigest() + '"'
+            return self._cached_json(b, None, etag, modified, PUBLIC_API_CACHE_CONTROL)
 
         # Public settings (theme default + optional logo/bg)
         if path == "/api/public/settings":
             s = load_settings()
-            return self._json(200, {
+            b = json.dumps({
                 "theme_default": s.get("theme_default","blue"),
                 "logo_path": s.get("logo_path",""),
                 "hero_bg_path": s.get("hero_bg_path",""),
-            })
+            }, ensure_ascii=False).encode("utf-8")
+            try:
+                modified = int(SETTINGS_JSON.stat().st_mtime)
+            except OSError:
+                modified = 0
+            etag = '"' + hashlib.blake2b(b, digest_size=12).hexdigest() + '"'
+            return self._cached_json(b, None, etag, modified, PUBLIC_API_CACHE_CONTROL)
 
         if path == "/api/products":
-            return self._json(200, normalize_products_list(read_json(PRODUCTS_JSON, [])))
+            return self._products_response()
 
         if path == "/api/settings":
             if not self._require_admin():
                 return
             return self._json(200, load_settings())
 
+        if path == "/api/rebuild/status":
+            qs = parse_qs(parsed.query)
+            return self._json(200, rebuild_queue.status((qs.get("ticket") or [""])[0]))
+
         if path == "/api/leads":
             return self._json(200, parse_leads())
 
+        if path == "/api/leads/outbox":
+            return self._json(200, dict(lead_outbox.status(), smtp_pool=smtp_pool.stats()))
+
         if path == "/api/leads.csv":
             if not self._require_admin():
                 return
@@ -1285,8 +4725,13 @@ class Handler(SimpleHTTPRequestHandler):
         # Rebuild pages
         if path == "/api/rebuild":
             try:
-                rebuild_static()
-                return self._json(200, {"ok": True})
+                # Explicit rebuild stays synchronous, but goes through the queue so it never overlaps the worker
+                ticket = rebuild_queue.submit("api/rebuild", full=True, delay=0)
+                st = rebuild_queue.wait(ticket, timeout=600)
+                info = st.get("ticket") or {}
+                if info.get("status") == "error":
+                    return self._json(500, {"ok": False, "error": info.get("error"), "rebuild_ticket": ticket})
+                return self._json(200, {"ok": True, "rebuild_ticket": ticket, "rebuild": st["last_rebuild"].get("stats")})
             except Exception as e:
                 return self._json(500, {"ok": False, "error": str(e)})
 
@@ -1401,72 +4846,64 @@ class Handler(SimpleHTTPRequestHandler):
                         normalize_product(p)
                         prods.append(p)
 
-                write_json_atomic(PRODUCTS_JSON, prods)
-                rebuild_static()
-                return self._json(200, {"ok": True, "count": len(prods)})
+                with _products_lock:
+                    product_store.save(prods)
+                ticket = rebuild_queue.submit("import_csv")
+                return self._json(200, {"ok": True, "count": len(prods), "rebuild_ticket": ticket})
             except Exception as e:
                 return self._json(500, {"ok": False, "error": str(e)})
 
+        # Batch of product ops (price sync etc.): validated as a whole, one write, one rebuild
+        if path == "/api/products/batch":
+            raw_ops = payload.get("ops") if isinstance(payload, dict) else payload
+            with _products_lock:
+                ops, results, ok = prepare_product_batch(raw_ops, product_store.products())
+                if not ok:
+                    return self._json(400, {"ok": False, "error": "validation failed, nothing applied", "results": results})
+                product_store.apply_batch(ops)
+            ticket = rebuild_queue.submit(f"products:batch({len(ops)})")
+            return self._json(200, {"ok": True, "applied": len(ops), "results": results, "rebuild_ticket": ticket})
+
         # CRUD products (admin)
         if path == "/api/products":
-            action = payload.get("action")
-            prods = normalize_products_list(read_json(PRODUCTS_JSON, []))
-
-            if action == "create":
-                p = payload.get("product") or {}
-                new_id = "p" + str(int(time.time()*1000))
-                p["id"] = new_id
-                normalize_product(p)
-                p["featured"] = bool(p.get("featured", False))
-                p["featured_rank"] = (p.get("featured_rank") or "").strip()
-
-                prods.append(p)
-                write_json_atomic(PRODUCTS_JSON, prods)
-                rebuild_static()
-                return self._json(200, {"ok": True, "id": new_id})
-
-            if action == "update":
-                p = payload.get("product") or {}
-                pid = p.get("id")
-                if not pid:
-                    return self._json(400, {"ok": False, "error": "id required"})
-                found = False
-                for i, cur in enumerate(prods):
-                    if cur.get("id")==pid:
-                        p["id"] = pid
-                        if "featured" not in p:
-                            p["featured"] = cur.get("featured", False)
-                        if "featured_rank" not in p:
-                            p["featured_rank"] = cur.get("featured_rank", "")
-                        if "cta" not in p:
-                            p["cta"] = cur.get("cta", "Узнать цену")
-
-                        for k in ("cargo","outreach","sections","control"):
-                            if k not in p and k in cur:
-                                p[k] = cur.get(k)
-
-                        normalize_product(p)
-                        p["featured"] = bool(p.get("featured", False))
-                        p["featured_rank"] = (p.get("featured_rank") or "").strip()
-                        prods[i] = p
-                        found = True
-                        break
-                if not found:
-                    return self._json(404, {"ok": False, "error": "not found"})
-                write_json_atomic(PRODUCTS_JSON, prods)
-                rebuild_static()
-                return self._json(200, {"ok": True})
-
-            if action == "delete":
-                pid = payload.get("id")
-                if not pid:
-                    return self._json(400, {"ok": False, "error": "id required"})
-                prods2 = [x for x in prods if x.get("id")!=pid]
-                write_json_atomic(PRODUCTS_JSON, prods2)
-                rebuild_static()
-                return self._json(200, {"ok": True})
-
-            return self._json(400, {"ok": False, "error": "unknown action"})
+            with _products_lock:
+                action = payload.get("action")
+
+                if action == "create":
+                    p = payload.get("product") or {}
+                    new_id = new_product_id()
+                    p["id"] = new_id
+                    normalize_product(p)
+                    p["featured"] = bool(p.get("featured", False))
+                    p["featured_rank"] = (p.get("featured_rank") or "").strip()
+
+                    product_store.create(p)
+                    ticket = rebuild_queue.submit("products:create")
+                    return self._json(200, {"ok": True, "id": new_id, "rebuild_ticket": ticket})
+
+                if action == "update":
+                    p = payload.get("product") or {}
+                    pid = p.get("id")
+                    if not pid:
+                        return self._json(400, {"ok": False, "error": "id required"})
+                    cur = product_store.get(pid)
+                    if cur is None:
+                        return self._json(404, {"ok": False, "error": "not found"})
+                    merge_product_update(p, cur)
+                    if not product_store.update(p):
+                        return self._json(404, {"ok": False, "error": "not found"})
+                    ticket = rebuild_queue.submit("products:update")
+                    return self._json(200, {"ok": True, "rebuild_ticket": ticket})
+
+                if action == "delete":
+                    pid = payload.get("id")
+                    if not pid:
+                        return self._json(400, {"ok": False, "error": "id required"})
+                    product_store.delete(pid)
+                    ticket = rebuild_queue.submit("products:delete")
+                    return self._json(200, {"ok": True, "rebuild_ticket": ticket})
+
+                return self._json(400, {"ok": False, "error": "unknown action"})
 
         return self._json(404, {"ok": False, "msg": "Not found"})
 
@@ -1475,11 +4912,13 @@ def run():
     os.chdir(BASE_DIR)
     ensure_products_seed()
     ensure_leads_csv()
+    lead_outbox.start()  # notifications a previous run did not deliver
 
     try:
         rebuild_static()
     except Exception:
         pass
+    threading.Thread(target=catalog_index, daemon=True).start()
 
     port = int(os.getenv("PORT", "8000"))
     httpd = ThreadingHTTPServer(("0.0.0.0", port), Handler)
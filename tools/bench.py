@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк горячих путей на синтетическом каталоге: rebuild_static, normalize_products_list,
+GET /api/public/products (весь список и страницы с фильтрами) и parse_leads. Каждый замер идёт в отдельном процессе
+над временной копией сайта (server.py + assets), пиковая память — ru_maxrss процесса.
+Хранилище товаров задаётся как у сервера: PRODUCTS_BACKEND=sqlite python tools/bench.py ...
+Результат — JSON, который можно сравнить с прогоном на другом коммите (--compare).
+Запуск:
+  python tools/bench.py                          # 1k, 10k, 100k товаров + 100k лидов
+  python tools/bench.py --sizes 1000,10000 --leads 200000 --out bench.json
+  python tools/bench.py --compare bench-results/old.json
+"""
+
+import argparse, csv, json, os, platform, random, shutil, subprocess, sys, tempfile, time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BRANDS = {
+    "Palfinger": ["PK 12502", "PK 15500", "PK 17502", "PK 23500", "PK 29002"],
+    "Hiab": ["XS 144", "XS 166", "XS 211", "X-HiPro 232"],
+    "HMF": ["1430-K4", "1820-K3", "2020-K4", "2620-K5"],
+    "Fassi": ["F155A", "F190A.24", "F215A"],
+    "Ferrari": ["728", "1150"],
+    "Effer": ["135 2S", "175 4S"],
+}
+CITIES = ["Санкт-Петербург", "Москва", "Казань", "Екатеринбург", "Новосибирск", ""]
+STATUSES = ["В наличии", "Под заказ", "В пути", "Продано"]
+
+
+def synthetic_products(n: int, seed: int = 1, categories=("kmu", "kmu", "kmu", "kmu", "trailers")):
+    """Raw products in the shapes the admin/CSV import really produce (separate spec fields, specs text, image aliases)."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        brand = rnd.choice(list(BRANDS))
+        model = rnd.choice(BRANDS[brand])
+        cat = rnd.choice(categories)
+        pid = f"{cat}-{i:06d}"
+        cargo = f"до {rnd.choice([3, 5, 6.5, 7, 8, 10, 12])} т"
+        outreach = f"до {rnd.randint(8, 22)} м"
+        sections = str(rnd.randint(2, 8))
+        p = {
+            "id": pid,
+            "category": cat,
+            "brand": brand,
+            "model": model,
+            "year": str(rnd.randint(1998, 2024)),
+            "status": rnd.choice(STATUSES),
+            "price": rnd.choice(["Цена по запросу", "Договорная", f"{rnd.randint(15, 95) * 100000}"]),
+            "city": rnd.choice(CITIES),
+            "title": f"{brand} {model}",
+            "slug": f"{brand.lower()}-{model.lower().replace(' ', '-').replace('.', '')}-{pid}",
+            "short": f"Кран-манипулятор {brand} {model}, {rnd.choice(['отличное', 'хорошее', 'рабочее'])} состояние",
+            "description": "\n".join(
+                rnd.choice([
+                    "Пригнан из Европы, растаможен.",
+                    "Полный комплект документов, ПСМ.",
+                    "Возможна установка на ваше шасси.",
+                    "Гидравлика без течей, проверено на стенде.",
+                    "Доставка по РФ, лизинг.",
+                ]) for _ in range(rnd.randint(1, 4))
+            ),
+            "cta": "Узнать цену",
+            "featured": rnd.random() < 0.05,
+        }
+        r = rnd.random()
+        if r < 0.5:
+            p.update({"cargo": cargo, "outreach": outreach, "sections": sections, "control": rnd.choice(["пульт", "ручное", "радио"])})
+        elif r < 0.85:
+            p["specs"] = f"Грузоподъемность: {cargo}\nВылет: {outreach}\nСекций: {sections}\nГрузовой момент: {rnd.randint(10, 30)} т·м"
+        imgs = [f"/assets/uploads/{cat}/{p['slug']}-{k}.jpg" for k in range(rnd.randint(1, 10))]
+        r = rnd.random()
+        if r < 0.6:
+            p["images"] = imgs
+            p["image"] = imgs[0]
+        elif r < 0.8:
+            p["images"] = "|".join(imgs)
+        else:
+            p["image"] = imgs[0]
+            for k, im in enumerate(imgs[1:], start=2):
+                p[rnd.choice(["image", "img", "photo"]) + str(k)] = im
+        out.append(p)
+    return out
+
+
+def write_leads_csv(path: Path, rows: int, seed: int = 2):
+    rnd = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["ts", "ip", "lead_type", "page", "referer", "utm_json", "fields_json"])
+        for i in range(rows):
+            w.writerow([
+                f"2026-0{rnd.randint(1, 9)}-{rnd.randint(10, 28)}T{rnd.randint(10, 23)}:{rnd.randint(10, 59)}:00Z",
+                f"10.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}",
+                rnd.choice(["price", "lead", "pick", "call"]),
+                f"/catalog/kmu/item-{rnd.randint(1, 5000)}/",
+                "https://yandex.ru/",
+                json.dumps({"utm_source": rnd.choice(["yandex", "google", "avito"]), "utm_campaign": f"c{rnd.randint(1, 40)}"}),
+                json.dumps({"name": f"Клиент {i}", "phone": f"+7981{rnd.randint(1000000, 9999999)}", "message": "Интересует цена и наличие"}, ensure_ascii=False),
+            ])
+
+
+def make_site(tmp: Path, products: list, leads: int) -> Path:
+    """Minimal copy of the site the generator needs; server.py derives all paths from its own location."""
+    site = tmp / "site"
+    (site / "data").mkdir(parents=True)
+    shutil.copy2(ROOT / "server.py", site / "server.py")
+    shutil.copy2(ROOT / "translit.py", site / "translit.py")  # imported by server.py
+    for sub in ("css", "js"):
+        shutil.copytree(ROOT / "assets" / sub, site / "assets" / sub)
+    (site / "data" / "products.json").write_text(json.dumps(products, ensure_ascii=False, indent=2), encoding="utf-8")
+    if leads:
+        write_leads_csv(site / "leads" / "leads.csv", leads)
+    return site
+
+
+# ---------- child side: one case per process ----------
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _best_of(fn, repeat: int):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def _case_normalize(server, site: Path, args):
+    raw = json.loads((site / "data" / "products.json").read_text(encoding="utf-8"))
+    secs = _best_of(lambda: server.normalize_products_list(json.loads(json.dumps(raw))), args.repeat)
+    return {"seconds": secs}
+
+
+def _case_rebuild(server, site: Path, args):
+    out = {}
+    t = time.perf_counter()
+    out["full_stats"] = server.rebuild_static(full=True)
+    out["full_seconds"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    out["noop_stats"] = server.rebuild_static()
+    out["noop_seconds"] = time.perf_counter() - t
+
+    prods = server.product_store.products()
+    server.product_store.update(dict(prods[len(prods) // 2], price="1 234 567"))
+    t = time.perf_counter()
+    out["one_edit_stats"] = server.rebuild_static()
+    out["one_edit_seconds"] = time.perf_counter() - t
+    return out
+
+
+def _case_product_memory(server, site: Path, args):
+    """Heap held by the normalized catalog: plain dicts vs slotted Product objects (tracemalloc)."""
+    import gc, tracemalloc
+    text = (site / "data" / "products.json").read_text(encoding="utf-8")
+
+    def measure(build):
+        gc.collect()
+        tracemalloc.start()
+        obj = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return obj, size
+
+    dicts, dict_bytes = measure(lambda: server.normalize_products_list(json.loads(text)))
+    models, model_bytes = measure(lambda: [server.Product.from_dict(p) for p in server.normalize_products_list(json.loads(text))])
+    lossless = all(m.to_dict() == d and list(m.to_dict()) == list(d) for m, d in zip(models, dicts))
+    n = max(1, len(dicts))
+    return {
+        "dict_bytes": dict_bytes,
+        "model_bytes": model_bytes,
+        "dict_bytes_per_product": dict_bytes // n,
+        "model_bytes_per_product": model_bytes // n,
+        "ratio": round(model_bytes / max(1, dict_bytes), 3),
+        "lossless": lossless,
+    }
+
+
+def _case_crud_update(server, site: Path, args):
+    """Admin "update" path: merge + normalize one product and persist it through the store."""
+    prods = server.product_store.products()
+    picks = [dict(prods[(i * 7919) % len(prods)]) for i in range(args.requests)]
+    t = time.perf_counter()
+    for k, p in enumerate(picks):
+        p["price"] = str(1000000 + k)
+        server.normalize_product(p)
+        server.product_store.update(p)
+    secs = time.perf_counter() - t
+    return {"seconds": secs / len(picks), "updates": len(picks), "backend": server.product_store.backend.name}
+
+
+def _http_timings(server, paths, requests: int):
+    """Serves the site in-process; times `requests` GETs cycling through paths (the first one separately)."""
+    import threading
+    from urllib.request import Request, urlopen
+
+    httpd = server.ThreadingHTTPServer(("127.0.0.1", 0), server.Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+    times, size, first = [], 0, None
+    try:
+        for i in range(requests + 1):
+            t = time.perf_counter()
+            with urlopen(Request(base + paths[i % len(paths)]), timeout=600) as r:
+                size = max(size, len(r.read()))
+            if first is None:
+                first = time.perf_counter() - t  # cold: loads the catalog / builds the index
+            else:
+                times.append(time.perf_counter() - t)
+    finally:
+        httpd.shutdown()
+    times.sort()
+    return {
+        "requests": len(times),
+        "bytes": size,
+        "first_ms": first * 1000,
+        "mean_ms": sum(times) / len(times) * 1000,
+        "p50_ms": times[len(times) // 2] * 1000,
+        "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+    }
+
+
+def _case_public_products(server, site: Path, args):
+    return _http_timings(server, ["/api/public/products"], args.requests)
+
+
+def _case_public_query(server, site: Path, args):
+    """Filtered pages of /api/public/products (category, brand, year, q, sort, facet counts only)."""
+    from urllib.parse import quote
+    brand = quote(next(iter(BRANDS)))
+    paths = [
+        "/api/public/products?category=kmu",
+        f"/api/public/products?category=kmu&brand={brand}",
+        f"/api/public/products?category=kmu&brand={brand}&year=2018&sort=name_asc",
+        "/api/public/products?category=kmu&q=pk&sort=year_desc",
+        "/api/public/products?category=kmu&sort=updated_desc&cursor=240",
+        "/api/public/products?category=kmu&limit=0",
+    ]
+    return _http_timings(server, paths, args.requests * len(paths))
+
+
+def _case_public_search(server, site: Path, args):
+    """/api/public/search: a brand in Latin and in Cyrillic, brand + model code, a word in every product, a prefix."""
+    from urllib.parse import quote
+    brand = next(iter(BRANDS))
+    paths = [
+        f"/api/public/search?q={quote(brand)}",
+        f"/api/public/search?q={quote('палфингер')}",
+        f"/api/public/search?q={quote(brand + ' ' + BRANDS[brand][0])}",
+        f"/api/public/search?q={quote('кран')}",
+        f"/api/public/search?q={quote('кран-манипуля')}&category=kmu&cursor=48",
+    ]
+    return _http_timings(server, paths, args.requests * len(paths))
+
+
+def _case_feed_size(server, site: Path, args):
+    """Bytes (raw and gzip) and encode time of the whole-catalog feed: all fields vs ?fields= (the home/product
+    page cards), rows vs ?format=columns."""
+    import gzip
+    prods = server.product_store.products()
+    card = ("id", "category", "slug", "title", "name", "brand", "model", "year", "status",
+            "image", "images", "featured", "popular", "featured_rank")
+    out = {}
+    for name, fields, columnar in (("full", None, False), ("columns", None, True),
+                                   ("cards", card, False), ("cards_columns", card, True)):
+        body = b""
+        def encode():
+            nonlocal body
+            body = server.encode_feed(prods, fields, columnar)
+        secs = _best_of(encode, args.repeat)
+        out[name] = {"bytes": len(body), "gzip_bytes": len(gzip.compress(body, 6)), "encode_seconds": secs}
+    # what the browser used to download for the same cards
+    legacy = server.product_store.response()[0]
+    out["legacy"] = {"bytes": len(legacy), "gzip_bytes": len(gzip.compress(legacy, 6))}
+    return {"feed_gzip_bytes": out["cards_columns"]["gzip_bytes"], "variants": out}
+
+
+def _case_parse_leads(server, site: Path, args):
+    rows = []
+    secs = _best_of(lambda: rows.append(len(server.parse_leads())), args.repeat)
+    return {"seconds": secs, "rows": rows[-1]}
+
+
+CASES = {
+    "normalize": _case_normalize,
+    "rebuild": _case_rebuild,
+    "crud_update": _case_crud_update,
+    "product_memory": _case_product_memory,
+    "public_products": _case_public_products,
+    "public_query": _case_public_query,
+    "public_search": _case_public_search,
+    "feed_size": _case_feed_size,
+    "parse_leads": _case_parse_leads,
+}
+
+
+def run_child(args):
+    site = Path(args.site)
+    os.chdir(site)
+    sys.path.insert(0, str(site))
+    import server
+    result = CASES[args.case](server, site, args)
+    result["peak_rss_kb"] = _peak_rss_kb()
+    print(json.dumps(result, ensure_ascii=False))
+
+
+# ---------- parent side ----------
+
+def run_case(case: str, site: Path, args) -> dict:
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--child", case, "--site", str(site),
+           "--repeat", str(args.repeat), "--requests", str(args.requests)]
+    t = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
+    wall = time.perf_counter() - t
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1:] or ["failed"], "wall_seconds": wall}
+    res = json.loads(proc.stdout.strip().splitlines()[-1])
+    res["wall_seconds"] = wall
+    return res
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def headline(r: dict):
+    """The single number per case used by --compare."""
+    for key in ("full_seconds", "seconds", "p50_ms", "model_bytes", "feed_gzip_bytes"):
+        if key in r:
+            return key, r[key]
+    return None, None
+
+
+def compare(old_path: str, new: dict):
+    old = json.loads(Path(old_path).read_text(encoding="utf-8"))
+    idx = {(r["case"], r["n"]): r for r in old.get("results", [])}
+    print(f"\ncompare with {old_path} ({old.get('meta', {}).get('commit', '?')})")
+    for r in new["results"]:
+        o = idx.get((r["case"], r["n"]))
+        key, val = headline(r)
+        if not o or key is None or key not in o or not o[key]:
+            continue
+        print(f"  {r['case']:16} n={r['n']:<7} {key:13} {o[key]:10.4f} -> {val:10.4f}  x{val / o[key]:.2f}"
+              f"   rss {o.get('peak_rss_kb')} -> {r.get('peak_rss_kb')} KB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="1000,10000,100000", help="catalog sizes, comma separated")
+    ap.add_argument("--leads", type=int, default=100000, help="rows in the synthetic leads.csv")
+    ap.add_argument("--cases", default=",".join(CASES), help="subset of: " + ", ".join(CASES))
+    ap.add_argument("--rebuild-limit", type=int, default=10000,
+                    help="skip the rebuild case above this size (100k pages need several GB of disk)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--out", default="")
+    ap.add_argument("--compare", default="")
+    ap.add_argument("--child", default="", help=argparse.SUPPRESS)
+    ap.add_argument("--site", default="", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        args.case = args.child
+        return run_child(args)
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    cases = [c for c in args.cases.split(",") if c in CASES]
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": [],
+    }
+
+    for n in sizes:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{n}-") as tmp:
+            site = make_site(Path(tmp), synthetic_products(n), args.leads if "parse_leads" in cases else 0)
+            for case in cases:
+                if case == "parse_leads" and n != sizes[0]:
+                    continue  # leads do not depend on catalog size
+                if case == "rebuild" and n > args.rebuild_limit:
+                    report["results"].append({"case": case, "n": n, "skipped": f"n > --rebuild-limit {args.rebuild_limit}"})
+                    continue
+                res = run_case(case, site, args)
+                res.update({"case": case, "n": args.leads if case == "parse_leads" else n})
+                report["results"].append(res)
+                key, val = headline(res)
+                print(f"{case:16} n={res['n']:<7} {key or 'error'}={val if val is not None else res.get('error')}"
+                      f"  peak_rss={res.get('peak_rss_kb')} KB", flush=True)
+
+    out = Path(args.out) if args.out else ROOT / "bench-results" / f"bench-{report['meta']['commit'] or 'nogit'}-{int(time.time())}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"results -> {out}")
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Микро-бенчмарк рендера страниц: стоимость одной страницы товара/каталога.
+# "cold" — общие фрагменты (шапка, подвал, статичный JSON-LD) собираются заново
+# для каждой страницы, как было до компилированных шаблонов; "warm" — один раз за пересборку.
+# --against <путь к server.py> — замерить ещё и другую версию (например, из git show).
+# Запуск: python tools/bench_render.py [кол-во товаров] [--against old_server.py]
+
+import importlib.util, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import server  # noqa: E402
+from bench import synthetic_products  # noqa: E402
+
+def load_module(path: str):
+    spec = importlib.util.spec_from_file_location("server_against", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def per_page(mod, fn, items, cold: bool, repeat: int = 3) -> float:
+    """Best of `repeat` runs, µs per item."""
+    reset = getattr(mod, "reset_fragments", lambda: None)
+    best = None
+    for _ in range(repeat):
+        reset()
+        t = time.perf_counter()
+        for x in items:
+            if cold:
+                reset()
+            fn(x)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best / max(1, len(items)) * 1e6
+
+def bench(mod, raw, label: str):
+    prods = mod.normalize_products_list([dict(p) for p in raw])
+    extra = (mod.build_similar_index(prods),) if hasattr(mod, "build_similar_index") else ()
+    sample = prods[:min(len(prods), 500)]
+
+    rows = [
+        ("product page", lambda p: mod.render_product_page(p, prods, *extra), sample),
+        ("product card", mod.render_product_card, sample),
+        ("catalog page", lambda cat: mod.render_catalog_page(cat, prods), ["kmu"] * 5),
+    ]
+    print(f"[{label}] {len(prods)} products, µs per render")
+    print(f"{'':14} {'cold':>10} {'warm':>10}")
+    for name, fn, items in rows:
+        fn(items[0])  # warm up imports/regex caches
+        cold = per_page(mod, fn, items, cold=True)
+        warm = per_page(mod, fn, items, cold=False)
+        print(f"{name:14} {cold:10.1f} {warm:10.1f}")
+
+def main():
+    args = sys.argv[1:]
+    against = None
+    if "--against" in args:
+        i = args.index("--against")
+        against = args[i + 1]
+        del args[i:i + 2]
+    n = int(args[0]) if args else 1000
+    raw = synthetic_products(n, categories=("kmu",))
+
+    if against:
+        bench(load_module(against), raw, against)
+    bench(server, raw, "server.py")
+
+if __name__ == "__main__":
+    main()
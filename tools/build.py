@@ -3,18 +3,19 @@
 # Генератор JSON из data/products.csv.
 # Запуск: python tools/build.py
 
-import csv, json, re
+import csv, json, re, sys
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from translit import RU_TRANSLIT  # shared with the search in server.py
+
 DATA_CSV = ROOT / "data" / "products.csv"
 DATA_JSON = ROOT / "data" / "products.json"
 
 def ru_slugify(s: str) -> str:
     s = s.lower().strip()
-    tr = {"а":"a","б":"b","в":"v","г":"g","д":"d","е":"e","ё":"e","ж":"zh","з":"z","и":"i","й":"y",
-          "к":"k","л":"l","м":"m","н":"n","о":"o","п":"p","р":"r","с":"s","т":"t","у":"u","ф":"f",
-          "х":"h","ц":"ts","ч":"ch","ш":"sh","щ":"sch","ъ":"","ы":"y","ь":"","э":"e","ю":"yu","я":"ya"}
+    tr = RU_TRANSLIT
     out=[]
     for ch in s:
         if ch.isalnum(): out.append(tr.get(ch,ch))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Проверка пула SMTP-сессий (SmtpPool) и дайджеста заявок на локальной заглушке SMTP (stdlib, без сети):
+# переиспользование сессии, NOOP keepalive и закрытие простаивающих, переподключение после обрыва,
+# ответ 5xx без повтора, лимит SMTP_POOL_SIZE и склейка заявок в одно письмо (LEAD_EMAIL_DIGEST_SECONDS).
+# Запуск: python tools/smtp_check.py          (код выхода 1, если хоть одна проверка не прошла)
+
+import smtplib, socket, socketserver, sys, tempfile, threading, time, traceback
+from email.parser import BytesParser
+from email.policy import default as email_default_policy
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import server  # noqa: E402
+
+
+class _StubSession(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        stub = self.server
+        with stub.lock:
+            stub.connects += 1
+            stub.open.add(self.connection)
+        try:
+            self._reply("220 stub ESMTP")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                verb = line[:4].decode("ascii", "replace").upper()
+                if verb == "NOOP":
+                    with stub.lock:
+                        stub.noops += 1
+                    self._reply("250 ok")
+                elif verb in ("EHLO", "HELO", "MAIL", "RCPT", "RSET"):
+                    self._reply("250 ok")
+                elif verb == "DATA":
+                    self._reply("354 end with .")
+                    data = []
+                    for chunk in iter(self.rfile.readline, b""):
+                        if chunk == b".\r\n":
+                            break
+                        data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                    time.sleep(stub.data_delay)
+                    with stub.lock:
+                        reject = stub.reject_next > 0
+                        stub.reject_next -= reject
+                        if not reject:
+                            stub.messages.append(b"".join(data))
+                    self._reply("554 rejected by stub" if reject else "250 queued")
+                elif verb == "QUIT":
+                    with stub.lock:
+                        stub.quits += 1
+                    self._reply("221 bye")
+                    return
+                else:
+                    self._reply("502 not implemented")
+        except OSError:
+            pass  # dropped by drop_all()
+        finally:
+            with stub.lock:
+                stub.open.discard(self.connection)
+
+
+class StubSmtp(socketserver.ThreadingTCPServer):
+    """Just enough SMTP for smtplib (no STARTTLS, no AUTH); counts what the client did."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubSession)
+        self.port = self.server_address[1]
+        self.lock = threading.Lock()
+        self.connects = self.noops = self.quits = self.reject_next = 0
+        self.data_delay = 0.0
+        self.open = set()
+        self.messages = []
+        threading.Thread(target=self.serve_forever, name="smtp-stub", daemon=True).start()
+
+    def drop_all(self):
+        """Closes every session server-side, like a provider's idle timeout."""
+        with self.lock:
+            conns = list(self.open)
+        for c in conns:
+            try:
+                c.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def open_count(self) -> int:
+        with self.lock:
+            return len(self.open)
+
+
+def _connect(stub: StubSmtp):
+    def connect():
+        s = smtplib.SMTP("127.0.0.1", stub.port, timeout=5)
+        s.ehlo()
+        return s
+    return connect
+
+def _send(pool, n: int = 1):
+    for i in range(n):
+        pool.sendmail("site@example.test", ["leads@example.test"], f"Subject: t{i}\r\n\r\nbody {i}\r\n")
+
+def _settle(cond, timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def check_reuse(stub):
+    pool = server.SmtpPool(_connect(stub), size=2, keepalive=60)
+    _send(pool, 3)
+    st = pool.stats()
+    assert stub.connects == 1 and len(stub.messages) == 3, (stub.connects, len(stub.messages))
+    assert st["connects"] == 1 and st["reused"] == 2 and st["idle"] == 1, st
+
+def check_keepalive(stub):
+    pool = server.SmtpPool(_connect(stub), size=2, keepalive=0.1, idle_max=60)
+    _send(pool)
+    assert _settle(lambda: stub.noops >= 2), stub.noops
+    _send(pool)
+    assert stub.connects == 1 and pool.stats()["reused"] == 1, (stub.connects, pool.stats())
+    # a session the server dropped fails its NOOP and leaves the pool
+    stub.drop_all()
+    assert _settle(lambda: pool.stats()["idle"] == 0), pool.stats()
+
+def check_idle_max(stub):
+    pool = server.SmtpPool(_connect(stub), size=2, keepalive=0.1, idle_max=0.25)
+    _send(pool)
+    assert _settle(lambda: pool.stats()["closed_idle"] == 1), pool.stats()
+    assert pool.stats()["idle"] == 0 and _settle(lambda: stub.quits == 1), (pool.stats(), stub.quits)
+    # the keepalive thread exits with an empty pool and comes back with the next session
+    _send(pool)
+    assert _settle(lambda: pool.stats()["noops"] >= 1), pool.stats()
+
+def check_reconnect(stub):
+    pool = server.SmtpPool(_connect(stub), size=2, keepalive=60)
+    _send(pool)
+    stub.drop_all()
+    assert _settle(lambda: stub.open_count() == 0)
+    _send(pool)
+    st = pool.stats()
+    assert len(stub.messages) == 2 and stub.connects == 2, (len(stub.messages), stub.connects)
+    assert st["reconnects"] == 1 and st["idle"] == 1, st
+
+def check_reject_not_retried(stub):
+    pool = server.SmtpPool(_connect(stub), size=2, keepalive=60)
+    _send(pool)
+    stub.reject_next = 1
+    try:
+        _send(pool)
+    except smtplib.SMTPDataError as e:
+        assert e.smtp_code == 554, e
+    else:
+        raise AssertionError("5xx reply did not reach the caller")
+    st = pool.stats()
+    # no second handshake and no second copy of the rejected message
+    assert st["reconnects"] == 0 and stub.connects == 1 and len(stub.messages) == 1, (st, stub.connects)
+
+def check_pool_size(stub):
+    pool = server.SmtpPool(_connect(stub), size=2, keepalive=60)
+    stub.data_delay = 0.2  # all six are in flight at once
+    threads = [threading.Thread(target=_send, args=(pool,)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stub.data_delay = 0.0
+    assert stub.connects == 6 and len(stub.messages) == 6, (stub.connects, len(stub.messages))
+    assert pool.stats()["idle"] == 2 and _settle(lambda: stub.open_count() == 2), (pool.stats(), stub.open_count())
+    _send(pool, 2)
+    assert stub.connects == 6, stub.connects
+    # size=0: a connection per message, nothing kept
+    nopool = server.SmtpPool(_connect(stub), size=0, keepalive=60)
+    _send(nopool, 2)
+    assert stub.connects == 8 and nopool.stats()["idle"] == 0, (stub.connects, nopool.stats())
+
+def check_digest(stub):
+    server.SMTP_HOST, server.SMTP_PORT, server.SMTP_USER, server.SMTP_PASS = "127.0.0.1", stub.port, "", ""
+    server.SMTP_FROM, server.SMTP_TO = "site@example.test", "leads@example.test"
+    server.smtp_pool = server.SmtpPool(server.smtp_connect, size=2, keepalive=60)
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = server.LeadOutbox(Path(tmp) / "outbox", Path(tmp) / "dead.jsonl",
+                                   {"email": lambda subject, text: server.send_email(subject, text)},
+                                   workers=2, digest_senders={"email": server.send_email_digest},
+                                   digest_window=0.3)
+        for i in range(5):
+            outbox.enqueue(f"Заявка {i}", f"лид {i}", channels=["email"])
+        assert outbox.wait_idle(5), outbox.status()
+        st = outbox.status()
+    assert st["sent"] == 5 and st["digests"] == 1, st
+    assert len(stub.messages) == 1 and stub.connects == 1, (len(stub.messages), stub.connects)
+    msg = BytesParser(policy=email_default_policy).parsebytes(stub.messages[0])
+    body = msg.get_content()
+    assert "(5)" in msg["Subject"] and all(f"лид {i}" in body for i in range(5)), (msg["Subject"], body)
+
+
+CHECKS = [check_reuse, check_keepalive, check_idle_max, check_reconnect,
+          check_reject_not_retried, check_pool_size, check_digest]
+
+def main():
+    failed = 0
+    for check in CHECKS:
+        stub = StubSmtp()
+        try:
+            check(stub)
+            print(f"ok    {check.__name__}")
+        except Exception:
+            failed += 1
+            print(f"FAIL  {check.__name__}")
+            traceback.print_exc()
+        finally:
+            stub.shutdown()
+            stub.server_close()
+    print(f"{len(CHECKS) - failed}/{len(CHECKS)} passed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()